@@ -0,0 +1,29 @@
+"""Building blocks for the SET pupillometry time-course pipeline.
+
+SET_TimeCourse.py drives these modules; they can also be imported on their
+own (e.g. from a notebook) to run a single stage on one subject. The
+functions below (see setpupil/api.py) take a Config instead of the globals
+of the script, and ``python -m setpupil`` runs the whole pipeline.
+
+The functions are loaded from setpupil.api the first time one of them is
+used, so ``python -m setpupil.<module>`` does not import every module of
+the package before running its own.
+"""
+
+__all__ = [
+    'Config', 'list_subjects', 'load_subject', 'label_windows', 'bin_samples',
+    'compute_trial_metrics', 'process_subject', 'process_cohort', 'trial_index', 'load_trial',
+    'profile_sampling', 'stream_trials', 'parameter_grid', 'sweep_cohort', 'compare_time_courses',
+    'epoch_subject', 'epoch_cohort', 'correct_baselines',
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        from setpupil import api
+        return getattr(api, name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,151 @@
+import argparse
+import os
+
+from setpupil import writer
+from setpupil.windows import loadSchedule
+from setpupil.api import Config, list_subjects, process_cohort, parameter_grid, sweep_cohort
+
+########################################################################################################
+#########################################  Command line  ###############################################
+########################################################################################################
+# python -m setpupil --input DIR --output TS.tsv [--summary SUMMARY.tsv] [--jobs N] [parameters]
+# Same pipeline as SET_TimeCourse.py, with the parameters on the command line instead of in the script.
+# With --sweep-time-round-to/--sweep-rolling/--sweep-window-size every combination of the values is run in one go
+# (see setpupil/sweep.py), the output files get the parameters in their name (e.g. ts_t50_roll0_w100.tsv).
+########################################################################################################
+
+
+#Summary path used when --summary is not given: next to the time series, e.g. ts.tsv -> ts_summary.tsv
+def defaultSummaryPath(tsPath):
+    stem, extension = os.path.splitext(tsPath)
+    return stem + '_summary' + (extension or '.tsv')
+
+
+#--time-round-to: a number of ms or 'auto'
+def binWidth(text):
+    if text == 'auto':
+        return text
+    try:
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r is not a number of ms or 'auto'" % text)
+
+
+#--sweep-*: comma separated values, each one read with parse
+def valueList(parse):
+    def parseList(text):
+        return [parse(value) for value in text.split(',') if value != '']
+    return parseList
+
+
+#--sweep-rolling: 0/1 (or no/yes)
+def onOff(text):
+    if text.lower() in ('1', 'yes', 'true', 'on'):
+        return True
+    if text.lower() in ('0', 'no', 'false', 'off'):
+        return False
+    raise argparse.ArgumentTypeError('%r is not 0 or 1' % text)
+
+
+def parseArgs(argv=None):
+    defaults = Config()
+    parser = argparse.ArgumentParser(prog='python -m setpupil',
+                                     description='Calculate the SET pupil time courses (TEPR/IEPR) of every subject file')
+    parser.add_argument('--input', required=True, help='directory with the subject files (*.tsv)')
+    parser.add_argument('--output', required=True, help='time series file')
+    parser.add_argument('--summary', help='trial summary file (default: <output>_summary)')
+    parser.add_argument('--jobs', type=int, default=defaults.jobs,
+                        help='number of subjects processed in parallel (default %d)' % defaults.jobs)
+    parser.add_argument('--format', default=defaults.output_format, choices=['tsv'] + writer.COLUMNAR_FORMATS,
+                        help='output format (default %s)' % defaults.output_format)
+    parser.add_argument('--no-avg-same-time', dest='avg_same_time', action='store_false', default=defaults.avg_same_time,
+                        help='do not average the rows of the same time bin (AVG_SAME_TIME)')
+    parser.add_argument('--time-round-to', type=binWidth, default=defaults.time_round_to,
+                        help="size of the time bins in ms, or 'auto' for a size per subject from its sampling rate "
+                             "(default %s)" % defaults.time_round_to)
+    parser.add_argument('--rolling', action='store_true', default=defaults.rolling,
+                        help='use the rolling avg of the pupil data instead of the plain avg of the time bins')
+    parser.add_argument('--window-size', type=int, default=defaults.window_size,
+                        help='length of the rolling avg in ms (default %d)' % defaults.window_size)
+    parser.add_argument('--cache-dir', help='cache the subject results in this directory (default: no cache)')
+    parser.add_argument('--cache-max-mb', type=int, default=defaults.cache_max_mb,
+                        help='size limit of the cache (default %d)' % defaults.cache_max_mb)
+    parser.add_argument('--store-dir', help='keep the parsed subject files as binary columns in this directory '
+                                            '(default: parse the files every run)')
+    parser.add_argument('--filter-pupil', action='store_true', default=defaults.filter_pupil,
+                        help='the input files are raw exports: filter and interpolate the pupil data first '
+                             '(instead of filter_with_stat_report.R)')
+    parser.add_argument('--filter-se', type=float, default=defaults.filter_se,
+                        help='standard errors around the fit where pupil values are kept (default %s)' % defaults.filter_se)
+    parser.add_argument('--filter-num-points', type=int, default=defaults.filter_num_points,
+                        help='points of every local fit (default %d)' % defaults.filter_num_points)
+    parser.add_argument('--filter-max-interp', type=int, default=defaults.filter_max_interp,
+                        help='longest run of missing rows that is interpolated (default %d)' % defaults.filter_max_interp)
+    parser.add_argument('--filter-min-valid', type=float, default=defaults.filter_min_valid_percent,
+                        help='%% of valid eye data a subject needs to be filtered (default %(default)s)')
+    parser.add_argument('--trial-threshold', type=float,
+                        help='remove the trials with less than this %% of valid pupil data here '
+                             '(instead of Removetrialswithtoofewdatapoints.R)')
+    parser.add_argument('--manifest', help='keep a manifest of the subject files in this file (JSON): only new or changed '
+                                           'files are read to list them, and the largest subjects are processed first')
+    parser.add_argument('--subjects', type=valueList(str),
+                        help='only process these subjects (Subject column), e.g. 101,102')
+    parser.add_argument('--window-schedule', type=loadSchedule,
+                        help='JSON file with the window schedule of the task (default: the one of SET)')
+    parser.add_argument('--sampling-report', help='write the sampling rate and jitter of every subject to this file')
+    parser.add_argument('--condition-report',
+                        help='write the stats of the bias and encoding conditions of every subject and of the cohort '
+                             'to this file')
+    parser.add_argument('--condition-histograms', action='store_true',
+                        help='with --condition-report, also write the histogram of every condition')
+    parser.add_argument('--grand-average', help='write the cohort mean and SE time courses to this file')
+    parser.add_argument('--grand-average-by', type=valueList(str), default=defaults.grand_average_by,
+                        help='conditions of the grand average, e.g. SETornoSET,Category (default %s)'
+                             % ','.join(defaults.grand_average_by))
+    parser.add_argument('--grand-average-subjects', action='store_true',
+                        help='with --grand-average, also write the mean time courses of every subject')
+    parser.add_argument('--filter-stats', help='write the filter stats of every subject to this file (.csv)')
+    parser.add_argument('--sweep-time-round-to', type=valueList(binWidth),
+                        help='sweep: sizes of the time bins to run, e.g. 20,50,100 (one output per parameter set)')
+    parser.add_argument('--sweep-rolling', type=valueList(onOff), help='sweep: rolling avg off/on to run, e.g. 0,1')
+    parser.add_argument('--sweep-window-size', type=valueList(int),
+                        help='sweep: lengths of the rolling avg to run, e.g. 100,200')
+    parser.add_argument('--report', help='write the timing of every stage of every subject to this file (.json or .csv)')
+    parser.add_argument('--profile', help='run this subject file (name or path) under cProfile')
+    parser.add_argument('--profile-out', help='where the cProfile stats go (default: <subject file>.prof)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    config = Config(avg_same_time=args.avg_same_time, time_round_to=args.time_round_to, rolling=args.rolling,
+                    window_size=args.window_size, output_format=args.format, jobs=args.jobs,
+                    cache_dir=args.cache_dir, cache_max_mb=args.cache_max_mb, report_path=args.report,
+                    profile_subject=args.profile, profile_path=args.profile_out, store_dir=args.store_dir,
+                    filter_pupil=args.filter_pupil, filter_se=args.filter_se, filter_num_points=args.filter_num_points,
+                    filter_max_interp=args.filter_max_interp, filter_min_valid_percent=args.filter_min_valid,
+                    trial_threshold=args.trial_threshold, filter_stats_path=args.filter_stats,
+                    sampling_report_path=args.sampling_report, window_schedule=args.window_schedule,
+                    condition_report_path=args.condition_report, condition_histograms=args.condition_histograms,
+                    grand_average_path=args.grand_average, grand_average_by=args.grand_average_by,
+                    grand_average_subjects=args.grand_average_subjects, manifest_path=args.manifest)
+    summaryPath = args.summary or defaultSummaryPath(args.output)
+    for path in [args.output, summaryPath]:
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    sweeps = dict(time_round_to=args.sweep_time_round_to, rolling=args.sweep_rolling,
+                  window_size=args.sweep_window_size)
+    paths = list_subjects(args.input, args.subjects, config)
+    if any(values is not None for values in sweeps.values()):
+        ### every combination of the swept values, the other parameters as given ###
+        paramSets = parameter_grid(config, **sweeps)
+        results = sweep_cohort(paths, args.output, summaryPath, paramSets, config)
+        print('%d parameter sets: %s' % (len(results), ', '.join(results)))
+    else:
+        process_cohort(paths, args.output, summaryPath, config)
+    print('REALLY DONE')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,490 @@
+import functools
+import os
+
+import pandas as pd
+
+from setpupil import conditions, epochs, filtering, grandaverage, instrument, loader, manifest, permutation, sampling
+from setpupil import streaming, sweep, trials, writer
+from setpupil.cache import SubjectCache
+from setpupil.store import ColumnStore
+from setpupil.columns import NUM_COLUMNS, colTrialId, colCurrentObject, colTETTime, colRemoveTrials
+from setpupil.windows import calcWindowNames, makeSchedule
+from setpupil.binning import combineTimeBuckets
+from setpupil.metrics import computeTrialMetrics
+from setpupil.pipeline import processSubject, writeSubjects, binSubject, _orderedMap
+
+########################################################################################################
+#########################################  Library API  ################################################
+########################################################################################################
+# Entry points for code that calls the pipeline directly (notebooks, long running workers, benchmarks)
+# instead of running SET_TimeCourse.py. Nothing here reads module globals: the parameters that used to
+# be set at the top of SET_TimeCourse.py (AVG_SAME_TIME, TIME_ROUND_TO, ...) are fields of a Config.
+# The stages can be run one at a time on a subject:
+#   headers, frame = load_subject(path, config)
+#   windows = label_windows(frame, config)
+#   index = trial_index(frame, windows)
+#   bins = bin_samples(frame, windows, config)
+#   metrics = compute_trial_metrics(frame, windows, pupil_avg_roll, config)
+# or all at once with process_subject(path, config) / process_cohort(paths, ts_path, summary_path, config).
+# stream_trials(lines, config) gives the summary of every trial of a session that is still being recorded.
+# sweep_cohort(paths, ts_path, summary_path, param_sets, config) runs several parameter sets at once.
+# list_subjects(input_dir, subjects, config) lists the subject files (or the ones of some subjects) with the
+# manifest of config.manifest_path (see setpupil/manifest.py).
+# compare_time_courses(subject_means, ...) runs a cluster-based permutation test on the subject means of the
+# grand average (config.grand_average_subjects).
+# epoch_subject(path, config) gives the time bins of a subject as a trials x cells array, and
+# correct_baselines(epochs, baselines, config) several baseline corrections of it at once.
+########################################################################################################
+
+
+#Parameters of a run, same defaults as SET_TimeCourse.py
+#   avg_same_time:  AVG_SAME_TIME, create time bins before any calculations
+#   time_round_to:  TIME_ROUND_TO, size of the time bins in ms (not 0), or 'auto' for a size per subject that
+#                   suits its sampling rate (see setpupil/sampling.py)
+#   rolling:        ROLLING, use the rolling avg instead of the plain avg of the time bins
+#   window_size:    WINDOW_SIZE, length of the rolling avg in ms
+#   output_columns: input columns written to the time series (settings.columns), every column if None
+#   output_format:  'tsv' or one of writer.COLUMNAR_FORMATS
+#   jobs:           number of subjects processed in parallel
+#   cache_dir:      directory of the subject cache (setpupil/cache.py), no cache if None
+#   cache_max_mb:   size limit of the cache
+#   store_dir:      directory of the column store (setpupil/store.py), the files are parsed every run if None
+#   report_path:    run report with the timing of every stage of every subject (.json or .csv), none if None
+#   profile_subject: subject file (name or path) to run under cProfile, stats written to profile_path
+#   filter_pupil:   the files are raw exports: filter and interpolate their pupil data first (setpupil/filtering.py)
+#                   with filter_se, filter_num_points, filter_max_interp, filter_min_valid_percent (se, numPoints,
+#                   max.interp and min.percent.of.valid.data of filter_with_stat_report.R)
+#   trial_threshold: trial.threshold of Removetrialswithtoofewdatapoints.R: remove_trial is made here from
+#                   interp_av_pupil without the trials with less valid data (in %); None uses remove_trial of the
+#                   files (with filter_pupil, no trials are removed then)
+#   sampling_report_path: sampling rate, jitter and dropped samples of every subject (.csv or .tsv), none if None
+#   filter_stats_path: stats of the filter and of the removed trials of every subject (CSV, see
+#                   filtering.writeFilterStats), none if None
+#   condition_report_path: count, mean, variance, min and max of the pupil values of the bias and encoding windows
+#                   by condition, for every subject and for the cohort (see setpupil/conditions.py), none if None
+#   condition_histograms: also write the histogram of every condition (<condition_report_path>_histogram)
+#   grand_average_path: cohort mean and SE time courses of TEPR/TEPR_fix/IEPR by grand_average_by (names of
+#                   grandaverage.TIMECOURSE_FIELDS), Window and WindowTimeNormalized, folded in as the subjects finish
+#                   (see setpupil/grandaverage.py; needs avg_same_time), none if None
+#   grand_average_subjects: also write the mean of every subject (<grand_average_path>_subjects)
+#   window_schedule: windows of the trials: a windows.WindowSchedule, the objects of one (CurrentObject -> [(ms since
+#                   the object started, window)], like windows.SET_SCHEDULE) or a dict with the objects and the other
+#                   parameters of WindowSchedule; the schedule of SET if None
+#   manifest_path:  manifest of the subject files (JSON, see setpupil/manifest.py): list_subjects keeps it up to date and
+#                   can pick subjects by ID from it, and the workers get the largest files first; none if None (the
+#                   largest files by size still go first)
+class Config(object):
+
+    def __init__(self, avg_same_time=True, time_round_to=50, rolling=False, window_size=100, output_columns=None,
+                 output_format='tsv', jobs=1, cache_dir=None, cache_max_mb=2048, report_path=None, profile_subject=None,
+                 profile_path=None, store_dir=None, filter_pupil=False, filter_se=5, filter_num_points=80,
+                 filter_max_interp=50, filter_min_valid_percent=25, trial_threshold=None, filter_stats_path=None,
+                 sampling_report_path=None, window_schedule=None, condition_report_path=None,
+                 condition_histograms=False, grand_average_path=None, grand_average_by=('SETornoSET',),
+                 grand_average_subjects=False, manifest_path=None):
+        if time_round_to != 'auto' and not time_round_to > 0:
+            raise ValueError("time_round_to has to be > 0 or 'auto' (got %r)" % (time_round_to,))
+        if output_format != 'tsv' and output_format not in writer.COLUMNAR_FORMATS:
+            raise ValueError('unknown output format %r' % output_format)
+        if output_columns is None:
+            output_columns = dict.fromkeys(range(NUM_COLUMNS), True)
+        if grand_average_path is not None and not avg_same_time:
+            raise ValueError('the grand average needs the time bins (avg_same_time)')
+
+        self.avg_same_time = avg_same_time
+        self.time_round_to = time_round_to
+        self.rolling = rolling
+        self.window_size = window_size
+        self.output_columns = output_columns
+        self.output_format = output_format
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        self.cache_max_mb = cache_max_mb
+        self.report_path = report_path
+        self.profile_subject = profile_subject
+        self.profile_path = profile_path
+        self.store_dir = store_dir
+        self.filter_pupil = filter_pupil
+        self.filter_se = filter_se
+        self.filter_num_points = filter_num_points
+        self.filter_max_interp = filter_max_interp
+        self.filter_min_valid_percent = filter_min_valid_percent
+        self.trial_threshold = trial_threshold
+        self.filter_stats_path = filter_stats_path
+        self.sampling_report_path = sampling_report_path
+        self.window_schedule = makeSchedule(window_schedule)
+        self.condition_report_path = condition_report_path
+        self.condition_histograms = condition_histograms
+        self.grand_average_path = grand_average_path
+        self.grand_average_by = list(grand_average_by)
+        self.grand_average_subjects = grand_average_subjects
+        self.manifest_path = manifest_path
+        #checks the fields
+        grandaverage.GrandAverage(self.grand_average_by)
+
+    #Keyword arguments of processSubject/writeSubjects
+    def params(self):
+        return dict(avgSameTime=self.avg_same_time, timeRoundTo=self.time_round_to, rolling=self.rolling,
+                    windowSize=self.window_size, outputColumns=self.output_columns, pupilFilter=self.pupilFilter(),
+                    trialThreshold=self.trial_threshold, schedule=self.window_schedule)
+
+    #Format that will actually be written ('columnar' becomes parquet or npz, see writer.resolveFormat)
+    def resolvedFormat(self):
+        if self.output_format == 'tsv':
+            return 'tsv'
+        return writer.resolveFormat(self.output_format)
+
+    #SubjectCache of the run, None without cache_dir
+    def cache(self):
+        if self.cache_dir is None:
+            return None
+        return SubjectCache(self.cache_dir, self.cache_max_mb * 1024 * 1024)
+
+    #ProfileHook of the run, None without profile_subject
+    def profile(self):
+        if self.profile_subject is None:
+            return None
+        return instrument.ProfileHook(self.profile_subject, self.profile_path)
+
+    #ColumnStore of the run, None without store_dir
+    def store(self):
+        if self.store_dir is None:
+            return None
+        return ColumnStore(self.store_dir)
+
+    #GrandAverage of the run, None without grand_average_path
+    def grandAverage(self):
+        if self.grand_average_path is None:
+            return None
+        return grandaverage.GrandAverage(self.grand_average_by, self.grand_average_subjects)
+
+    #PupilFilter of the run, None without filter_pupil
+    def pupilFilter(self):
+        if not self.filter_pupil:
+            return None
+        return filtering.PupilFilter(self.filter_se, self.filter_num_points, self.filter_max_interp,
+                                     self.filter_min_valid_percent)
+
+    #Manifest of the subject files, None without manifest_path
+    def manifest(self):
+        if self.manifest_path is None:
+            return None
+        return manifest.Manifest(self.manifest_path)
+
+
+#Subject files (*.tsv) of a directory, sorted so the output is always in the same order
+#subjects picks the files of some subjects (values of their Subject column) instead of all of them: the first row of
+#every file is read, or with config.manifest_path only of the files that are new or changed since the last run (see
+#manifest.Manifest.select); the manifest is brought up to date with the files that were read
+def list_subjects(input_dir, subjects=None, config=None):
+    config = config or Config()
+    inputManifest = config.manifest()
+    if inputManifest is None:
+        paths = [path for path, stat in manifest.scanInputs(input_dir)]
+        if subjects is None:
+            return paths
+        wanted = set(str(subject) for subject in subjects)
+        return [path for path in paths if manifest.readSubject(path) in wanted]
+
+    if subjects is None:
+        paths = inputManifest.update(input_dir)
+    else:
+        paths = inputManifest.select(input_dir, subjects)
+    inputManifest.save()
+    return paths
+
+
+#Work of every file of paths for the scheduler: its rows from config.manifest_path, its size without a manifest
+#None with a single job (the files are processed in order anyway)
+def _workSizes(paths, config):
+    if config.jobs <= 1:
+        return None
+    inputManifest = config.manifest()
+    if inputManifest is None:
+        return [os.path.getsize(path) for path in paths]
+    rows = inputManifest.rows(paths)
+    inputManifest.save()
+    return rows
+
+
+#Reads a subject file (and filters its pupil data with config.filter_pupil, removes its trials with
+#config.trial_threshold) and keeps its experiment rows (see loader.experimentRows)
+#Returns (header names of the file, data frame labeled by column number)
+def load_subject(path, config=None):
+    config = config or Config()
+    usecols = loader.columnsToRead(config.output_columns)
+    pupilFilter = config.pupilFilter()
+    if pupilFilter is not None:
+        usecols = sorted(set(usecols).union(filtering.FILTER_COLUMNS))
+    store = config.store()
+    if store is not None:
+        headers, frame = store.read(path, usecols)
+    else:
+        headers, frame = loader.readTobiiExport(path, usecols)
+    if pupilFilter is not None:
+        headers, frame = pupilFilter.apply(headers, frame)[:2]
+    if config.trial_threshold is not None or pupilFilter is not None:
+        headers, frame = filtering.removeTrials(headers, frame, config.trial_threshold or 0)[:2]
+    return headers, loader.experimentRows(frame)
+
+
+#Window code of every row of a subject (see windows.windowLabels for the names, '' for rows that are not in a window)
+def label_windows(frame, config=None):
+    config = config or Config()
+    return calcWindowNames(frame[colCurrentObject], frame[colTrialId], frame[colTETTime], config.window_schedule)
+
+
+#Row ranges of the trials of a subject and of their window segments (see setpupil/trials.py)
+#e.g. frame.iloc[trial_index(frame, windows).rows(5)] are the rows of trial 5
+def trial_index(frame, windows=None):
+    return trials.buildTrialIndex(frame[colTrialId], windows)
+
+
+#Rows of one trial of a subject file, read without going through the rest of the file
+#The byte offsets of the trials are stored in config.store_dir (or config.cache_dir) the first time, if one is set
+#(see trials.exportTrialIndex)
+def load_trial(path, trial_id, config=None):
+    config = config or Config()
+    indexDir = config.store_dir if config.store_dir is not None else config.cache_dir
+    return trials.readTrial(path, trial_id, loader.columnsToRead(config.output_columns), indexDir=indexDir)
+
+
+#Bin size of a subject: config.time_round_to, or the one that suits its sampling rate if that is 'auto'
+def _timeRoundTo(frame, config):
+    timeRoundTo = config.time_round_to
+    if timeRoundTo == 'auto':
+        timeRoundTo = sampling.samplingProfile(frame[colTETTime], timeRoundTo)['time_round_to']
+    return timeRoundTo
+
+
+#Time bins of a subject, one row per bin (see binning.BIN_COLUMNS)
+def bin_samples(frame, windows, config=None):
+    config = config or Config()
+    timeRoundTo = _timeRoundTo(frame, config)
+    return combineTimeBuckets(frame[colTrialId], frame[colCurrentObject], frame[colTETTime], windows,
+                              frame[colRemoveTrials], timeRoundTo, config.window_size)
+
+
+#Sampling rate, interval distribution, dropped samples and jitter of a subject file, and how its samples fill
+#the time bins of config.time_round_to (see sampling.samplingProfile)
+def profile_sampling(path, config=None):
+    config = config or Config()
+    headers, frame = loader.readTobiiExport(path, [colTETTime])
+    profile = sampling.samplingProfile(frame[colTETTime], config.time_round_to)
+    profile['file'] = os.path.basename(path)
+    return profile
+
+
+#Metric columns and trial summary of a subject (see metrics.computeTrialMetrics)
+#frame, windows and pupil_avg_roll are the binned rows when config.avg_same_time is set
+def compute_trial_metrics(frame, windows, pupil_avg_roll, config=None):
+    config = config or Config()
+    return computeTrialMetrics(frame, windows, pupil_avg_roll, config.rolling, config.window_schedule)
+
+
+#Summary of every trial of a session as soon as the trial ends, while the session is still going (see
+#setpupil/streaming.py), e.g. for line in streaming.sourceLines('-')
+#lines are the lines of an export as they come in, header first
+#The pupil filter needs the whole session, so config.filter_pupil and config.trial_threshold cannot be used here
+def stream_trials(lines, config=None):
+    config = config or Config()
+    if config.filter_pupil or config.trial_threshold is not None:
+        raise ValueError('the pupil filter and the trial threshold need the whole session, they do not work on a stream')
+    return streaming.streamTrials(lines, avgSameTime=config.avg_same_time, timeRoundTo=config.time_round_to,
+                                  rolling=config.rolling, windowSize=config.window_size,
+                                  schedule=config.window_schedule)
+
+
+#Time bins of a subject file as a trials x cells array (see epochs.Epochs): a cell is a (Window, WindowTimeNormalized)
+#of the bins of config.time_round_to, its value the pupil (rolling avg with config.rolling) of the bin of the trial;
+#the bins are made whether config.avg_same_time is set or not
+def epoch_subject(path, config=None):
+    config = config or Config()
+    headers, frame = load_subject(path, config)
+    windows = label_windows(frame, config)
+    binned = binSubject(frame, windows, _timeRoundTo(frame, config), config.window_size)
+    return epochs.buildEpochs(frame, windows, binned, config.rolling, config.window_schedule)
+
+
+def _saveEpochs(path, directory, config):
+    subjectEpochs = epoch_subject(path, config)
+    epochPath = epochs.epochPath(directory, path)
+    subjectEpochs.save(epochPath)
+    return epochPath
+
+
+#Writes the epochs of every file of paths to directory (<file name>.epochs.npz, read them with epochs.loadEpochs),
+#on config.jobs worker processes (largest files first)
+#Returns the paths of the epoch files, in the order of paths
+def epoch_cohort(paths, directory, config=None):
+    config = config or Config()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = list(paths)
+    return list(_orderedMap(functools.partial(_saveEpochs, directory=directory, config=config), paths, config.jobs,
+                            _workSizes(paths, config)))
+
+
+#Baseline corrected arrays of epochs (epoch_subject or epochs.loadEpochs), all computed in one go:
+#{name: trials x cells array} for every epochs.Baseline of baselines, the ones of TEPR, TEPR_fix, IEPR, TEPR_ratio and
+#pretrial of config.window_schedule if None (see epochs.setBaselines)
+def correct_baselines(subject_epochs, baselines=None, config=None):
+    config = config or Config()
+    if baselines is None:
+        baselines = epochs.setBaselines(config.window_schedule)
+    return subject_epochs.correct(baselines)
+
+
+#Runs every stage on one subject
+#Returns (header names of the file, time series rows (text lines for tsv, a typed data frame otherwise), summary,
+#quality stats: sampling profile and stats of the filter stages (see pipeline.processSubject))
+def process_subject(path, config=None):
+    config = config or Config()
+    return processSubject(path, outputFormat=config.resolvedFormat(), store=config.store(), **config.params())
+
+
+#Processes every file of paths and writes the time series to ts_path and the summary to summary_path
+#With a columnar output_format the extension of both paths is replaced by the format (see writer.columnarPath)
+#With config.report_path the timing records of the run are written there, and the totals by stage are printed
+#With config.filter_stats_path the stats of the filter stages are written there (see filtering.writeFilterStats),
+#with config.sampling_report_path the sampling profile of every subject (see sampling.writeSamplingReport), with
+#config.condition_report_path the condition stats of every subject and of the cohort (see conditions.writeConditionReport),
+#with config.grand_average_path the cohort time courses (see grandaverage.writeGrandAverage)
+#With config.jobs > 1 the largest files are processed first (rows of config.manifest_path, or file sizes)
+#Returns the summary data frame
+def process_cohort(paths, ts_path, summary_path, config=None):
+    config = config or Config()
+    output_format = config.resolvedFormat()
+    if output_format != 'tsv':
+        ts_path = writer.columnarPath(ts_path, output_format)
+        summary_path = writer.columnarPath(summary_path, output_format)
+
+    report = []
+    qualityStats = []
+    grandAverage = config.grandAverage()
+    dfSUMMARY = writeSubjects(paths, ts_path, jobs=config.jobs, outputFormat=output_format, cache=config.cache(),
+                              profile=config.profile(), store=config.store(), report=report, qualityStats=qualityStats,
+                              grandAverage=grandAverage, sizes=_workSizes(paths, config), **config.params())
+
+    timer = instrument.StageTimer('', report)
+    timer.start('write_summary', len(dfSUMMARY))
+    if output_format == 'tsv':
+        dfSUMMARY.to_csv(summary_path, sep='\t')
+    else:
+        writer.writeColumnar(summary_path, writer.typedSummary(dfSUMMARY), output_format)
+    timer.stop(len(dfSUMMARY))
+
+    if config.filter_stats_path is not None:
+        filtering.writeFilterStats(config.filter_stats_path, qualityStats)
+    if config.sampling_report_path is not None:
+        sampling.writeSamplingReport(config.sampling_report_path, qualityStats)
+    if config.condition_report_path is not None:
+        conditions.writeConditionReport(config.condition_report_path, qualityStats, config.condition_histograms)
+    if grandAverage is not None:
+        grandaverage.writeGrandAverage(config.grand_average_path, grandAverage)
+
+    if config.report_path is not None:
+        instrument.writeReport(config.report_path, report)
+        print(instrument.stageTotals(report))
+    return dfSUMMARY
+
+
+#Parameter sets of a sweep: every combination of the given values of the Config fields, e.g.
+#parameter_grid(time_round_to=[20, 50, 100], rolling=[False, True]); the fields that are not given keep their value
+#of config
+def parameter_grid(config=None, avg_same_time=None, time_round_to=None, rolling=None, window_size=None):
+    config = config or Config()
+    grid = sweep.parameterGrid(
+        timeRoundTo=time_round_to if time_round_to is not None else [config.time_round_to],
+        rolling=rolling if rolling is not None else [config.rolling],
+        windowSize=window_size if window_size is not None else [config.window_size],
+        avgSameTime=avg_same_time if avg_same_time is not None else [config.avg_same_time])
+    return [dict(avg_same_time=params['avgSameTime'], time_round_to=params['timeRoundTo'], rolling=params['rolling'],
+                 window_size=params['windowSize']) for params in grid]
+
+
+#Processes every file of paths with every parameter set of param_sets (dicts of avg_same_time, time_round_to, rolling
+#and window_size, see parameter_grid) and writes the time series and summary of every parameter set next to ts_path
+#and summary_path, tagged with its parameters (see sweep.taggedPath)
+#Every subject is read, filtered and labeled once for all the parameter sets (see setpupil/sweep.py); the rest of
+#config is used as in process_cohort, but for the cache (a sweep does not use it)
+#The filter stats are written once, the sampling and condition reports and the grand average for every parameter set
+#(they depend on the time bins and the rolling avg; the parameter sets without time bins have no grand average)
+#Returns a dict: tag of the parameter set -> summary data frame
+def sweep_cohort(paths, ts_path, summary_path, param_sets, config=None):
+    config = config or Config()
+    output_format = config.resolvedFormat()
+    if output_format != 'tsv':
+        ts_path = writer.columnarPath(ts_path, output_format)
+        summary_path = writer.columnarPath(summary_path, output_format)
+
+    paramSets = []
+    for params in param_sets:
+        if params['time_round_to'] != 'auto' and not params['time_round_to'] > 0:
+            raise ValueError("time_round_to has to be > 0 or 'auto' (got %r)" % (params['time_round_to'],))
+        paramSets.append(dict(avgSameTime=params['avg_same_time'], timeRoundTo=params['time_round_to'],
+                              rolling=params['rolling'], windowSize=params['window_size']))
+    tags = [sweep.configTag(params) for params in paramSets]
+    if len(set(tags)) < len(tags):
+        raise ValueError('the parameter sets of a sweep have to be different')
+
+    report = []
+    qualityStats = []
+    grandAverages = [config.grandAverage() for params in paramSets]
+    summaries = sweep.writeSweep(paths, [sweep.taggedPath(ts_path, tag) for tag in tags], paramSets,
+                                 config.output_columns, jobs=config.jobs, outputFormat=output_format,
+                                 store=config.store(), report=report, pupilFilter=config.pupilFilter(),
+                                 trialThreshold=config.trial_threshold, qualityStats=qualityStats,
+                                 schedule=config.window_schedule, grandAverages=grandAverages,
+                                 sizes=_workSizes(paths, config))
+
+    results = {}
+    for tag, dfSUMMARY in zip(tags, summaries):
+        timer = instrument.StageTimer('[%s]' % tag, report)
+        timer.start('write_summary', len(dfSUMMARY))
+        if output_format == 'tsv':
+            dfSUMMARY.to_csv(sweep.taggedPath(summary_path, tag), sep='\t')
+        else:
+            writer.writeColumnar(sweep.taggedPath(summary_path, tag), writer.typedSummary(dfSUMMARY), output_format)
+        timer.stop(len(dfSUMMARY))
+        results[tag] = dfSUMMARY
+
+    if config.filter_stats_path is not None and qualityStats:
+        filtering.writeFilterStats(config.filter_stats_path, qualityStats[0])
+    if config.sampling_report_path is not None:
+        for tag, stats in zip(tags, qualityStats):
+            sampling.writeSamplingReport(sweep.taggedPath(config.sampling_report_path, tag), stats)
+    if config.condition_report_path is not None:
+        for tag, stats in zip(tags, qualityStats):
+            conditions.writeConditionReport(sweep.taggedPath(config.condition_report_path, tag), stats,
+                                            config.condition_histograms)
+    if config.grand_average_path is not None:
+        for tag, grandAverage in zip(tags, grandAverages):
+            grandaverage.writeGrandAverage(sweep.taggedPath(config.grand_average_path, tag), grandAverage)
+
+    if config.report_path is not None:
+        instrument.writeReport(config.report_path, report)
+        print(instrument.stageTotals(report))
+    return results
+
+
+#Cluster-based permutation test of the time courses of a measure (see setpupil/permutation.py)
+#subject_means are the subject means of the grand average (GrandAverage.subjectFrame, or the path of the
+#<grand_average_path>_subjects file); either two conditions of field (a paired sign flip test, e.g.
+#field='SETornoSET', conditions=['SET', 'noSET']) or groups, a dict Subject -> group with two groups (a label
+#permutation test, on the rows where field is condition if field is given)
+#The resamples run on config.jobs worker processes; the results only depend on seed
+#Returns (bin table: t, p, p_tmax and cluster p of every (Window, WindowTimeNormalized), cluster table)
+def compare_time_courses(subject_means, measure='TEPR', field=None, conditions=None, groups=None, condition=None,
+                         permutations=10000, threshold=None, alpha=0.05, seed=0, config=None):
+    config = config or Config()
+    if isinstance(subject_means, str):
+        subject_means = pd.read_csv(subject_means, sep=',' if subject_means.endswith('.csv') else '\t')
+    options = dict(numResamples=permutations, threshold=threshold, alpha=alpha, seed=seed, jobs=config.jobs)
+    if groups is not None:
+        matrix = permutation.subjectMatrix(subject_means, measure, field if condition is not None else None, condition)
+        return permutation.groupTest(matrix, groups, **options)
+    if field is None or conditions is None or len(conditions) != 2:
+        raise ValueError('a paired test needs a field and two conditions (or groups)')
+    return permutation.pairedTest(permutation.subjectMatrix(subject_means, measure, field, conditions[0]),
+                                  permutation.subjectMatrix(subject_means, measure, field, conditions[1]), **options)
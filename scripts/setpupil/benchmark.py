@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+from setpupil import synthetic, writer
+from setpupil.api import Config, load_subject, label_windows, compute_trial_metrics
+from setpupil.binning import combineTimeBuckets, loopBuckets
+from setpupil.columns import colTrialId, colCurrentObject, colTETTime, colRemoveTrials
+from setpupil.metrics import METRIC_COLUMNS, loopTrialMetrics
+from setpupil.pipeline import new_headers, newColumns, binSubject, timeSeriesLines
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+########################################################################################################
+#########################################  Benchmarks  #################################################
+########################################################################################################
+# python -m setpupil.benchmark [--rates 60 120 300] [--trials 20 60 120] [--json results.json]
+# Generates a synthetic subject (setpupil/synthetic.py) for every sampling rate x trial count and times
+# every stage of the pipeline on it: parse, windows (calcWindowNames), bins (combineTimeBuckets),
+# aggregate (computeTrialMetrics) and write (time series lines to disk).
+# Every stage is timed --repeat times (the best time counts) and then run once more under tracemalloc
+# for its peak memory, so the tracing does not slow down the timings.
+# With --compare, the throughput of every stage is checked against an earlier --json file and the run
+# fails if a stage got slower than --tolerance allows.
+# With --check, the mean and rolling avg of every time bin are checked against the old row loop
+# (binning.loopBuckets), and the metric columns and trial summary against the old passes
+# (metrics.loopTrialMetrics): they have to be the same to the last bit.
+########################################################################################################
+
+STAGES = ['parse', 'windows', 'bins', 'aggregate', 'write']
+
+
+#Runs function, returns (result, seconds)
+def _timed(function):
+    start = timeit.default_timer()
+    result = function()
+    return result, timeit.default_timer() - start
+
+
+#Peak memory (bytes) allocated while function runs, None without tracemalloc (python 2)
+def _peakMemory(function):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+#Functions that run the stages one after the other on the subject in path; every function takes the result
+#of the stage before it
+def _stages(path, config, outputPath):
+    def parse(previous):
+        return load_subject(path, config)
+
+    def windows(previous):
+        file_headers, frame = previous
+        return file_headers, frame, label_windows(frame)
+
+    def bins(previous):
+        file_headers, frame, windows = previous
+        return (file_headers,) + binSubject(frame, windows, config.time_round_to, config.window_size)
+
+    def aggregate(previous):
+        file_headers, frame, windows, rolling_avg, normalized_times = previous
+        new_columns = newColumns(windows, rolling_avg, normalized_times)
+        new_columns.update(compute_trial_metrics(frame, windows, rolling_avg, config)[0])
+        return file_headers, frame, new_columns
+
+    def write(previous):
+        file_headers, frame, new_columns = previous
+        lines = timeSeriesLines(frame, len(file_headers), config.output_columns, new_columns, True)
+        with writer.TimeSeriesWriter(outputPath, config.output_columns, new_headers) as tsWriter:
+            tsWriter.writeSubject(file_headers, lines)
+        return previous
+
+    return [parse, windows, bins, aggregate, write]
+
+
+#Benchmarks the stages on one subject file
+#Returns a result per stage: {'stage', 'samples', 'seconds', 'samples_per_s', 'peak_mb'}
+#samples is the number of experiment rows of the file (what every stage goes through, before the time bins)
+def benchmarkSubject(path, config, repeat=3):
+    handle, outputPath = tempfile.mkstemp(suffix='.tsv')
+    os.close(handle)
+    try:
+        results = []
+        previous = None
+        samples = None
+        for name, stage in zip(STAGES, _stages(path, config, outputPath)):
+            best = None
+            for n in range(repeat):
+                result, seconds = _timed(lambda: stage(previous))
+                best = seconds if best is None else min(best, seconds)
+            peak = _peakMemory(lambda: stage(previous))
+            previous = result
+            if samples is None:
+                samples = len(result[1])
+            results.append({
+                'stage' : name,
+                'samples' : samples,
+                'seconds' : best,
+                'samples_per_s' : samples / best if best > 0 else float('inf'),
+                'peak_mb' : None if peak is None else peak / 1024.0 / 1024.0,
+            })
+        return results
+    finally:
+        os.remove(outputPath)
+
+
+#Synthetic subject of a sampling rate and trial count in dataDir, generated the first time
+def _subjectPath(dataDir, rate, trials):
+    if not os.path.isdir(dataDir):
+        os.makedirs(dataDir)
+    path = os.path.join(dataDir, 'bench-%dhz-%dtrials.tsv' % (rate, trials))
+    if not os.path.exists(path):
+        synthetic.generateSubject(path, 101, samplingRate=rate, numTrials=trials)
+    return path
+
+
+#Benchmarks every sampling rate x trial count; the synthetic files are kept in dataDir and reused
+#Returns a list of results (see benchmarkSubject) with the 'rate' and 'trials' of the subject added
+def runBenchmarks(rates, trialCounts, dataDir, config, repeat=3):
+    results = []
+    for rate in rates:
+        for trials in trialCounts:
+            path = _subjectPath(dataDir, rate, trials)
+            for result in benchmarkSubject(path, config, repeat):
+                result['rate'] = rate
+                result['trials'] = trials
+                results.append(result)
+    return results
+
+
+#Values that are the same to the last bit (NaN matches NaN)
+def _sameBits(values, expected):
+    return (values == expected) | (np.isnan(values) & np.isnan(expected))
+
+
+#Checks the time bins of the subject in path against the old row loop (see binning.loopBuckets)
+#Returns (number of bins, number of bins whose mean or rolling avg differs)
+def checkBins(path, config):
+    file_headers, frame = load_subject(path, config)
+    arguments = (frame[colTrialId], frame[colCurrentObject], frame[colTETTime], label_windows(frame),
+                 frame[colRemoveTrials], config.time_round_to, config.window_size)
+    bins = combineTimeBuckets(*arguments)
+    means, rolling = loopBuckets(*arguments)
+    if len(means) != len(bins):
+        return len(means), len(means)
+    same = _sameBits(bins['PupilAvg'].values, means) & _sameBits(bins['PupilAvgRoll'].values, rolling)
+    return len(bins), int(np.count_nonzero(~same))
+
+
+#Checks the metric columns and trial summary of the subject in path against the old passes (see
+#metrics.loopTrialMetrics)
+#Returns (number of values, number of values that differ)
+def checkMetrics(path, config):
+    file_headers, frame = load_subject(path, config)
+    windows = label_windows(frame)
+    frame, windows, rolling_avg, normalized_times = binSubject(frame, windows, config.time_round_to, config.window_size)
+    new_columns, trialDataMap = compute_trial_metrics(frame, windows, rolling_avg, config)[:2]
+    expectedColumns, expectedMap = loopTrialMetrics(frame, windows, rolling_avg, config.rolling, config.window_schedule)
+
+    values = 0
+    differ = 0
+    for name in METRIC_COLUMNS:
+        values += len(frame)
+        differ += int(np.count_nonzero(~_sameBits(new_columns[name], expectedColumns[name])))
+    for trialId in set(trialDataMap) | set(expectedMap):
+        fields = trialDataMap.get(trialId, {})
+        expected = expectedMap.get(trialId, {})
+        for name in set(fields) | set(expected):
+            values += 1
+            differ += int(name not in fields or name not in expected or fields[name] != expected[name])
+    return values, differ
+
+
+def printResults(results):
+    print('%6s %7s %10s %10s %10s %14s %9s' % ('rate', 'trials', 'stage', 'samples', 'seconds', 'samples/s', 'peak MB'))
+    for result in results:
+        peak = '-' if result['peak_mb'] is None else '%.1f' % result['peak_mb']
+        print('%6d %7d %10s %10d %10.4f %14.0f %9s' % (result['rate'], result['trials'], result['stage'],
+                                                       result['samples'], result['seconds'], result['samples_per_s'],
+                                                       peak))
+
+
+#Stages whose throughput dropped more than tolerance (a fraction) compared to the baseline results
+#Returns a list of (rate, trials, stage, baseline samples/s, samples/s)
+def regressions(results, baseline, tolerance):
+    before = {}
+    for result in baseline:
+        before[(result['rate'], result['trials'], result['stage'])] = result['samples_per_s']
+
+    slower = []
+    for result in results:
+        key = (result['rate'], result['trials'], result['stage'])
+        if key in before and result['samples_per_s'] < before[key] * (1 - tolerance):
+            slower.append(key + (before[key], result['samples_per_s']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m setpupil.benchmark',
+                                     description='Time every stage of the pipeline on synthetic subjects')
+    parser.add_argument('--rates', type=int, nargs='+', default=[60, 120, 300], help='sampling rates in Hz')
+    parser.add_argument('--trials', type=int, nargs='+', default=[20, 60, 120], help='trials per subject')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per stage, the best one counts (default 3)')
+    parser.add_argument('--rolling', action='store_true', help='use the rolling avg (ROLLING)')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'setpupil-bench'),
+                        help='where the synthetic subjects are kept')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run (--json) to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='throughput drop that counts as a regression (default 0.25)')
+    parser.add_argument('--check', action='store_true',
+                        help='check the time bins against the old row loop (they have to be the same to the last bit)')
+    args = parser.parse_args(argv)
+
+    config = Config(rolling=args.rolling)
+    results = runBenchmarks(args.rates, args.trials, args.data_dir, config, args.repeat)
+    printResults(results)
+
+    if args.json:
+        with open(args.json, 'w') as jsonfile:
+            json.dump(results, jsonfile, indent=1)
+
+    if args.compare:
+        with open(args.compare, 'r') as jsonfile:
+            slower = regressions(results, json.load(jsonfile), args.tolerance)
+        for rate, trials, stage, before, after in slower:
+            print('REGRESSION %dHz %d trials %s: %.0f -> %.0f samples/s' % (rate, trials, stage, before, after))
+        if slower:
+            return 1
+
+    if args.check:
+        failed = False
+        for rate in args.rates:
+            for trials in args.trials:
+                path = _subjectPath(args.data_dir, rate, trials)
+                numBins, differ = checkBins(path, config)
+                print('CHECK %dHz %d trials: %d of %d bins differ from the row loop' % (rate, trials, differ, numBins))
+                numValues, differValues = checkMetrics(path, config)
+                print('CHECK %dHz %d trials: %d of %d metric values differ from the old passes'
+                      % (rate, trials, differValues, numValues))
+                failed = failed or differ > 0 or differValues > 0
+        if failed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
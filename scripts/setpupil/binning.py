@@ -0,0 +1,221 @@
+import numpy as np
+import pandas as pd
+
+from setpupil.windows import EMPTY_WINDOW
+
+########################################################################################################
+#########################################  Time bins  ##################################################
+########################################################################################################
+# Rows are grouped into bins of TIME_ROUND_TO ms (time since the first row of the trial, rounded to the
+# nearest bin). A new bin starts whenever the rounded time, the Window or the CurrentObject changes.
+# Every bin is represented by its first row, with the pupil data replaced by the bin statistics.
+########################################################################################################
+
+#Columns of the table returned by combineTimeBuckets
+BIN_COLUMNS = ['row', 'Window', 'WindowTimeNormalized', 'PupilAvg', 'PupilCount', 'PupilSD', 'PupilAvgRoll']
+
+
+#Rounds numbers (num) to nearest number we want (nearest). Define "nearest" top of SET_TimeCourse.py
+#Halves are rounded away from zero, which is what python 2's round did
+def roundToNearest(num, nearest):
+    x = np.asarray(num, dtype=np.float64) / nearest
+    rounded = np.floor(np.abs(x))
+    rounded += (np.abs(x) - rounded) >= 0.5
+    return (nearest * np.copysign(rounded, x)).astype(np.int64)
+
+
+#Sums of the rows starts[i]:stops[i] of values, added up the way np.sum/np.mean add up one array (in order for a few
+#rows, pairwise for more): the ranges are grouped by length and every group is summed as the rows of a 2-D array,
+#so the means are the same, to the last bit, as np.mean of every range in the old loop
+def _rangeSums(values, starts, stops):
+    lengths = stops - starts
+    sums = np.zeros(len(starts))
+    for length in np.unique(lengths):
+        if length == 0:
+            continue
+        ranges = np.flatnonzero(lengths == length)
+        sums[ranges] = np.add.reduce(values[starts[ranges, None] + np.arange(length)], axis=1)
+    return sums
+
+
+#Marks the nodes on the chain of every group: a chain starts at one of starts and goes on to following[node] (a later
+#node of the same group, len(following) after the last one)
+#Jumps of 1, 2, 4, ... links give every node the number of links to the end of its chain; a node is on the chain of
+#its group when jumping from the start of the group by the difference of the two lands on it
+def _chainMembers(following, starts, groups, numGroups):
+    numNodes = len(following)
+    jumps = [np.append(following, numNodes)]
+    while not np.all(jumps[-1] == numNodes):
+        jumps.append(jumps[-1][jumps[-1]])
+
+    toEnd = np.zeros(numNodes + 1, dtype=np.int64)
+    current = np.arange(numNodes + 1)
+    for level in range(len(jumps) - 1, -1, -1):
+        step = jumps[level][current]
+        move = step != numNodes
+        current[move] = step[move]
+        toEnd[move] += 1 << level
+
+    groupStart = np.full(numGroups, numNodes)
+    groupStart[groups[starts]] = starts
+    start = groupStart[groups]
+    nodes = np.arange(numNodes)
+    links = np.where(start <= nodes, toEnd[start] - toEnd[nodes], -1)
+    current = start.copy()
+    for level in range(len(jumps)):
+        jump = (links >= 0) & (((np.maximum(links, 0) >> level) & 1) == 1)
+        current[jump] = jumps[level][current[jump]]
+    return (links >= 0) & (current == nodes)
+
+
+#Rolling average of the pupil data for every bin, as the buffer of the old row loop gave it (see _bucketLoop), for
+#times that never go back within a trial:
+#  a bin is closed by the first row of the next bin. If that row starts a trial the buffer was just emptied and
+#  nothing is averaged; otherwise the buffer holds rows of its trial and is averaged once it spans windowSize ms
+#  (the last bin always is). The average is over the rows within windowSize of the latest one (np.searchsorted on
+#  the times of the trial), and the buffer keeps only those rows, so the next close that averages is the first
+#  one whose latest row is windowSize ms after the first row kept. These links are followed from the start of every
+#  trial with _chainMembers.
+#Bins that were closed without an average get the next average
+def _rollingAverages(binStart, trialStart, norm, pupil, windowSize):
+    numRows = len(norm)
+    numBins = len(binStart)
+    closeRow = np.append(binStart[1:], numRows)
+    opensTrial = np.append(trialStart[binStart[1:]] == binStart[1:], False)
+    closes = np.flatnonzero(~opensTrial)
+    lastRow = closeRow[closes] - 1
+
+    #rows and closes sorted by trial, then time (the trials are span ms apart)
+    trialNumber = np.cumsum(trialStart == np.arange(numRows)) - 1
+    span = int(norm.max()) + windowSize + 1
+    rowKey = trialNumber * span + norm
+    closeKey = rowKey[lastRow]
+    closeTrial = trialNumber[lastRow]
+    numCloses = len(closes)
+
+    #first row of the average of every close, and the next close that averages after it
+    first = np.searchsorted(rowKey, closeKey - windowSize, 'left')
+    following = np.searchsorted(closeKey, closeTrial * span + norm[first] + windowSize, 'left')
+    following = np.maximum(following, np.arange(1, numCloses + 1))
+    following[closeTrial[np.minimum(following, numCloses - 1)] != closeTrial] = numCloses
+
+    #first close of every trial that averages (its buffer still starts at the first row of the trial, at time 0)
+    trials = np.unique(closeTrial)
+    starts = np.searchsorted(closeKey, trials * span + windowSize, 'left')
+    starts = starts[(starts < numCloses) & (closeTrial[np.minimum(starts, numCloses - 1)] == trials)]
+
+    averaged = _chainMembers(following, starts, closeTrial, trialNumber[-1] + 1)
+    averaged[-1] = True
+    averages = _rangeSums(pupil, first[averaged], closeRow[closes[averaged]])
+    averages /= closeRow[closes[averaged]] - first[averaged]
+
+    closedBins = closes[averaged]
+    return averages[np.searchsorted(closedBins, np.arange(numBins), 'left')]
+
+
+#The bins as the old row loop made them: the mean of every bin and its rolling average (the buffer holds the rows of
+#the trial; once it spans windowSize ms it is averaged over the rows within windowSize of the latest one and only
+#those are kept, and the bins closed before that get the next average), both with np.mean
+def _bucketLoop(trialIds, norm, windows, codes, pupil, windowSize):
+    means = []
+    rolling = []
+    pending = 0
+    bucket = []
+    buffer = []
+    for i in range(len(norm)):
+        if i == 0 or trialIds[i] != trialIds[i - 1]:
+            buffer = []
+        if i > 0 and (norm[i] != norm[i - 1] or windows[i] != windows[i - 1] or codes[i] != codes[i - 1]):
+            means.append(np.mean(bucket))
+            bucket = []
+            pending += 1
+            if buffer and buffer[-1][0] - buffer[0][0] >= windowSize:
+                last = buffer[-1][0]
+                buffer = [entry for entry in buffer if last - entry[0] <= windowSize]
+                rolling += [np.mean([value for time, value in buffer])] * pending
+                pending = 0
+        bucket.append(pupil[i])
+        buffer.append((norm[i], pupil[i]))
+    means.append(np.mean(bucket))
+    last = buffer[-1][0]
+    rolling += [np.mean([value for time, value in buffer if last - time <= windowSize])] * (pending + 1)
+    return np.array(means), np.array(rolling)
+
+
+#Rows kept for the bins (see combineTimeBuckets) and what the bins are made from
+#Returns keep (row numbers), the TrialIds, normalized times, window codes, CurrentObject codes and pupil data of those
+#rows, and the first row of the trial of every row
+def _keptRows(trialId, currentObject, time, windows, pupil, timeRoundTo):
+    objects = pd.Categorical(currentObject)
+    windows = np.asarray(windows)
+    keep = np.flatnonzero((windows != EMPTY_WINDOW) & (np.asarray(objects) != 'Fixation'))
+
+    #NA TrialId/TETTime count as 0, like str2int/str2float did
+    trialIds = np.nan_to_num(np.asarray(trialId, dtype=np.float64)[keep]).astype(np.int64)
+    times = np.nan_to_num(np.asarray(time, dtype=np.float64)[keep])
+    numRows = len(keep)
+
+    #time since the first row of the trial, rounded to the bin size
+    newTrial = np.ones(numRows, dtype=bool)
+    newTrial[1:] = trialIds[1:] != trialIds[:-1]
+    trialStart = np.flatnonzero(newTrial)[np.cumsum(newTrial) - 1]
+    norm = roundToNearest(times - times[trialStart], timeRoundTo)
+    return (keep, trialIds, norm, windows[keep], np.asarray(objects.codes)[keep],
+            np.asarray(pupil, dtype=np.float64)[keep], trialStart)
+
+
+#Mean and rolling average of every bin computed row by row like the old combineTimeBuckets (same arguments), to
+#check the grouped version against (python -m setpupil.benchmark --check)
+#Returns (means, rolling avgs)
+def loopBuckets(trialId, currentObject, time, windows, pupil, timeRoundTo, windowSize):
+    keep, trialIds, norm, windows, codes, pupil, trialStart = _keptRows(trialId, currentObject, time, windows, pupil,
+                                                                        timeRoundTo)
+    if len(keep) == 0:
+        return np.zeros(0), np.zeros(0)
+    return _bucketLoop(trialIds, norm, windows, codes, pupil, windowSize)
+
+
+#Groups the rows into time bins
+#trialId, currentObject, time and pupil are the TrialId, CurrentObject, TETTime and pupil columns, windows the
+#window codes of the rows (see setpupil/windows.py)
+#Rows without a Window and the Fixation rows are left out
+#Returns a data frame with one row per bin (see BIN_COLUMNS): the row number of the first row of the bin in the
+#input, its Window code and normalized time, and the mean, count, SD (NaN for single rows) and rolling avg of the pupil
+def combineTimeBuckets(trialId, currentObject, time, windows, pupil, timeRoundTo, windowSize):
+    keep, trialIds, norm, windows, codes, pupil, trialStart = _keptRows(trialId, currentObject, time, windows, pupil,
+                                                                        timeRoundTo)
+    if len(keep) == 0:
+        empty = np.zeros(0)
+        return pd.DataFrame({'row' : keep, 'Window' : windows, 'WindowTimeNormalized' : keep, 'PupilAvg' : empty,
+                             'PupilCount' : keep, 'PupilSD' : empty, 'PupilAvgRoll' : empty}, columns=BIN_COLUMNS)
+    numRows = len(keep)
+
+    #a bin ends when the rounded time, the window or the CurrentObject changes
+    newBin = np.ones(numRows, dtype=bool)
+    newBin[1:] = (norm[1:] != norm[:-1]) | (windows[1:] != windows[:-1]) | (codes[1:] != codes[:-1])
+    binStart = np.flatnonzero(newBin)
+    binOfRow = np.cumsum(newBin) - 1
+
+    binStop = np.append(binStart[1:], numRows)
+    count = binStop - binStart
+    mean = _rangeSums(pupil, binStart, binStop) / count
+    squares = _rangeSums((pupil - mean[binOfRow]) ** 2, binStart, binStop)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sd = np.where(count > 1, np.sqrt(squares / (count - 1)), np.nan)
+
+    #the grouped rolling average needs the times of every trial in order, the row loop takes the rest
+    ordered = np.all((norm[1:] >= norm[:-1]) | (trialStart[1:] == np.arange(1, numRows)))
+    if ordered:
+        rolling = _rollingAverages(binStart, trialStart, norm, pupil, windowSize)
+    else:
+        rolling = _bucketLoop(trialIds, norm, windows, codes, pupil, windowSize)[1]
+
+    return pd.DataFrame({
+        'row' : keep[binStart],
+        'Window' : windows[binStart],
+        'WindowTimeNormalized' : norm[binStart],
+        'PupilAvg' : mean,
+        'PupilCount' : count,
+        'PupilSD' : sd,
+        'PupilAvgRoll' : rolling,
+    }, columns=BIN_COLUMNS)
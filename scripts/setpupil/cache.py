@@ -0,0 +1,138 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+from setpupil.windows import DEFAULT_SCHEDULE
+
+########################################################################################################
+#########################################  Subject cache  ##############################################
+########################################################################################################
+# The results of processSubject are kept on disk, keyed by the content of the subject file and by every
+# parameter that changes the results. On a rerun only new or changed files are processed again.
+# Entries are plain pickle files; reading an entry marks it as used (mtime), and when the cache grows
+# over its size limit the least recently used entries are removed.
+########################################################################################################
+
+#Bump when a change to the pipeline changes the results, so old entries are not used anymore
+CACHE_VERSION = 6
+
+#Bytes read at a time when hashing the subject files
+HASH_CHUNK = 1 << 20
+
+#File that remembers the hash of every input file by (size, mtime), so unchanged files are not read again
+DIGESTS_FILE = 'digests.pickle'
+
+
+#sha1 of the content of a file
+def fileDigest(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as datafile:
+        chunk = datafile.read(HASH_CHUNK)
+        while chunk:
+            sha.update(chunk)
+            chunk = datafile.read(HASH_CHUNK)
+    return sha.hexdigest()
+
+
+#Key of the results of one subject: the hash of the file plus everything that affects the results
+#params are the keyword arguments of processSubject (avgSameTime, timeRoundTo, ..., outputFormat)
+def resultKey(digest, params):
+    settingsKey = []
+    for name in sorted(params):
+        if name == 'schedule':
+            continue
+        value = params[name]
+        if isinstance(value, dict):
+            #settings.columns: only the columns that are in it matter
+            value = sorted(value)
+        settingsKey.append((name, value))
+    #the window schedule, also when it is the default one (None), so a change to it is a new key
+    windowsKey = repr(params.get('schedule') or DEFAULT_SCHEDULE)
+    text = repr((CACHE_VERSION, digest, settingsKey, windowsKey))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+#Cache of the subject results in directory, holding at most maxBytes
+#Only the main process calls keys() and evict(); get() and put() are safe to call from the worker processes
+class SubjectCache(object):
+
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _entryPath(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    #Result keys of the files in paths, params as in resultKey
+    #Files whose size and mtime did not change since the last run are not hashed again
+    def keys(self, paths, params):
+        digestsPath = os.path.join(self.directory, DIGESTS_FILE)
+        digests = self._load(digestsPath)
+        if digests is None:
+            digests = {}
+
+        keys = []
+        for path in paths:
+            stat = os.stat(path)
+            signature = (stat.st_size, stat.st_mtime)
+            known = digests.get(os.path.abspath(path))
+            if known is None or known[0] != signature:
+                known = (signature, fileDigest(path))
+                digests[os.path.abspath(path)] = known
+            keys.append(resultKey(known[1], params))
+
+        self._save(digestsPath, digests)
+        return keys
+
+    #Results stored under key, None if there are none
+    def get(self, key):
+        entryPath = self._entryPath(key)
+        result = self._load(entryPath)
+        if result is not None:
+            #mark the entry as recently used
+            os.utime(entryPath, None)
+        return result
+
+    def put(self, key, result):
+        self._save(self._entryPath(key), result)
+
+    #Removes the least recently used entries until the cache fits in maxBytes
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name == DIGESTS_FILE or not name.endswith('.pickle'):
+                continue
+            entryPath = os.path.join(self.directory, name)
+            stat = os.stat(entryPath)
+            entries.append((stat.st_mtime, stat.st_size, entryPath))
+
+        total = sum([size for mtime, size, entryPath in entries])
+        for mtime, size, entryPath in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            os.remove(entryPath)
+            total -= size
+
+    #Unreadable entries (e.g. from a run that was killed) count as missing
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as picklefile:
+                return pickle.load(picklefile)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    #Written to a temporary file first, so readers never see half an entry
+    def _save(self, path, value):
+        handle, tmpPath = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as picklefile:
+                pickle.dump(value, picklefile, pickle.HIGHEST_PROTOCOL)
+            #os.replace also overwrites on Windows (python 3), os.rename is atomic on posix
+            getattr(os, 'replace', os.rename)(tmpPath, path)
+        except Exception:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
@@ -0,0 +1,68 @@
+########################################################################################################
+######################################  Experiment & Data parameters   #################################
+########################################################################################################
+
+#The columns we will be reading from the input data files
+colID = 0 #row number of the export
+colSubject = 1
+colTETTime = 4
+colDiameterPupilLeftEye = 14
+colValidityLeftEye = 16
+colDiameterPupilRightEye = 21
+colValidityRightEye = 23
+colTrialId = 24
+colACC = 27
+colRT = 28
+colCategory = 29
+colSETornoSET = 30
+colTrainorExp = 31
+colPosition_false_shape = 32
+colCurrentObject = 39
+colInterpPupil = 40 #Pupil data: filtered and interpolated
+colFilteredPupil = 41
+colRemoveTrials = 42 #Pupil data: filtered, interpolated, and NAs in trials with less than 50% valid data
+
+#Number of columns in a complete row of the Tobii export
+NUM_COLUMNS = 43
+
+#Columns the pipeline itself needs (the output columns come from settings.columns)
+PIPELINE_COLUMNS = [
+    colSubject, colTETTime, colDiameterPupilLeftEye, colValidityLeftEye, colDiameterPupilRightEye,
+    colValidityRightEye, colTrialId, colACC, colRT, colCategory, colSETornoSET, colTrainorExp,
+    colPosition_false_shape, colCurrentObject, colInterpPupil, colFilteredPupil, colRemoveTrials,
+]
+
+#Columns read as numbers; NA becomes NaN so it can be used as a missing-value mask
+FLOAT_COLUMNS = [
+    colTETTime, colDiameterPupilLeftEye, colDiameterPupilRightEye,
+    colInterpPupil, colFilteredPupil, colRemoveTrials,
+]
+
+#Numeric columns that only ever hold whole numbers; they are stored as floats (so NA fits)
+#but are written back out without a decimal point
+INT_COLUMNS = [colValidityLeftEye, colValidityRightEye, colTrialId, colACC, colRT]
+
+#Other columns of the export that only hold the fields of a session or trial (passed through to the output)
+colSession = 2
+colRTTime = 6
+colCursorX = 7
+colCursorY = 8
+colBlock = 25
+colProcedure = 26
+colItem1 = 33
+colItem2 = 34
+colItem3 = 35
+colItem4 = 36
+colCorrectAnswer = 37
+colResponse = 38
+
+#Text columns with a few distinct values (fields of the session or trial), stored as categoricals: one copy of
+#"firstitem" per file instead of one per row
+CATEGORY_COLUMNS = [
+    colSubject, colSession, colRTTime, colCursorX, colCursorY, colBlock, colProcedure, colCategory, colSETornoSET,
+    colTrainorExp, colPosition_false_shape, colItem1, colItem2, colItem3, colItem4, colCorrectAnswer, colResponse,
+    colCurrentObject,
+]
+
+#Every other column (row ID, timestamps, gaze/camera positions, distances) is kept verbatim as text: those have a
+#different value on almost every row, so a categorical would only add the codes to the text
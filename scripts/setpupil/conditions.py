@@ -0,0 +1,171 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+########################################################################################################
+#########################################  Condition stats  ############################################
+########################################################################################################
+# The pupil values of the bias window (fix3, SET vs noSET) and of the encoding windows (fix2/fix3 of the
+# SET trials, span3 vs span1 or span2) of the correct trials, summarized by condition without keeping the
+# values: every condition has a Moments accumulator (count, mean and sum of squared deviations, min, max
+# and a fixed-bin histogram). Two accumulators merge into the one of all their values (Chan et al.), in
+# any order and grouping, so the stats of a subject come back from the worker processes (and the cache)
+# as a few numbers and the cohort stats are the merge of the subject stats.
+########################################################################################################
+
+#Edges (mm) of the histogram bins of the pupil values, plus one bin below the first edge and one from the last
+HISTOGRAM_EDGES = np.linspace(0.0, 10.0, 101)
+
+#Columns of the condition report, one row per subject (and one with Subject ALL for the cohort) and condition
+CONDITION_FIELDS = ['Subject', 'file', 'measure', 'condition', 'count', 'mean', 'variance', 'sd', 'min', 'max']
+
+#Subject of the cohort rows of the report
+COHORT = 'ALL'
+
+
+#Count, mean, variance, min and max of values added in batches, and their histogram over edges (None for none)
+#m2 is the sum of the squared deviations from the mean (Welford); merge adds the values of another Moments
+class Moments(object):
+
+    def __init__(self, edges=HISTOGRAM_EDGES):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.nan
+        self.maximum = np.nan
+        self.edges = None if edges is None else np.asarray(edges, dtype=np.float64)
+        self.histogram = None if edges is None else np.zeros(len(self.edges) + 1, dtype=np.int64)
+
+    #Adds a batch of values: its own count/mean/m2, merged in (see merge)
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return self
+        batch = Moments(None)
+        batch.count = len(values)
+        batch.mean = float(values.mean())
+        batch.m2 = float(np.square(values - batch.mean).sum())
+        batch.minimum = float(values.min())
+        batch.maximum = float(values.max())
+        self.merge(batch)
+        if self.histogram is not None:
+            self.histogram += np.bincount(np.searchsorted(self.edges, values, side='right'),
+                                          minlength=len(self.histogram))
+        return self
+
+    #Adds the values of other (same edges): the mean moves by its share of the difference of the means and m2
+    #gets the spread between the two means on top of both m2
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.histogram is not None and other.histogram is not None:
+            if not np.array_equal(self.edges, other.edges):
+                raise ValueError('the histograms of the accumulators have different bins')
+            self.histogram += other.histogram
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.minimum, self.maximum = other.minimum, other.maximum
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    #Sample variance (n - 1), NaN with fewer than 2 values
+    def variance(self):
+        if self.count < 2:
+            return np.nan
+        return self.m2 / (self.count - 1)
+
+    #Mean, NaN without values
+    def average(self):
+        return self.mean if self.count > 0 else np.nan
+
+    def __repr__(self):
+        return 'Moments(count=%d, mean=%r, variance=%r)' % (self.count, self.average(), self.variance())
+
+
+#Moments of the values
+def moments(values, edges=HISTOGRAM_EDGES):
+    return Moments(edges).add(values)
+
+
+#Merge of every Moments of accumulators (the values of all of them), an empty Moments if there are none
+def mergeMoments(accumulators, edges=HISTOGRAM_EDGES):
+    return functools.reduce(lambda merged, other: merged.merge(other), accumulators, Moments(edges))
+
+
+#Condition stats of a subject from the biasMap and encodingStrategyMap of metrics.computeTrialMetrics:
+#{measure: {condition: Moments}}
+def conditionStats(biasMap, encodingStrategyMap):
+    return {'bias' : biasMap, 'encoding' : encodingStrategyMap}
+
+
+#Cohort condition stats: the merge of the condition stats of every subject ('conditions' of the quality stats)
+def cohortConditions(subjectStats):
+    cohort = {}
+    for stats in subjectStats:
+        for measure, conditions in sorted(stats.get('conditions', {}).items()):
+            for condition, accumulator in sorted(conditions.items()):
+                merged = cohort.setdefault(measure, {}).setdefault(condition, Moments(accumulator.edges))
+                merged.merge(accumulator)
+    return cohort
+
+
+def _reportRows(subject, filename, conditions):
+    rows = []
+    for measure, byCondition in sorted(conditions.items()):
+        for condition, accumulator in sorted(byCondition.items()):
+            variance = accumulator.variance()
+            rows.append({'Subject' : subject, 'file' : filename, 'measure' : measure, 'condition' : condition,
+                         'count' : accumulator.count, 'mean' : accumulator.average(), 'variance' : variance,
+                         'sd' : np.sqrt(variance), 'min' : accumulator.minimum, 'max' : accumulator.maximum})
+    return rows
+
+
+#Condition report of the subjects (quality stats of processSubject): the stats of every condition of every subject,
+#then the ones of the cohort (Subject ALL)
+def conditionFrame(subjectStats):
+    rows = []
+    for stats in subjectStats:
+        if 'conditions' in stats:
+            sampling = stats.get('sampling', {})
+            rows.extend(_reportRows(sampling.get('Subject'), sampling.get('file'), stats['conditions']))
+    rows.extend(_reportRows(COHORT, '', cohortConditions(subjectStats)))
+    return pd.DataFrame(rows, columns=CONDITION_FIELDS)
+
+
+#Histograms of the conditions, one row per subject and condition like conditionFrame, with the count of every bin
+#(below_<first edge>, <edge>-<next edge>, ..., from_<last edge>)
+def histogramFrame(subjectStats):
+    rows = []
+    edges = HISTOGRAM_EDGES
+    entries = [(stats.get('sampling', {}), stats['conditions']) for stats in subjectStats if 'conditions' in stats]
+    entries.append(({'Subject' : COHORT, 'file' : ''}, cohortConditions(subjectStats)))
+    for sampling, conditions in entries:
+        for measure, byCondition in sorted(conditions.items()):
+            for condition, accumulator in sorted(byCondition.items()):
+                if accumulator.histogram is None:
+                    continue
+                edges = accumulator.edges
+                rows.append([sampling.get('Subject'), sampling.get('file'), measure, condition] +
+                            accumulator.histogram.tolist())
+    bins = ['below_%g' % edges[0]] + ['%g-%g' % (low, high) for low, high in zip(edges[:-1], edges[1:])] + \
+        ['from_%g' % edges[-1]]
+    return pd.DataFrame(rows, columns=CONDITION_FIELDS[:4] + bins)
+
+
+#Writes the condition report (CSV if path ends with .csv, tab separated otherwise), and with histograms the histogram
+#of every condition next to it (<path>_histogram)
+def writeConditionReport(path, subjectStats, histograms=False):
+    sep = ',' if path.endswith('.csv') else '\t'
+    conditionFrame(subjectStats).to_csv(path, sep=sep, index=False)
+    if histograms:
+        stem, extension = os.path.splitext(path)
+        histogramFrame(subjectStats).to_csv(stem + '_histogram' + (extension or '.tsv'), sep=sep, index=False)
@@ -0,0 +1,265 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from setpupil.columns import colTrialId, colACC, colRT, colRemoveTrials
+from setpupil.windows import DEFAULT_SCHEDULE, windowLabels
+from setpupil.metrics import TRIAL_FIELDS
+
+########################################################################################################
+#########################################  Epochs  #####################################################
+########################################################################################################
+# The binned rows of a subject as a dense trials x cells array: a cell is a (Window, WindowTimeNormalized)
+# of the time course (the last bin of a window and the first bin of the next one can have the same time,
+# so the time alone is not enough), the cells in time order, NaN where a trial has no valid pupil value.
+# Every trial has its summary fields (Subject, ACC, Category, SETornoSET, ...) in a row of Epochs.trials,
+# and the avg pupil of the experiment rows of every window (windowMeans, which has the pre-trial fixation
+# that the time bins leave out).
+# A baseline is a definition (windows, a time range, subtract or divide, and optionally other windows for
+# some cells, like IEPR) that gives every trial (and cell) a value; correct() computes any number of them
+# and applies them to the whole array with one broadcast. The baselines of TEPR, TEPR_fix and IEPR
+# (setBaselines) give the numbers of setpupil/metrics.py.
+########################################################################################################
+
+#Ways to apply a baseline: pupil - baseline or pupil / baseline
+BASELINE_METHODS = ['subtract', 'divide']
+
+#Window of the fixation cross before the first item (not in the time bins)
+PRETRIAL_WINDOW = 'fixation'
+
+
+#Baseline definition
+#   name:    name of the corrected array
+#   windows: windows whose valid pupil values give the baseline of a trial; a window that is not in the time bins
+#            (the pre-trial fixation) uses the avg of its experiment rows (Epochs.windowMeans) instead
+#   method:  'subtract' or 'divide'
+#   start, end: only the bins of the windows from start to end ms (WindowTimeNormalized), all of them if None
+#   per:     dict window -> windows of the baseline of the cells of that window (e.g. IEPR: the fixation before
+#            the item); the cells of the other windows use windows (NaN if windows is None)
+class Baseline(object):
+
+    def __init__(self, name, windows=None, method='subtract', start=None, end=None, per=None):
+        if method not in BASELINE_METHODS:
+            raise ValueError('unknown baseline method %r (one of %s)' % (method, ', '.join(BASELINE_METHODS)))
+        self.name = name
+        self.windows = None if windows is None else list(windows)
+        self.method = method
+        self.start = start
+        self.end = end
+        self.per = dict((window, list(others)) for window, others in (per or {}).items())
+
+    def __repr__(self):
+        return 'Baseline(%r, %r, method=%r, start=%r, end=%r, per=%r)' % (self.name, self.windows, self.method,
+                                                                          self.start, self.end, sorted(self.per.items()))
+
+
+#Baselines of the trial metrics of a window schedule (the one of SET if None), as setpupil/metrics.py computes them:
+#   TEPR:       the windows of the baseline object (firstitem: item1 and fix1)
+#   TEPR_fix:   the fixation cross of the first item (fix1)
+#   IEPR:       for the windows of item n, the fixation cross of item n - 1 (of item 1 for the first item)
+#(over every cell: the metric columns only have the item windows), and two more: TEPR_ratio (pupil / TEPR
+#baseline) and, if the schedule has it, pretrial (the fixation before the items)
+def setBaselines(schedule=None):
+    schedule = schedule or DEFAULT_SCHEDULE
+    baselineWindows = [label for start, label in schedule.objects.get(schedule.baseline, [])]
+    fixOfItem = dict((schedule.itemNumbers[name], 'fix%d' % schedule.itemNumbers[name]) for name in schedule.names
+                     if 'fix%d' % schedule.itemNumbers[name] in schedule.code)
+    previous = {}
+    for name in schedule.names:
+        item = schedule.itemNumbers[name]
+        if item == 0:
+            continue
+        fix = fixOfItem.get(item - 1, fixOfItem.get(item))
+        for start, label in schedule.objects[name]:
+            if fix is not None:
+                previous[label] = [fix]
+    baselines = [
+        Baseline('TEPR', baselineWindows),
+        Baseline('TEPR_fix', [fixOfItem[1]] if 1 in fixOfItem else None),
+        Baseline('IEPR', per=previous),
+        Baseline('TEPR_ratio', baselineWindows, method='divide'),
+    ]
+    if PRETRIAL_WINDOW in schedule.code:
+        baselines.append(Baseline('pretrial', [PRETRIAL_WINDOW]))
+    return baselines
+
+
+#Trials x cells array of a subject (see buildEpochs)
+#   data:        pupil value of every trial and cell (avg of its valid bins), NaN without one
+#   counts:      number of valid bins of every trial and cell
+#   cells:       data frame with the Window and WindowTimeNormalized of every cell
+#   trials:      data frame with the summary fields of every trial (metrics.TRIAL_FIELDS)
+#   windowMeans: avg valid pupil of the experiment rows of every trial and window (columns: labels)
+#   labels:      window labels of the window schedule
+class Epochs(object):
+
+    def __init__(self, data, counts, cells, trials, windowMeans, labels):
+        self.data = data
+        self.counts = counts
+        self.cells = cells
+        self.trials = trials
+        self.windowMeans = windowMeans
+        self.labels = list(labels)
+
+    def __len__(self):
+        return len(self.trials)
+
+    #Epochs of the trials where mask is True (e.g. epochs.trials['SETornoSET'] == 'SET')
+    def select(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return Epochs(self.data[mask], self.counts[mask], self.cells, self.trials[mask].reset_index(drop=True),
+                      self.windowMeans[mask], self.labels)
+
+    #Baseline value of every trial for windows (avg of the valid values, see Baseline)
+    def _trialBaseline(self, windows, start, end):
+        cellWindows = self.cells['Window'].values
+        if set(windows) <= set(cellWindows):
+            cells = np.isin(cellWindows, windows)
+            times = self.cells['WindowTimeNormalized'].values
+            if start is not None:
+                cells &= times >= start
+            if end is not None:
+                cells &= times <= end
+            weights = self.counts[:, cells]
+            total = np.nansum(self.data[:, cells] * weights, axis=1)
+            count = weights.sum(axis=1)
+        else:
+            #windows that are not in the bins: avg of their rows (weighted alike, every window counts once)
+            columns = [self.labels.index(window) for window in windows if window in self.labels]
+            values = self.windowMeans[:, columns]
+            total = np.nansum(values, axis=1)
+            count = (~np.isnan(values)).sum(axis=1)
+        baseline = np.full(len(self), np.nan)
+        np.divide(total, count, out=baseline, where=count > 0)
+        return baseline
+
+    #Baseline value of every trial and cell (trials x cells)
+    def baselineValues(self, baseline):
+        values = np.full(self.data.shape, np.nan)
+        cellWindows = self.cells['Window'].values
+        rest = ~np.isin(cellWindows, list(baseline.per))
+        if baseline.windows is not None:
+            values[:, rest] = self._trialBaseline(baseline.windows, baseline.start, baseline.end)[:, None]
+        for window, others in baseline.per.items():
+            cells = cellWindows == window
+            if cells.any():
+                values[:, cells] = self._trialBaseline(others, baseline.start, baseline.end)[:, None]
+        return values
+
+    #Corrected arrays of every baseline: {name: trials x cells array}, NaN where the pupil or the baseline is missing
+    #(or the baseline is not > 0)
+    #The baselines are stacked (baselines x trials x cells) and applied in one broadcast per method
+    def correct(self, baselines):
+        baselines = list(baselines)
+        values = np.stack([self.baselineValues(baseline) for baseline in baselines]) if baselines else \
+            np.zeros((0,) + self.data.shape)
+        values[~(values > 0)] = np.nan
+        corrected = np.empty_like(values)
+        subtract = np.array([baseline.method == 'subtract' for baseline in baselines], dtype=bool)
+        corrected[subtract] = self.data[None, :, :] - values[subtract]
+        corrected[~subtract] = self.data[None, :, :] / values[~subtract]
+        return dict((baseline.name, corrected[n]) for n, baseline in enumerate(baselines))
+
+    #Long data frame of the corrected arrays: one row per trial and cell with a value, the summary fields of the
+    #trial, the cell and a column for every baseline
+    def frame(self, corrected):
+        trial, cell = np.nonzero(~np.isnan(self.data))
+        rows = self.trials.iloc[trial].reset_index(drop=True)
+        rows['Window'] = self.cells['Window'].values[cell]
+        rows['WindowTimeNormalized'] = self.cells['WindowTimeNormalized'].values[cell]
+        rows['pupil'] = self.data[trial, cell]
+        for name, values in corrected.items():
+            rows[name] = values[trial, cell]
+        return rows
+
+    def save(self, path):
+        arrays = {'data' : self.data, 'counts' : self.counts, 'windowMeans' : self.windowMeans,
+                  'labels' : np.array(self.labels, dtype=str),
+                  'cellWindows' : np.asarray(self.cells['Window'], dtype=str),
+                  'cellTimes' : self.cells['WindowTimeNormalized'].values}
+        for name in self.trials.columns:
+            values = self.trials[name]
+            if values.dtype.kind in 'biuf':
+                arrays['trial_' + name] = values.values
+            else:
+                arrays['text_' + name] = np.asarray(values.fillna('').astype(str), dtype=str)
+        with open(path, 'wb') as npzfile:
+            np.savez(npzfile, **arrays)
+
+
+#Reads epochs written by Epochs.save
+def loadEpochs(path):
+    with np.load(path, allow_pickle=False) as arrays:
+        trials = pd.DataFrame()
+        for name, col in TRIAL_FIELDS:
+            if 'trial_' + name in arrays.files:
+                trials[name] = arrays['trial_' + name]
+            elif 'text_' + name in arrays.files:
+                trials[name] = pd.Series(arrays['text_' + name].astype(object)).replace('', np.nan)
+        cells = pd.DataFrame({'Window' : arrays['cellWindows'].astype(object),
+                              'WindowTimeNormalized' : arrays['cellTimes']})
+        return Epochs(arrays['data'], arrays['counts'], cells, trials, arrays['windowMeans'],
+                      arrays['labels'].tolist())
+
+
+#Epochs of a subject
+#frame and windows are the experiment rows and their window codes (labelSubject), binned the binned rows, their
+#window codes, rolling avg and normalized times (pipeline.binSubject); rolling uses the rolling avg as pupil value
+#(ROLLING), schedule is the WindowSchedule of the windows (the one of SET if None)
+def buildEpochs(frame, windows, binned, rolling=False, schedule=None):
+    schedule = schedule or DEFAULT_SCHEDULE
+    binFrame, binWindows, pupilAvgRoll, times = binned
+    pupil = np.nan_to_num(np.asarray(pupilAvgRoll, dtype=np.float64)) if rolling else \
+        np.nan_to_num(np.asarray(binFrame[colRemoveTrials], dtype=np.float64))
+    trialIds = np.nan_to_num(np.asarray(binFrame[colTrialId], dtype=np.float64)).astype(np.int64)
+    trialOfBin, trialList = pd.factorize(trialIds)
+
+    #the summary fields of a trial come from its first bin, like the summary of the pipeline
+    first = np.flatnonzero(~pd.Index(trialOfBin).duplicated())
+    trials = pd.DataFrame()
+    for name, col in TRIAL_FIELDS:
+        values = binFrame[col].values[first]
+        if col in (colTrialId, colACC, colRT):
+            values = np.nan_to_num(np.asarray(values, dtype=np.float64)).astype(np.int64)
+        trials[name] = values
+
+    #cells: windows in the order they start, then by time
+    labels = windowLabels(binWindows, schedule)
+    cellOfBin, cellKeys = pd.factorize(pd.MultiIndex.from_arrays([labels, np.asarray(times, dtype=np.float64)]))
+    cells = cellKeys.to_frame(index=False, name=['Window', 'WindowTimeNormalized'])
+    windowStart = cells.groupby('Window')['WindowTimeNormalized'].transform('min').values
+    order = np.lexsort((cells['WindowTimeNormalized'].values, cells['Window'].values, windowStart))
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    cells = cells.iloc[order].reset_index(drop=True)
+    cellOfBin = position[cellOfBin]
+
+    numTrials, numCells = len(trialList), len(cells)
+    valid = pupil > 0
+    flat = trialOfBin[valid] * numCells + cellOfBin[valid]
+    counts = np.bincount(flat, minlength=numTrials * numCells).reshape(numTrials, numCells)
+    totals = np.bincount(flat, weights=pupil[valid], minlength=numTrials * numCells).reshape(numTrials, numCells)
+    data = np.full((numTrials, numCells), np.nan)
+    np.divide(totals, counts, out=data, where=counts > 0)
+
+    #avg valid pupil of the experiment rows of every trial and window, for the windows the bins leave out
+    rowPupil = np.nan_to_num(np.asarray(frame[colRemoveTrials], dtype=np.float64))
+    rowTrials = pd.Index(trialList).get_indexer(np.nan_to_num(np.asarray(frame[colTrialId],
+                                                                         dtype=np.float64)).astype(np.int64))
+    rowWindows = np.asarray(windows, dtype=np.int64)
+    keep = (rowTrials >= 0) & (rowPupil > 0)
+    numLabels = len(schedule.labels)
+    flat = rowTrials[keep] * numLabels + rowWindows[keep]
+    rowCounts = np.bincount(flat, minlength=numTrials * numLabels).reshape(numTrials, numLabels)
+    rowTotals = np.bincount(flat, weights=rowPupil[keep], minlength=numTrials * numLabels).reshape(numTrials,
+                                                                                                  numLabels)
+    windowMeans = np.full((numTrials, numLabels), np.nan)
+    np.divide(rowTotals, rowCounts, out=windowMeans, where=rowCounts > 0)
+
+    return Epochs(data, counts, cells, trials, windowMeans, schedule.labels)
+
+
+#Where the epochs of a subject file go in directory
+def epochPath(directory, path):
+    return os.path.join(directory, os.path.splitext(os.path.basename(path))[0] + '.epochs.npz')
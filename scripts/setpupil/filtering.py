@@ -0,0 +1,395 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from setpupil import loader
+from setpupil.columns import colID, colSubject, colDiameterPupilLeftEye, colValidityLeftEye
+from setpupil.columns import colDiameterPupilRightEye, colValidityRightEye
+from setpupil.columns import colInterpPupil, colFilteredPupil, colRemoveTrials
+from setpupil.columns import colTrialId, colTrainorExp, colCurrentObject
+
+########################################################################################################
+#########################################  Pupil filter  ###############################################
+########################################################################################################
+# Same steps as filter_with_stat_report.R, run on the raw export inside the pipeline instead of writing
+# and reading back an intermediate file:
+#   1. pupil = avg of both eyes, or whichever eye is valid (diameter -1 or validity 4 is no data)
+#   2. in blocks of blockSize rows (overlapping by numPoints on both sides), fit a local quadratic
+#      regression (loess) of the pupil on the row ID and drop the points more than se standard errors
+#      from the fit -> filtered_av_pupil
+#   3. fit again without the dropped points and fill the missing points with the fit; runs of more than
+#      maxInterp missing rows stay missing -> interp_av_pupil
+# and then the step of Removetrialswithtoofewdatapoints.R (removeTrials):
+#   4. experiment trials with less than trialThreshold % of valid interp_av_pupil in their rows (Fixation rows
+#      not counted) lose the data of those rows -> remove_trial
+# The fits are computed directly at every point (R interpolates them over a kd tree), vectorized over
+# all the points of a block, so the values are close to but not exactly the ones of the R script.
+########################################################################################################
+
+#Columns of the raw export the filter needs
+FILTER_COLUMNS = [colID, colSubject, colDiameterPupilLeftEye, colValidityLeftEye, colDiameterPupilRightEye,
+                  colValidityRightEye]
+
+#Header names of the columns the filter adds, as the R scripts name them
+FILTER_HEADERS = {
+    colInterpPupil : 'interp_av_pupil',
+    colFilteredPupil : 'filtered_av_pupil',
+    colRemoveTrials : 'remove_trial',
+}
+
+#Columns of the filter stats report (one row per block, the subj_ columns are totals of the subject)
+FILTER_STATS_FIELDS = [
+    'Subject', 'row.numb', 'valid.data', 'block', 'filtered_numb', 'filtered_perc', 'interpolated_numb',
+    'interpolated_perc', 'subj_filtered_row_numb', 'subj_filtered_row_perc', 'subj_filtered_row_perc_total',
+    'subj_interpolated_row_numb', 'subj_interpolated_row_perc', 'subj_interpolated_row_perc_total',
+]
+
+#Validity code of an eye without data
+INVALID_EYE = 4
+
+#Fewest points a local quadratic fit is computed from (the farthest ones get no weight)
+MIN_FIT_POINTS = 5
+
+
+#Parameters of the filter, same names and defaults as filter_with_stat_report.R
+#   se:               points more than se standard errors away from the fit are dropped
+#   numPoints:        neighbours of a point used for its fit (span of the loess), and overlap of the blocks
+#   maxInterp:        only runs of at most maxInterp missing rows are interpolated
+#   minValidPercent:  subjects with less valid eye data (in %) are not filtered, their pupil columns stay NA
+#   blockSize:        rows fitted at once
+class PupilFilter(object):
+
+    def __init__(self, se=5, numPoints=80, maxInterp=50, minValidPercent=25, blockSize=8000):
+        if numPoints <= 0 or blockSize <= 0:
+            raise ValueError('numPoints and blockSize have to be > 0 (got %r, %r)' % (numPoints, blockSize))
+        self.se = se
+        self.numPoints = numPoints
+        self.maxInterp = maxInterp
+        self.minValidPercent = minValidPercent
+        self.blockSize = blockSize
+
+    #Part of the cache key of the results (see cache.resultKey), so it has to list every parameter
+    def __repr__(self):
+        return 'PupilFilter(se=%r, numPoints=%r, maxInterp=%r, minValidPercent=%r, blockSize=%r)' % (
+            self.se, self.numPoints, self.maxInterp, self.minValidPercent, self.blockSize)
+
+    #Adds interp_av_pupil and filtered_av_pupil to a raw export
+    #frame has the FILTER_COLUMNS, labeled by column number (see loader.readTobiiExport)
+    #Returns (headers with the new columns named, frame, filter stats of the subject (see filterPupil))
+    def apply(self, headers, frame):
+        pupil, validEyes = pupilValues(frame[colDiameterPupilLeftEye], frame[colValidityLeftEye],
+                                       frame[colDiameterPupilRightEye], frame[colValidityRightEye])
+        ids = _numbers(frame[colID])
+        filtered, interp, stats = filterPupil(ids, pupil, validEyes, self)
+
+        stats['Subject'] = subjectName(frame)
+        for block in stats['blocks']:
+            block['Subject'] = stats['Subject']
+
+        frame = frame.copy()
+        frame[colInterpPupil] = interp
+        frame[colFilteredPupil] = filtered
+        return _namedHeaders(headers, [colInterpPupil, colFilteredPupil]), frame, stats
+
+
+#Subject of an export, as text (None for an empty file)
+def subjectName(frame):
+    subject = frame[colSubject].iloc[0] if len(frame) else None
+    return None if pd.isna(subject) else str(subject)
+
+
+#Headers with the names of the columns cols added where the file has no header for them
+def _namedHeaders(headers, cols):
+    headers = list(headers)
+    for col in sorted(cols):
+        if col >= len(headers):
+            headers += [''] * (col - len(headers)) + [FILTER_HEADERS[col]]
+    return headers
+
+
+#Numbers of a column that may have been read as text (the ID column is kept as text by the loader)
+def _numbers(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = pd.to_numeric(np.asarray(values.cat.categories, dtype=object), errors='coerce')
+        codes = np.asarray(values.cat.codes)
+        return np.where(codes >= 0, np.append(np.asarray(categories, dtype=np.float64), np.nan)[codes], np.nan)
+    if loader.isText(values):
+        return np.asarray(pd.to_numeric(values, errors='coerce'), dtype=np.float64)
+    return np.asarray(values, dtype=np.float64)
+
+
+#Pupil value of every row: the avg of both eyes, or whichever eye has data (NaN if neither)
+#Returns (pupil values, number of eyes with data over all the rows)
+def pupilValues(left, validityLeft, right, validityRight):
+    left = np.array(left, dtype=np.float64)
+    right = np.array(right, dtype=np.float64)
+    left[(left == -1) | (np.asarray(validityLeft, dtype=np.float64) == INVALID_EYE)] = np.nan
+    right[(right == -1) | (np.asarray(validityRight, dtype=np.float64) == INVALID_EYE)] = np.nan
+
+    pupil = (left + right) / 2
+    onlyLeft = np.isnan(pupil) & ~np.isnan(left)
+    pupil[onlyLeft] = left[onlyLeft]
+    onlyRight = np.isnan(pupil) & ~np.isnan(right)
+    pupil[onlyRight] = right[onlyRight]
+    return pupil, int(np.count_nonzero(~np.isnan(left)) + np.count_nonzero(~np.isnan(right)))
+
+
+#First point of the q nearest neighbours of every point of at, among the sorted points x
+#The neighbours of a point are x[start:start + q]
+def _nearestStarts(x, at, q):
+    last = len(x) - q
+    #the window [s, s + q) is centered on a where x[s] + x[s + q - 1] first reaches 2a; the best window is
+    #that one or the one before it
+    starts = np.clip(np.searchsorted(x[:last + 1] + x[q - 1:], 2 * at), 0, last)
+    before = np.maximum(starts - 1, 0)
+    reach = np.maximum(at - x[starts], x[starts + q - 1] - at)
+    reachBefore = np.maximum(at - x[before], x[before + q - 1] - at)
+    return np.where(reachBefore < reach, before, starts)
+
+
+#Local quadratic regression with tricube weights over the q nearest points (x sorted, no NaN)
+#Returns (fit at every point of at, sum of the squared weights of the fit, weight of the point itself (the
+#leverage, only meaningful when at is x))
+def localFit(x, y, at, q):
+    starts = _nearestStarts(x, at, q)
+    neighbours = starts[:, None] + np.arange(q)
+    distances = x[neighbours] - at[:, None]
+    reach = np.abs(distances).max(axis=1)
+    reach[reach == 0] = 1
+    u = distances / reach[:, None]
+    cube = np.abs(u)
+    cube *= cube * cube
+    weights = np.clip(1 - cube, 0, None)
+    weights *= weights * weights
+
+    #normal equations of the weighted fit of [1, u, u^2]; the fit at u = 0 is the first coefficient, so only
+    #the first row of the inverse is needed
+    moments = []
+    weighted = weights
+    for k in range(5):
+        moments.append(weighted.sum(axis=1))
+        weighted = weighted * u
+    normal = np.empty((len(at), 3, 3))
+    for i in range(3):
+        for j in range(3):
+            normal[:, i, j] = moments[i + j]
+    unit = np.zeros((len(at), 3, 1))
+    unit[:, 0, 0] = 1
+    try:
+        coefs = np.linalg.solve(normal, unit)[:, :, 0]
+    except np.linalg.LinAlgError:
+        coefs = np.matmul(np.linalg.pinv(normal), unit)[:, :, 0]
+
+    operator = weights * (coefs[:, 0:1] + (coefs[:, 1:2] + coefs[:, 2:3] * u) * u)
+    return (operator * y[neighbours]).sum(axis=1), (operator ** 2).sum(axis=1), coefs[:, 0]
+
+
+#Number of neighbours of every fit in a block of numRows rows of which numValid have data
+#(the span of the R script is numPoints / rows of the block, of the points that have data)
+def _neighbours(numValid, numRows, numPoints):
+    return int(np.floor(numValid * float(numPoints) / numRows))
+
+
+#Fit, lower and upper bound (se standard errors) at the points with data, NaN for the others
+def _fitBounds(x, y, numRows, numPoints, se):
+    valid = ~np.isnan(y)
+    lower = np.full(len(y), np.nan)
+    upper = np.full(len(y), np.nan)
+    q = min(max(_neighbours(np.count_nonzero(valid), numRows, numPoints), MIN_FIT_POINTS), np.count_nonzero(valid))
+    if q < MIN_FIT_POINTS:
+        return lower, upper
+
+    xValid = x[valid]
+    yValid = y[valid]
+    fit, squares, leverage = localFit(xValid, yValid, xValid, q)
+    #residual standard error, with the equivalent number of parameters of the fit
+    delta = len(xValid) - 2 * leverage.sum() + squares.sum()
+    scale = np.sqrt(((yValid - fit) ** 2).sum() / delta) if delta > 0 else np.nan
+    spread = se * scale * np.sqrt(squares)
+    lower[valid] = fit - spread
+    upper[valid] = fit + spread
+    return lower, upper
+
+
+#Fit at the points without data between the first and the last point with data (no extrapolation)
+def _fillMissing(x, y, numRows, numPoints):
+    valid = ~np.isnan(y)
+    filled = y.copy()
+    q = min(max(_neighbours(np.count_nonzero(valid), numRows, numPoints), MIN_FIT_POINTS), np.count_nonzero(valid))
+    if q < MIN_FIT_POINTS:
+        return filled
+
+    xValid = x[valid]
+    inside = ~valid & (x >= xValid[0]) & (x <= xValid[-1])
+    if inside.any():
+        filled[inside] = localFit(xValid, y[valid], x[inside], q)[0]
+    return filled
+
+
+#Marks the missing points that are in a run of more than maxInterp consecutive missing IDs
+def _longGaps(x, missing, maxInterp):
+    gaps = np.zeros(len(x), dtype=bool)
+    missingAt = np.flatnonzero(missing)
+    if len(missingAt) <= maxInterp:
+        return gaps
+    ids = x[missingAt]
+    newRun = np.ones(len(ids), dtype=bool)
+    newRun[1:] = ids[1:] - ids[:-1] != 1
+    runStarts = np.flatnonzero(newRun)
+    runLengths = np.diff(np.append(runStarts, len(ids)))
+    gaps[missingAt[np.repeat(runLengths > maxInterp, runLengths)]] = True
+    return gaps
+
+
+#Ratio that is NaN instead of failing when there is nothing to divide by (R gives NaN too)
+def _ratio(count, total):
+    return count / float(total) if total else float('nan')
+
+
+#Filters and interpolates the pupil values of a subject
+#ids are the row IDs (the x of the fits), pupil the values from pupilValues, validEyes its count of eyes with data
+#Returns (filtered_av_pupil, interp_av_pupil, stats) where stats has the totals of the subject
+#('row.numb', 'valid.data', 'valid_percent', 'resting' = avg interp_av_pupil) and the stats of every block
+#('blocks', see FILTER_STATS_FIELDS); subjects under minValidPercent are returned as NaN, without blocks
+def filterPupil(ids, pupil, validEyes, pupilFilter):
+    numRows = len(pupil)
+    numPoints = pupilFilter.numPoints
+    blockSize = pupilFilter.blockSize
+    validPercent = _ratio(validEyes * 100.0, numRows * 2)
+    stats = {'row.numb' : numRows, 'valid.data' : validEyes / 2.0, 'valid_percent' : validPercent,
+             'resting' : float('nan'), 'blocks' : []}
+
+    filtered = np.full(numRows, np.nan)
+    interp = np.full(numRows, np.nan)
+    if numRows == 0 or not validPercent >= pupilFilter.minValidPercent:
+        print('only %d out of %d data points (%.2f%%) have valid values, the pupil data is not filtered' %
+              (validEyes, numRows * 2, validPercent if numRows else 0))
+        return filtered, interp, stats
+
+    for start in range(0, numRows, blockSize):
+        #every block but the last also has numPoints rows on both sides; only its middle rows are kept
+        lastBlock = start + 1 + blockSize >= numRows
+        if lastBlock:
+            stop = numRows
+            spanRows = numRows - start
+        else:
+            stop = min(start + blockSize + 2 * numPoints + 1, numRows)
+            spanRows = blockSize + 2 * numPoints + 1
+        keepStart = start + numPoints if start > 0 else start
+        keepStop = numRows if lastBlock else min(start + blockSize + numPoints, numRows)
+
+        x = ids[start:stop]
+        y = pupil[start:stop].copy()
+        numValid = np.count_nonzero(~np.isnan(y))
+
+        lower, upper = _fitBounds(x, y, spanRows, numPoints, pupilFilter.se)
+        dropped = ~np.isnan(y) & ((y < lower) | (y > upper))
+        y[dropped] = np.nan
+        numFiltered = int(np.count_nonzero(dropped))
+
+        missing = np.isnan(y) & ~np.isnan(x)
+        filled = _fillMissing(x, y, spanRows, numPoints)
+        filled[_longGaps(x, missing, pupilFilter.maxInterp)] = np.nan
+        numInterpolated = int(np.count_nonzero(missing & ~np.isnan(filled)))
+
+        if keepStart < keepStop:
+            filtered[keepStart:keepStop] = y[keepStart - start:keepStop - start]
+            interp[keepStart:keepStop] = filled[keepStart - start:keepStop - start]
+
+        stats['blocks'].append({
+            'row.numb' : numRows,
+            'valid.data' : stats['valid.data'],
+            'block' : start + 1,
+            'filtered_numb' : numFiltered,
+            'filtered_perc' : _ratio(numFiltered * 100.0, numValid),
+            'interpolated_numb' : numInterpolated,
+            'interpolated_perc' : _ratio(numInterpolated * 100.0, np.count_nonzero(missing)),
+        })
+
+    if not np.isnan(interp).all():
+        stats['resting'] = float(np.nanmean(interp))
+    return filtered, interp, stats
+
+
+#Sets remove_trial: interp_av_pupil without the data of the trials that have too little of it
+#A trial is checked on its experiment rows (TrainorExp Exp) that are not Fixation rows; if less than threshold %
+#of them have an interp_av_pupil value, those rows get NaN (its Fixation rows keep their data, like in the R script)
+#Returns (headers with remove_trial named, frame, stats: 'trials' checked, 'removed_trials' and 'removed_trial_ids')
+def removeTrials(headers, frame, threshold):
+    interp = np.asarray(frame[colInterpPupil], dtype=np.float64)
+    trialId = np.asarray(frame[colTrialId], dtype=np.float64)
+    checked = ((frame[colTrainorExp] == 'Exp').to_numpy(dtype=bool) &
+               (frame[colCurrentObject] != 'Fixation').to_numpy(dtype=bool) & ~np.isnan(trialId))
+
+    #one pass over the rows: rows checked and rows with data of every trial
+    trialIds, trialOfRow = np.unique(trialId[checked], return_inverse=True)
+    numChecked = np.bincount(trialOfRow, minlength=len(trialIds))
+    numValid = np.bincount(trialOfRow, weights=~np.isnan(interp[checked]), minlength=len(trialIds))
+    removed = numValid * 100.0 < threshold * numChecked
+
+    removeTrial = interp.copy()
+    removeTrial[np.flatnonzero(checked)[removed[trialOfRow]]] = np.nan
+    removedIds = [int(trial) if trial == int(trial) else float(trial) for trial in trialIds[removed]]
+    subject = subjectName(frame)
+    if removedIds:
+        print('Subject %s does not have enough data in %d trials (%s), their data points are removed' %
+              (subject, len(removedIds), ', '.join(str(trial) for trial in removedIds)))
+
+    frame = frame.copy()
+    frame[colRemoveTrials] = removeTrial
+    stats = {'Subject' : subject, 'trials' : len(trialIds), 'removed_trials' : len(removedIds),
+             'removed_trial_ids' : removedIds}
+    return _namedHeaders(headers, [colRemoveTrials]), frame, stats
+
+
+#Filter stats report of the subjects (stats from PupilFilter.apply), one row per block
+def filterStatsFrame(subjectStats):
+    rows = []
+    for stats in subjectStats:
+        rows.extend(stats.get('blocks', []))
+    frame = pd.DataFrame(rows, columns=FILTER_STATS_FIELDS[:8])
+
+    #totals of every subject over its blocks, as parts of its valid data and of its rows
+    totals = frame.groupby('Subject', sort=False)[['filtered_numb', 'interpolated_numb']].transform('sum')
+    frame['subj_filtered_row_numb'] = totals['filtered_numb']
+    frame['subj_filtered_row_perc'] = frame['subj_filtered_row_numb'] / frame['valid.data']
+    frame['subj_filtered_row_perc_total'] = frame['subj_filtered_row_numb'] / frame['row.numb']
+    frame['subj_interpolated_row_numb'] = totals['interpolated_numb']
+    frame['subj_interpolated_row_perc'] = frame['subj_interpolated_row_numb'] / frame['valid.data']
+    frame['subj_interpolated_row_perc_total'] = frame['subj_interpolated_row_numb'] / frame['row.numb']
+    return frame
+
+
+#Resting pupil of every filtered subject (avg interp_av_pupil), like RestingStats of the R script
+def restingStatsFrame(subjectStats):
+    return pd.DataFrame([{'Subject' : stats['Subject'], 'resting' : stats['resting']}
+                         for stats in subjectStats if stats.get('blocks')], columns=['Subject', 'resting'])
+
+
+#Trials checked and removed of every subject (stats from removeTrials)
+def removedTrialsFrame(subjectStats):
+    rows = []
+    for stats in subjectStats:
+        if 'removed_trials' in stats:
+            rows.append({'Subject' : stats['Subject'], 'trials' : stats['trials'],
+                         'removed_trials' : stats['removed_trials'],
+                         'removed_trial_ids' : ' '.join(str(trial) for trial in stats['removed_trial_ids'])})
+    return pd.DataFrame(rows, columns=['Subject', 'trials', 'removed_trials', 'removed_trial_ids'])
+
+
+#Path of a report that goes next to the filter stats, e.g. filter.csv -> filter_resting.csv
+def siblingPath(path, suffix):
+    stem, extension = os.path.splitext(path)
+    return stem + '_' + suffix + (extension or '.csv')
+
+
+#Writes the stats of the filter stages (CSV, like the R scripts): the filter stats to path, the resting stats
+#(<path>_resting) next to it, and the removed trials of every subject (<path>_removed_trials)
+#Only the stages that ran are written
+def writeFilterStats(path, subjectStats):
+    if any('blocks' in stats for stats in subjectStats):
+        filterStatsFrame(subjectStats).to_csv(path)
+        restingStatsFrame(subjectStats).to_csv(siblingPath(path, 'resting'))
+    if any('removed_trials' in stats for stats in subjectStats):
+        removedTrialsFrame(subjectStats).to_csv(siblingPath(path, 'removed_trials'), index=False)
@@ -0,0 +1,158 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from setpupil.columns import colACC, colCategory, colSETornoSET
+from setpupil.windows import DEFAULT_SCHEDULE, EMPTY_WINDOW
+
+########################################################################################################
+#########################################  Grand average  ##############################################
+########################################################################################################
+# Cohort time courses of TEPR/TEPR_fix/IEPR without the cohort time series: every subject's binned rows
+# are summed by (SETornoSET, Category, ACC, Window, WindowTimeNormalized) when the subject is aggregated
+# (subjectTimeCourse: count and sum of every measure), which is a few thousand numbers.
+# GrandAverage folds those tables in as the subjects finish, grouped by the conditions asked for: it keeps
+# the number of samples, and the number, sum and sum of squares of the subject means of every
+# (condition, Window, WindowTimeNormalized), so the cohort mean and SE (over subjects) come out at the end.
+# The subject means can be kept as well, one row per subject and cell.
+# Only the binned rows (AVG_SAME_TIME) have a WindowTimeNormalized, so there is no time course without them.
+########################################################################################################
+
+#Measures of the time courses (new columns of the time series)
+MEASURES = ['TEPR', 'TEPR_fix', 'IEPR']
+
+#Trial fields the time courses can be grouped by
+TIMECOURSE_FIELDS = [
+    ('SETornoSET', colSETornoSET),
+    ('Category', colCategory),
+    ('ACC', colACC),
+]
+
+#Columns that place a cell on the time course
+TIME_KEYS = ['Window', 'WindowTimeNormalized']
+
+
+#Count and sum of every measure of the binned rows of a subject, by TIMECOURSE_FIELDS and TIME_KEYS
+#frame holds the binned rows, new_columns their new columns (see pipeline.newColumns), schedule the WindowSchedule
+#of their windows (the one of SET if None)
+#Returns a data frame indexed by the fields and keys, with <measure>_n and <measure>_sum columns;
+#None when the rows have no WindowTimeNormalized (no time bins)
+def subjectTimeCourse(frame, new_columns, schedule=None):
+    schedule = schedule or DEFAULT_SCHEDULE
+    times = new_columns['WindowTimeNormalized']
+    if np.isnan(times).all():
+        return None
+    rows = np.flatnonzero(~np.isnan(times) & (new_columns['Window'] != EMPTY_WINDOW))
+
+    cells = pd.DataFrame(index=pd.RangeIndex(len(rows)))
+    for name, col in TIMECOURSE_FIELDS:
+        cells[name] = frame[col].values[rows]
+    cells['Window'] = np.array(schedule.labels, dtype=object)[new_columns['Window'][rows].astype(np.int64)]
+    cells['WindowTimeNormalized'] = times[rows]
+    for measure in MEASURES:
+        values = new_columns[measure][rows]
+        valid = ~np.isnan(values)
+        cells[measure + '_n'] = valid.astype(np.int64)
+        cells[measure + '_sum'] = np.where(valid, values, 0.0)
+    keys = [name for name, col in TIMECOURSE_FIELDS] + TIME_KEYS
+    return cells.groupby(keys, sort=True, dropna=False, observed=True).sum()
+
+
+#Cohort time courses grouped by groupBy (names of TIMECOURSE_FIELDS, can be empty), folded in one subject at a time
+#With subjects the mean of every subject and cell is kept as well (see subjectFrame)
+#add folds in the subjectTimeCourse of a subject; merge folds in another GrandAverage (the order does not matter)
+class GrandAverage(object):
+
+    def __init__(self, groupBy=('SETornoSET',), subjects=False):
+        fields = [name for name, col in TIMECOURSE_FIELDS]
+        for name in groupBy:
+            if name not in fields:
+                raise ValueError('cannot group the time courses by %r (one of %s)' % (name, ', '.join(fields)))
+        self.groupBy = list(groupBy)
+        self.keepSubjects = subjects
+        self.totals = None
+        self.subjectMeans = []
+        self.numSubjects = 0
+
+    def add(self, course, subject=None):
+        if course is None:
+            return self
+        self.numSubjects += 1
+        if len(course) == 0:
+            return self
+        cells = course.groupby(level=self.groupBy + TIME_KEYS, sort=False, dropna=False, observed=True).sum()
+        totals = pd.DataFrame(index=cells.index)
+        means = pd.DataFrame(index=cells.index)
+        for measure in MEASURES:
+            count = cells[measure + '_n'].values
+            mean = np.full(len(cells), np.nan)
+            np.divide(cells[measure + '_sum'].values, count, out=mean, where=count > 0)
+            totals[measure + '_samples'] = count
+            totals[measure + '_subjects'] = (count > 0).astype(np.int64)
+            totals[measure + '_sum'] = np.nan_to_num(mean)
+            totals[measure + '_sumsq'] = np.nan_to_num(mean * mean)
+            means[measure] = mean
+            means[measure + '_samples'] = count
+        self._fold(totals)
+        if self.keepSubjects:
+            means.insert(0, 'Subject', subject)
+            self.subjectMeans.append(means.reset_index())
+        return self
+
+    def merge(self, other):
+        if other.groupBy != self.groupBy:
+            raise ValueError('the time courses are grouped by different fields')
+        self.numSubjects += other.numSubjects
+        if other.totals is not None:
+            self._fold(other.totals)
+        self.subjectMeans.extend(other.subjectMeans)
+        return self
+
+    def _fold(self, totals):
+        if self.totals is None:
+            self.totals = totals
+        else:
+            self.totals = self.totals.add(totals, fill_value=0)
+
+    #Cohort time courses: for every (condition, Window, WindowTimeNormalized) and measure, the mean and SE of the
+    #subject means, the number of subjects with a value and the number of samples (binned rows) behind them
+    def table(self):
+        keys = self.groupBy + TIME_KEYS
+        columns = keys + [measure + suffix for measure in MEASURES for suffix in ['_mean', '_se', '_subjects',
+                                                                                 '_samples']]
+        if self.totals is None:
+            return pd.DataFrame(columns=columns)
+        totals = self.totals
+        table = pd.DataFrame(index=totals.index)
+        for measure in MEASURES:
+            subjects = totals[measure + '_subjects'].values
+            total = totals[measure + '_sum'].values
+            mean = np.full(len(totals), np.nan)
+            np.divide(total, subjects, out=mean, where=subjects > 0)
+            #sample variance of the subject means, from their sum of squares
+            variance = np.full(len(totals), np.nan)
+            np.divide(totals[measure + '_sumsq'].values - total * mean, subjects - 1, out=variance,
+                      where=subjects > 1)
+            table[measure + '_mean'] = mean
+            table[measure + '_se'] = np.sqrt(np.maximum(variance, 0)) / np.sqrt(np.maximum(subjects, 1))
+            table[measure + '_subjects'] = subjects.astype(np.int64)
+            table[measure + '_samples'] = totals[measure + '_samples'].values.astype(np.int64)
+        return table.reset_index().sort_values(self.groupBy + ['WindowTimeNormalized', 'Window'],
+                                               kind='mergesort').reset_index(drop=True)[columns]
+
+    #Mean of every subject and cell (with subjects), one row per subject and cell
+    def subjectFrame(self):
+        if not self.subjectMeans:
+            return pd.DataFrame(columns=['Subject'] + self.groupBy + TIME_KEYS)
+        return pd.concat(self.subjectMeans, ignore_index=True)
+
+
+#Writes the cohort time courses (CSV if path ends with .csv, tab separated otherwise), and with the subject means
+#(GrandAverage subjects) those next to it (<path>_subjects)
+def writeGrandAverage(path, grandAverage):
+    sep = ',' if path.endswith('.csv') else '\t'
+    grandAverage.table().to_csv(path, sep=sep, index=False)
+    if grandAverage.keepSubjects:
+        stem, extension = os.path.splitext(path)
+        grandAverage.subjectFrame().to_csv(stem + '_subjects' + (extension or '.tsv'), sep=sep, index=False)
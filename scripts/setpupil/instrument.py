@@ -0,0 +1,102 @@
+import cProfile
+import json
+import os
+import sys
+import timeit
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+########################################################################################################
+#########################################  Run report  #################################################
+########################################################################################################
+# Every stage of every subject adds a record to the run report:
+#   subject, stage, seconds (wall time), rows_in, rows_out, peak_rss_mb (peak memory of the process so far)
+# Stages of a subject: read, filter (pupil filter) and trials (trial removal) for raw exports only, select
+# (experiment rows), windows, bins, aggregate, format (time series rows) and write (to the output), or cache
+# when the results came from the subject cache. The report is written as JSON or CSV (by the extension of
+# the file), so a slow run can be traced back to the stage and the subject that caused it.
+########################################################################################################
+
+REPORT_FIELDS = ['subject', 'stage', 'seconds', 'rows_in', 'rows_out', 'peak_rss_mb']
+
+
+#Peak resident set size of this process in MB, None where the resource module is missing (Windows)
+def peakRssMb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return peak / 1024.0 / 1024.0
+    return peak / 1024.0
+
+
+#Times the stages of one subject and appends their records to report (a list)
+#   timer.start('bins', rowsIn) ... timer.stop(rowsOut)
+#rowsIn can also be given to stop() when it is only known once the stage ran (e.g. the rows of a file)
+class StageTimer(object):
+
+    def __init__(self, subject, report=None):
+        self.subject = subject
+        self.report = report if report is not None else []
+        self.stage = None
+
+    def start(self, stage, rowsIn):
+        self.stage = (stage, rowsIn, timeit.default_timer())
+
+    def stop(self, rowsOut, rowsIn=None):
+        stage, startRowsIn, started = self.stage
+        self.stage = None
+        if rowsIn is None:
+            rowsIn = startRowsIn
+        self.report.append({
+            'subject' : self.subject,
+            'stage' : stage,
+            'seconds' : timeit.default_timer() - started,
+            'rows_in' : rowsIn,
+            'rows_out' : rowsOut,
+            'peak_rss_mb' : peakRssMb(),
+        })
+
+
+#Writes the records of a run to path: CSV if it ends with .csv, JSON otherwise
+def writeReport(path, report):
+    if path.endswith('.csv'):
+        pd.DataFrame(report, columns=REPORT_FIELDS).to_csv(path, index=False)
+    else:
+        with open(path, 'w') as jsonfile:
+            json.dump(report, jsonfile, indent=1)
+
+
+#Totals of a report by stage (seconds and rows summed over the subjects), e.g. to see which stage got slower
+def stageTotals(report):
+    frame = pd.DataFrame(report, columns=REPORT_FIELDS)
+    return frame.groupby('stage', sort=False)[['seconds', 'rows_in', 'rows_out']].sum()
+
+
+#Profile hook: which subject to profile and where the cProfile stats go
+#subject matches the file name or the path of the subject file; the stats are written to statsPath
+#(default: <file name>.prof in the current directory) and can be read with pstats
+class ProfileHook(object):
+
+    def __init__(self, subject, statsPath=None):
+        self.subject = subject
+        self.statsPath = statsPath
+
+    def matches(self, path):
+        return self.subject in (path, os.path.basename(path))
+
+    #Calls function(*args, **kwargs) under cProfile and writes the stats
+    def run(self, path, function, *args, **kwargs):
+        statsPath = self.statsPath or os.path.basename(path) + '.prof'
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            profiler.dump_stats(statsPath)
+            print('profile of %s written to %s' % (os.path.basename(path), statsPath))
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from setpupil.columns import CATEGORY_COLUMNS, FLOAT_COLUMNS, INT_COLUMNS, PIPELINE_COLUMNS
+from setpupil.columns import colTrainorExp, colRemoveTrials
+
+########################################################################################################
+#########################################  Tobii export reader  ########################################
+########################################################################################################
+# The exports are tab separated with a header line; R quotes the strings ("Exp", "firstitem", ...)
+# Instead of splitting every line and keeping every cell as a python string, we only read the columns
+# we need, numbers go straight into float arrays (NA -> NaN) and the text columns with a few values
+# (CATEGORY_COLUMNS) become categoricals, which keeps one copy of "firstitem" per file instead of one per
+# row. The other text columns (row IDs, ...) are different on every row and are kept as text.
+########################################################################################################
+
+#Values that mean "no data" in the numeric columns
+NA_VALUES = ['NA', 'NaN', 'nan', '']
+
+
+#Reads the header line of an export and strips the quotes around the names
+def readHeaders(path):
+    with open(path, 'r') as tsvfile:
+        return parseHeaders(tsvfile.readline())
+
+
+#Header names of a header line, without the quotes around them
+def parseHeaders(line):
+    headers = []
+    for h in line.rstrip('\r\n').split('\t'):
+        if len(h) > 1 and h[0] == '"' and h[-1] == '"':
+            headers.append(h[1:-1])
+        else:
+            headers.append(h)
+    return headers
+
+
+#Columns to read for a run: what the pipeline uses plus what goes to the output file
+#outputColumns is settings.columns (only the keys are used, same as when writing the output)
+def columnsToRead(outputColumns=None):
+    usecols = set(PIPELINE_COLUMNS)
+    if outputColumns is not None:
+        usecols.update(outputColumns)
+    return sorted(usecols)
+
+
+#Reads an export into a data frame whose column labels are the column numbers (colTETTime, ...)
+#Returns the header names of the file as well so the output can be labeled
+#Rows that are shorter than NUM_COLUMNS end up with a missing remove_trial value, so experimentRows drops them
+def readTobiiExport(path, usecols=None):
+    headers = readHeaders(path)
+    return headers, readExportRows(path, headers, usecols, skiprows=1)
+
+
+#Reads rows of an export from source (a path or a file object) with the types described above
+#headers are the header names of the export (the rows are read from the first line of source after skiprows)
+def readExportRows(source, headers, usecols=None, skiprows=0):
+    if usecols is None:
+        usecols = PIPELINE_COLUMNS
+    #raw exports (before filter_with_stat_report.R) end before interp_av_pupil
+    usecols = [c for c in sorted(set(usecols)) if c < len(headers)]
+
+    dtypes = {}
+    na_values = {}
+    for c in usecols:
+        if c in FLOAT_COLUMNS or c in INT_COLUMNS:
+            dtypes[c] = np.float64
+            na_values[c] = NA_VALUES
+        elif c in CATEGORY_COLUMNS:
+            dtypes[c] = 'category'
+        else:
+            dtypes[c] = str
+
+    return pd.read_csv(source, sep='\t', header=None, skiprows=skiprows, usecols=usecols, dtype=dtypes,
+                       na_values=na_values, keep_default_na=False, float_precision='round_trip')
+
+
+#Whether a column holds the pass-through text of the loader (object, or the string dtype of newer pandas)
+def isText(values):
+    return values.dtype == object or isinstance(values.dtype, pd.StringDtype)
+
+
+#Keeps the experimental rows (no practice) that have pupil data after removing bad trials
+def experimentRows(frame):
+    keep = (frame[colTrainorExp] == 'Exp').to_numpy() & frame[colRemoveTrials].notna().to_numpy()
+    return frame[keep].reset_index(drop=True)
+
+
+#Writes a cell back out the way it looked in the export (NA for missing numbers)
+#Whole numbers are written without '.0', like R's write.csv does (e.g. -1 for a missing pupil diameter)
+def formatCell(col, value):
+    if isinstance(value, float):
+        if np.isnan(value):
+            return 'NA'
+        if col in INT_COLUMNS:
+            return '%d' % value
+        text = repr(float(value))
+        if text.endswith('.0'):
+            text = text[:-2]
+        return text
+    return str(value)
+
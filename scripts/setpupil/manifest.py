@@ -0,0 +1,178 @@
+import json
+import os
+import tempfile
+
+from setpupil import loader
+from setpupil.columns import colSubject
+
+########################################################################################################
+#########################################  Input manifest  #############################################
+########################################################################################################
+# The subject files of an input directory are listed with one os.scandir pass (the size and mtime come
+# with the directory entries, glob had to stat every file again). The manifest keeps, for every file, its
+# size, mtime, Subject (first row of the file) and number of rows in a JSON file; a run only reads the
+# files that are new or changed since the last one, and drops the ones that are gone.
+# The manifest gives:
+#   the number of rows of every file, so the workers can get the largest subjects first (see
+#   pipeline._orderedMap) and one big file does not start last and hold up the end of the run
+#   the files of some subjects (by Subject): the directory is listed, but of the other files only the ones
+#   that are new or changed are opened, and only their first data row is read
+########################################################################################################
+
+#Bump when the fields of the entries change
+MANIFEST_VERSION = 1
+
+#Bytes read at a time when counting the lines of a file
+SCAN_CHUNK = 1 << 22
+
+
+#Subject files of directory (name ends with extension, not hidden, like glob's *.tsv), sorted by path
+#With recursive the subdirectories are listed as well (not the hidden ones, e.g. a cache or store directory)
+#Returns [(path, os.stat_result)]
+def scanInputs(directory, extension='.tsv', recursive=False):
+    found = []
+    pending = [directory]
+    while pending:
+        for entry in os.scandir(pending.pop()):
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                if recursive:
+                    pending.append(entry.path)
+            elif entry.name.endswith(extension) and entry.is_file():
+                found.append((entry.path, entry.stat()))
+    return sorted(found, key=lambda pathAndStat: pathAndStat[0])
+
+
+#Subject of a data line (the Subject cell), None for an empty line
+def _lineSubject(line):
+    if not line.strip():
+        return None
+    cells = loader.parseHeaders(line.decode('utf-8', 'replace'))
+    return cells[colSubject] if len(cells) > colSubject else None
+
+
+#Subject of an export (Subject column of the first row, None for a file without rows), from its first two lines
+def readSubject(path):
+    with open(path, 'rb') as datafile:
+        datafile.readline()
+        return _lineSubject(datafile.readline())
+
+
+#Subject (see readSubject) and number of rows of an export, read in one pass over the bytes of the file
+def describeInput(path):
+    subject = None
+    lines = 0
+    last = b'\n'
+    head = b''
+    with open(path, 'rb') as datafile:
+        chunk = datafile.read(SCAN_CHUNK)
+        while chunk:
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+            if head.count(b'\n') < 2:
+                head += chunk
+            chunk = datafile.read(SCAN_CHUNK)
+    if last != b'\n':
+        #the last line has no line break
+        lines += 1
+    firstLines = head.split(b'\n', 2)
+    if len(firstLines) > 1:
+        subject = _lineSubject(firstLines[1])
+    return subject, max(lines - 1, 0)
+
+
+#Manifest of the subject files, stored as JSON in path (read from there if it is there and of this version)
+#entries: absolute path -> {'size', 'mtime', 'subject', 'rows'}
+class Manifest(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(path, 'r') as jsonfile:
+                stored = json.load(jsonfile)
+            if stored.get('version') == MANIFEST_VERSION:
+                self.entries = stored['entries']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    #Whether the entry of a file is there and matches its size and mtime
+    def _current(self, path, stat):
+        entry = self.entries.get(os.path.abspath(path))
+        return entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+    #Entry of a file, read again if its size or mtime changed
+    def _entry(self, path, stat):
+        key = os.path.abspath(path)
+        entry = self.entries.get(key)
+        if not self._current(path, stat):
+            subject, rows = describeInput(path)
+            entry = {'size' : stat.st_size, 'mtime' : stat.st_mtime, 'subject' : subject, 'rows' : rows}
+            self.entries[key] = entry
+            self.changed = True
+        return entry
+
+    #Brings the entries of directory up to date (see scanInputs) and returns its subject files, sorted by path
+    def update(self, directory, extension='.tsv', recursive=False):
+        found = scanInputs(directory, extension, recursive)
+        for path, stat in found:
+            self._entry(path, stat)
+        self._dropGone(directory, found, extension, recursive)
+        return [path for path, stat in found]
+
+    #Files of the subjects (values of the Subject column) in directory, sorted by path
+    #The directory is listed (a new file of a known subject is found too), the entries of the files of the subjects
+    #are brought up to date; of the other files, the new or changed ones only get their first row read
+    def select(self, directory, subjects, extension='.tsv', recursive=False):
+        wanted = set(str(subject) for subject in subjects)
+        found = scanInputs(directory, extension, recursive)
+        paths = []
+        for path, stat in found:
+            if self._current(path, stat):
+                subject = self.entries[os.path.abspath(path)]['subject']
+            else:
+                subject = readSubject(path)
+            if subject in wanted:
+                self._entry(path, stat)
+                paths.append(path)
+        self._dropGone(directory, found, extension, recursive)
+        return paths
+
+    #Drops the entries of the files of directory that are not in found (scanInputs) anymore
+    def _dropGone(self, directory, found, extension, recursive):
+        root = os.path.abspath(directory)
+        current = set(os.path.abspath(path) for path, stat in found)
+        for key in list(self.entries):
+            inside = key.startswith(root + os.sep) if recursive else os.path.dirname(key) == root
+            if inside and key not in current and key.endswith(extension):
+                del self.entries[key]
+                self.changed = True
+
+    #Brings the entries of paths up to date (only those files are looked at)
+    def refresh(self, paths):
+        for path in paths:
+            self._entry(path, os.stat(path))
+
+    #Number of rows of every file of paths (from the entries, refreshed first)
+    def rows(self, paths):
+        self.refresh(paths)
+        return [self.entries[os.path.abspath(path)]['rows'] for path in paths]
+
+    #Writes the manifest if an entry changed (to a temporary file first, so a manifest is always complete)
+    def save(self):
+        if not self.changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, tmpPath = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+        try:
+            with os.fdopen(handle, 'w') as jsonfile:
+                json.dump({'version' : MANIFEST_VERSION, 'entries' : self.entries}, jsonfile, sort_keys=True)
+            os.replace(tmpPath, self.path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        self.changed = False
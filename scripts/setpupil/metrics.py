@@ -0,0 +1,341 @@
+import numpy as np
+import pandas as pd
+
+from setpupil.columns import colSubject, colTrialId, colACC, colRT, colCategory, colSETornoSET
+from setpupil.columns import colPosition_false_shape, colCurrentObject, colRemoveTrials
+from setpupil.windows import DEFAULT_SCHEDULE
+from setpupil.conditions import moments
+from setpupil.trials import buildTrialIndex
+
+########################################################################################################
+#########################################  Trial metrics  ##############################################
+########################################################################################################
+# One pass over the (binned) rows that computes everything the old baseline/fix/window passes did:
+#   baseline: avg pupil of the firstitem rows of the trial (TEPR = pupil - baseline)
+#   fix:      avg pupil of the fixation cross after each item (TEPR_fix = pupil - fix1, IEPR = pupil - previous fix)
+#   window:   avg pupil of every window of the trial (fix1_pupil_av ... fix4_pupil_av, TEPR_Fix2Fix3avg)
+# The old passes started the sums of a baseline or window again at every new run of its rows, so the rows are
+# indexed by run (a trial index, setpupil/trials.py, with the object or window runs as its segments): a baseline
+# or window is the sum of the row range of its last segment, a fix the sum of the rows of its fix# segments.
+# The objects, items and windows (firstitem, fix2/fix3, ...) are the ones of the window schedule (see
+# setpupil/windows.py), so a variant of the task only needs another schedule.
+# Only pupil values > 0 are averaged. Sums are accumulated in row order, so the averages are the same numbers
+# the row loops produced (loopTrialMetrics keeps those loops; python -m setpupil.benchmark --check compares the two).
+########################################################################################################
+
+#New columns computed here, the rest (Window, PupilAvgRoll, WindowTimeNormalized) come from the earlier stages
+METRIC_COLUMNS = ['PupilAvg', 'TrialBaseline', 'TEPR', 'TEPR_fix', 'IEPR']
+
+#Summary columns taken from the first row of every trial
+TRIAL_FIELDS = [
+    ('Subject', colSubject),
+    ('Trial', colTrialId),
+    ('ACC', colACC),
+    ('RT', colRT),
+    ('Category', colCategory),
+    ('SETornoSET', colSETornoSET),
+    ('Position_false_shape', colPosition_false_shape),
+]
+
+
+#NA numbers count as 0, like str2int/str2float did
+def _asInt(values):
+    return np.nan_to_num(np.asarray(values, dtype=np.float64)).astype(np.int64)
+
+
+def _asFloat(values):
+    return np.nan_to_num(np.asarray(values, dtype=np.float64))
+
+
+#Sum and count of the values > 0 of every group, added up in row order (np.bincount goes through the rows in order)
+def _groupTotals(groups, numGroups, values):
+    positive = values > 0
+    count = np.bincount(groups[positive], minlength=numGroups)
+    total = np.bincount(groups[positive], weights=values[positive], minlength=numGroups)
+    avg = np.zeros(numGroups)
+    np.divide(total, count, out=avg, where=count > 0)
+    return count, total, avg
+
+
+#Sum and count of the values > 0 of the rows of every segment of a trial index (values by row of the index)
+def _segmentTotals(index, values):
+    return _groupTotals(index.segmentOfRows(), len(index.segmentStarts), values)
+
+
+#The last of segments (segment numbers, in row order) for every key (arrays with a value per segment), in row order
+def _lastSegments(segments, *keys):
+    reverse = segments[::-1]
+    first = ~pd.MultiIndex.from_arrays([key[reverse] for key in keys]).duplicated()
+    return reverse[first][::-1]
+
+
+#Looks up (trial, key) pairs in an index of groups, -1 where the group does not exist
+def _lookup(index, trialIds, keys):
+    return index.get_indexer(pd.MultiIndex.from_arrays([trialIds, keys]))
+
+
+#Computes the per-row metric columns and the per-trial summary for one subject
+#frame holds the (binned) rows, windows their window codes (see setpupil/windows.py) and pupilAvgRoll their
+#rolling avg (NaN if missing)
+#rolling says whether the rolling avg or the plain (bin) avg is used for the calculations (ROLLING)
+#schedule is the WindowSchedule the windows come from (setpupil/windows.py), the one of SET if None
+#Returns (new column arrays, trialDataMap, biasMap, encodingStrategyMap):
+#   the new column arrays are NaN where the old passes left the column empty
+#   trialDataMap[TrialId] has the summary fields of the trial (a fix#_pupil_av for every fix# window of the schedule)
+#   biasMap and encodingStrategyMap have the stats (conditions.Moments) of the pupil values of the bias and encoding
+#   windows (fix3, fix2/fix3) of the correct trials by condition
+def computeTrialMetrics(frame, windows, pupilAvgRoll, rolling, schedule=None):
+    schedule = schedule or DEFAULT_SCHEDULE
+    numRows = len(frame)
+    windows = np.asarray(windows)
+    pupilAvgRoll = np.asarray(pupilAvgRoll, dtype=np.float64)
+
+    objects = pd.Categorical(frame[colCurrentObject])
+    lowerObjects = np.append(np.array([str(c).lower() for c in objects.categories], dtype=object), '')
+    codes = np.asarray(objects.codes)
+    lower = lowerObjects[codes]
+    mapped = np.isin(lower, list(schedule.objects.keys()))
+    itemNumber = np.array([schedule.itemNumbers.get(o, 0) for o in lowerObjects], dtype=np.int64)[codes]
+
+    trialIds = _asInt(frame[colTrialId])
+    pupilValidOnly = _asFloat(frame[colRemoveTrials])
+    diamAvg = np.nan_to_num(pupilAvgRoll) if rolling else pupilValidOnly
+
+    new_columns = {}
+    for name in METRIC_COLUMNS:
+        new_columns[name] = np.full(numRows, np.nan)
+
+    ### baseline: rows without a rolling avg are skipped ###
+    hasRolling = ~np.isnan(pupilAvgRoll)
+    new_columns['PupilAvg'][hasRolling] = pupilValidOnly[hasRolling]
+
+    rows = np.flatnonzero(hasRolling & mapped)
+    trialDataMap = {}
+    for r in rows[~pd.Index(trialIds[rows]).duplicated()]:
+        trialId = int(trialIds[r])
+        trialDataMap[trialId] = {}
+        for name, col in TRIAL_FIELDS:
+            if col in (colTrialId, colACC, colRT):
+                trialDataMap[trialId][name] = int(np.nan_to_num(frame[col].values[r]))
+            else:
+                trialDataMap[trialId][name] = frame[col].values[r]
+
+    #the baseline is the last run of the baseline object in the trial (the old pass only counted these rows)
+    objectRuns = buildTrialIndex(trialIds[rows], codes[rows])
+    segmentTrials = trialIds[rows][objectRuns.segmentStarts]
+    isBaseline = lowerObjects[objectRuns.segmentWindows] == schedule.baseline
+    baselineSegments = _lastSegments(np.flatnonzero(isBaseline), segmentTrials)
+    baselineAvg = _segmentTotals(objectRuns, diamAvg[rows])[2][baselineSegments]
+    baselineIndex = pd.Index(segmentTrials[baselineSegments])
+
+    ### window runs of the rows of the schedule's objects ###
+    rows = np.flatnonzero(mapped)
+    windowTrials = pd.unique(trialIds[rows])
+    windowRuns = buildTrialIndex(trialIds[rows], windows[rows])
+    segmentTrials = trialIds[rows][windowRuns.segmentStarts]
+
+    ### fix: the rows of the fix# segments, by trial and item ###
+    fixRows = np.isin(windowRuns.segmentWindows, schedule.fixCodes)[windowRuns.segmentOfRows()]
+    fixRows &= itemNumber[rows] > 0
+    fixGroups, fixKeys = pd.factorize(pd.MultiIndex.from_arrays([trialIds[rows][fixRows], itemNumber[rows][fixRows]]))
+    fixAvg = _groupTotals(fixGroups, len(fixKeys), diamAvg[rows][fixRows])[2]
+    fixIndex = fixKeys if len(fixKeys) else None
+
+    ### window: avg of every window of the trial, from its last segment ###
+    lastSegments = _lastSegments(np.arange(len(segmentTrials)), segmentTrials, windowRuns.segmentWindows)
+    windowCount, windowTotal, windowAvg = [totals[lastSegments] for totals in _segmentTotals(windowRuns, diamAvg[rows])]
+    windowKeys = pd.MultiIndex.from_arrays([segmentTrials[lastSegments], windowRuns.segmentWindows[lastSegments]])
+    windowIndex = windowKeys if len(windowKeys) else None
+    encodingCodes = [schedule.code[window] for window in schedule.encodingWindows if window in schedule.code]
+
+    for trialId in windowTrials:
+        if trialId not in trialDataMap:
+            continue
+        for window in schedule.fixWindows:
+            trialDataMap[trialId][window + '_pupil_av'] = 'NA'
+
+    for g, (trialId, window) in enumerate(windowKeys):
+        window = schedule.labels[window]
+        if trialId in trialDataMap and window in schedule.fixWindows:
+            trialDataMap[trialId][window + '_pupil_av'] = windowAvg[g]
+
+    for trialId in windowTrials:
+        if trialId not in trialDataMap:
+            continue
+        total = 0
+        count = 0
+        for window in encodingCodes:
+            if windowIndex is not None and (trialId, window) in windowIndex:
+                g = windowIndex.get_loc((trialId, window))
+                total += windowTotal[g]
+                count += windowCount[g]
+        trialDataMap[trialId]['TEPR_Fix2Fix3avg'] = total / count if count > 0 else 'NA'
+
+    ### set biasMap and encodingStrategyMap values ###
+    rowWindows = windows[rows]
+    acc = _asInt(frame[colACC])[rows]
+    setOrNoSet = np.asarray(frame[colSETornoSET], dtype=object)[rows]
+    category = np.asarray(frame[colCategory], dtype=object)[rows]
+    positionFalseShape = np.asarray(frame[colPosition_false_shape], dtype=object)[rows]
+    correct = (diamAvg[rows] > 0) & (acc == 1)
+    isSet = setOrNoSet == 'SET'
+    bias = correct & (rowWindows == schedule.code.get(schedule.biasWindow, -1))
+    encoding = correct & isSet & np.isin(rowWindows, encodingCodes)
+    biasMap = {
+        'SET' : moments(diamAvg[rows][bias & isSet]),
+        'noSET' : moments(diamAvg[rows][bias & ~isSet & (positionFalseShape == '3')]),
+    }
+    encodingStrategyMap = {
+        'span1 or span2' : moments(diamAvg[rows][encoding & (category != 'span3')]),
+        'span3' : moments(diamAvg[rows][encoding & (category == 'span3')]),
+    }
+
+    ### TEPR/TEPR_fix/IEPR for the item windows ###
+    rows = np.flatnonzero(mapped & (itemNumber > 0))
+    trials = trialIds[rows]
+    diam = diamAvg[rows]
+    positive = diam > 0
+
+    baseline = baselineIndex.get_indexer(trials)
+    hasBaseline = baseline >= 0
+    new_columns['TrialBaseline'][rows[hasBaseline]] = baselineAvg[baseline[hasBaseline]]
+    tepr = hasBaseline & positive
+    new_columns['TEPR'][rows[tepr]] = diam[tepr] - baselineAvg[baseline[tepr]]
+
+    if fixIndex is not None:
+        items = itemNumber[rows]
+        fix1 = _lookup(fixIndex, trials, np.ones(len(rows), dtype=np.int64))
+        teprFix = positive & (fix1 >= 0)
+        new_columns['TEPR_fix'][rows[teprFix]] = diam[teprFix] - fixAvg[fix1[teprFix]]
+
+        #IEPR uses the fixation of the previous item, or of the item itself if there is none
+        fix = _lookup(fixIndex, trials, items - 1)
+        fix = np.where(fix >= 0, fix, _lookup(fixIndex, trials, items))
+        iepr = positive & (fix >= 0)
+        new_columns['IEPR'][rows[iepr]] = diam[iepr] - fixAvg[fix[iepr]]
+
+    return new_columns, trialDataMap, biasMap, encodingStrategyMap
+
+
+#The metrics as the old baseline, fix, window and item passes computed them, row by row (same arguments as
+#computeTrialMetrics), to check computeTrialMetrics against (python -m setpupil.benchmark --check)
+#Returns (new column arrays, trialDataMap) like computeTrialMetrics, without the bias and encoding stats
+def loopTrialMetrics(frame, windows, pupilAvgRoll, rolling, schedule=None):
+    schedule = schedule or DEFAULT_SCHEDULE
+    numRows = len(frame)
+    rawObjects = [str(o) for o in frame[colCurrentObject]]
+    objects = [o.lower() for o in rawObjects]
+    trialIds = _asInt(frame[colTrialId])
+    pupilValidOnly = _asFloat(frame[colRemoveTrials])
+    pupilAvgRoll = np.asarray(pupilAvgRoll, dtype=np.float64)
+    diamAvg = np.nan_to_num(pupilAvgRoll) if rolling else pupilValidOnly
+
+    new_columns = {}
+    for name in METRIC_COLUMNS:
+        new_columns[name] = np.full(numRows, np.nan)
+
+    ### baseline pass: rows without a rolling avg are skipped, every run of the baseline object starts again ###
+    trialDataMap = {}
+    baselineMap = {}
+    prevObject = ''
+    prevTrialId = -1
+    for r in range(numRows):
+        if np.isnan(pupilAvgRoll[r]):
+            continue
+        new_columns['PupilAvg'][r] = pupilValidOnly[r]
+        if objects[r] not in schedule.objects:
+            continue
+
+        trialId = int(trialIds[r])
+        if trialId not in trialDataMap:
+            trialDataMap[trialId] = {}
+            for name, col in TRIAL_FIELDS:
+                if col in (colTrialId, colACC, colRT):
+                    trialDataMap[trialId][name] = int(np.nan_to_num(frame[col].values[r]))
+                else:
+                    trialDataMap[trialId][name] = frame[col].values[r]
+
+        if objects[r] == schedule.baseline:
+            if rawObjects[r] != prevObject or trialId != prevTrialId:
+                baselineMap[trialId] = [0, 0.0]
+            if diamAvg[r] > 0:
+                baselineMap[trialId][0] += 1
+                baselineMap[trialId][1] += diamAvg[r]
+        prevObject = rawObjects[r]
+        prevTrialId = trialId
+
+    baselineAvg = {}
+    for trialId, (count, total) in baselineMap.items():
+        baselineAvg[trialId] = total / count if count > 0 else 0.0
+
+    ### fix pass: the fix# window of every item ###
+    fixmap = {}
+    for r in range(numRows):
+        item = schedule.itemNumbers.get(objects[r], 0)
+        if windows[r] not in schedule.fixCodes or item == 0:
+            continue
+        entry = fixmap.setdefault((int(trialIds[r]), item), [0, 0.0])
+        if diamAvg[r] > 0:
+            entry[0] += 1
+            entry[1] += diamAvg[r]
+
+    fixAvg = {}
+    for key, (count, total) in fixmap.items():
+        fixAvg[key] = total / count if count > 0 else 0.0
+
+    ### window pass: every run of a window starts its sums again ###
+    windowmap = {}
+    prevWindow = -1
+    prevTrialId = -1
+    for r in range(numRows):
+        if objects[r] not in schedule.objects:
+            continue
+        trialId = int(trialIds[r])
+        if windows[r] != prevWindow or trialId != prevTrialId:
+            windowmap[(trialId, windows[r])] = [0, 0.0]
+        if diamAvg[r] > 0:
+            windowmap[(trialId, windows[r])][0] += 1
+            windowmap[(trialId, windows[r])][1] += diamAvg[r]
+        prevWindow = windows[r]
+        prevTrialId = trialId
+
+    for trialId, window in windowmap:
+        if trialId in trialDataMap:
+            for label in schedule.fixWindows:
+                trialDataMap[trialId].setdefault(label + '_pupil_av', 'NA')
+    for (trialId, window), (count, total) in windowmap.items():
+        label = schedule.labels[window]
+        if trialId in trialDataMap and label in schedule.fixWindows:
+            trialDataMap[trialId][label + '_pupil_av'] = total / count if count > 0 else 0.0
+
+    for trialId in set(trialId for trialId, window in windowmap):
+        if trialId not in trialDataMap:
+            continue
+        total = 0
+        count = 0
+        for label in schedule.encodingWindows:
+            key = (trialId, schedule.code.get(label, -1))
+            if key in windowmap:
+                count += windowmap[key][0]
+                total += windowmap[key][1]
+        trialDataMap[trialId]['TEPR_Fix2Fix3avg'] = total / count if count > 0 else 'NA'
+
+    ### item pass: TEPR/TEPR_fix/IEPR ###
+    for r in range(numRows):
+        item = schedule.itemNumbers.get(objects[r], 0)
+        if objects[r] not in schedule.objects or item == 0:
+            continue
+        trialId = int(trialIds[r])
+        if trialId in baselineAvg:
+            new_columns['TrialBaseline'][r] = baselineAvg[trialId]
+        if diamAvg[r] <= 0:
+            continue
+        if trialId in baselineAvg:
+            new_columns['TEPR'][r] = diamAvg[r] - baselineAvg[trialId]
+        if (trialId, 1) in fixAvg:
+            new_columns['TEPR_fix'][r] = diamAvg[r] - fixAvg[(trialId, 1)]
+        fix = (trialId, item - 1) if (trialId, item - 1) in fixAvg else (trialId, item)
+        if fix in fixAvg:
+            new_columns['IEPR'][r] = diamAvg[r] - fixAvg[fix]
+
+    return new_columns, trialDataMap
@@ -0,0 +1,342 @@
+import argparse
+import functools
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from setpupil.grandaverage import TIMECOURSE_FIELDS, TIME_KEYS
+from setpupil.pipeline import _orderedMap
+
+try:
+    from scipy import stats as scipyStats
+except ImportError:
+    scipyStats = None
+
+########################################################################################################
+#########################################  Permutation tests  ##########################################
+########################################################################################################
+# Cluster-based permutation tests of time courses (TEPR/TEPR_fix/IEPR), on the subject means of the grand
+# average (grandaverage.GrandAverage subjects, or the <grand average>_subjects file): a subjects x time
+# bins matrix, the bins being the (Window, WindowTimeNormalized) cells that every subject has.
+#   paired: two conditions of a trial field (e.g. SET vs noSET), every subject has both -> the signs of
+#           the subject differences are flipped at random (one-sample t of the differences)
+#   groups: two groups of subjects -> the group labels of the subjects are permuted (Welch t)
+# The resamples are done in blocks, a block being a few matrix products: the random signs (or group
+# memberships) of every resample of the block are the rows of a matrix, and its product with the data
+# gives the sums (and sums of squares) of every resample and bin at once. Clusters are runs of bins of
+# the same Window over the t threshold with the same sign; the null distribution is the largest |cluster
+# mass| (sum of t) of every resample, so the cluster p-values are corrected over the whole time course.
+# The blocks are sized to stay under maxBlockBytes and can run on a process pool. Every block draws from
+# its own seed (from the seed of the test), so the results depend on the seed and not on the workers.
+########################################################################################################
+
+#Memory (MB) a block of resamples may use
+MAX_BLOCK_MB = 64
+
+#Kinds of test
+PAIRED = 'paired'
+GROUPS = 'groups'
+
+#Columns of the bin and cluster tables of a test
+BIN_FIELDS = TIME_KEYS + ['subjects', 'effect', 't', 'p', 'p_tmax', 'cluster', 'p_cluster']
+CLUSTER_FIELDS = ['cluster', 'Window', 'start', 'end', 'bins', 'mass', 'p']
+
+
+#Quantile of the standard normal distribution (bisection on erf, which is all the math module has)
+def _normalQuantile(q):
+    low, high = -40.0, 40.0
+    for n in range(200):
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < q:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+#Cluster-forming threshold: the |t| of a two-sided alpha with df degrees of freedom (Student t quantile, from scipy if
+#it is installed, otherwise from the normal quantile with the expansion of Abramowitz & Stegun 26.7.5)
+def tThreshold(df, alpha=0.05):
+    if scipyStats is not None:
+        return float(scipyStats.t.ppf(1 - alpha / 2.0, df))
+    z = _normalQuantile(1 - alpha / 2.0)
+    return (z + (z ** 3 + z) / (4.0 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96.0 * df ** 2) +
+            (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384.0 * df ** 3) +
+            (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / (92160.0 * df ** 4))
+
+
+########################################################################################################
+#########################################  Matrices  ###################################################
+########################################################################################################
+
+#Subjects x bins matrix of a measure from the subject means (columns Subject, trial fields, Window,
+#WindowTimeNormalized, <measure>, <measure>_samples), only the rows where field is condition (all rows if field is
+#None); the trial fields that are not field are pooled (sample weighted)
+#Returns a data frame indexed by Subject, with a (Window, WindowTimeNormalized) column for every bin (NaN where a
+#subject has no value), the bins in time order and the windows in the order they start
+def subjectMatrix(subjectMeans, measure, field=None, condition=None):
+    rows = subjectMeans
+    if field is not None:
+        rows = rows[rows[field].astype(str) == str(condition)]
+    samples = rows[measure + '_samples'].values.astype(np.float64)
+    values = rows[measure].values
+    valid = ~np.isnan(values) & (samples > 0)
+    cells = pd.DataFrame({'Subject' : rows['Subject'].values[valid], 'Window' : rows['Window'].values[valid],
+                          'WindowTimeNormalized' : rows['WindowTimeNormalized'].values[valid],
+                          'total' : values[valid] * samples[valid], 'samples' : samples[valid]})
+    cells = cells.groupby(['Subject'] + TIME_KEYS, sort=False, observed=True).sum()
+    matrix = (cells['total'] / cells['samples']).unstack(TIME_KEYS)
+
+    #windows by their first bin, then the bins by time
+    bins = matrix.columns.to_frame(index=False)
+    windowStart = bins.groupby('Window')['WindowTimeNormalized'].transform('min')
+    order = np.lexsort((bins['WindowTimeNormalized'].values, bins['Window'].values, windowStart.values))
+    return matrix.iloc[:, order].sort_index()
+
+
+#Keeps the bins that every subject of every matrix has, and the subjects that are in every matrix
+def _commonCells(*matrices):
+    subjects = matrices[0].index
+    for matrix in matrices[1:]:
+        subjects = subjects.intersection(matrix.index, sort=False)
+    columns = [column for column in matrices[0].columns if all(column in matrix.columns for matrix in matrices[1:])]
+    matrices = [matrix.loc[subjects, columns] for matrix in matrices]
+    complete = np.logical_and.reduce([matrix.notna().all(axis=0).values for matrix in matrices])
+    return [matrix.loc[:, complete] for matrix in matrices]
+
+
+########################################################################################################
+#########################################  Resamples  ##################################################
+########################################################################################################
+
+#One-sample t of every row of the sums (differences of numSubjects subjects, with their sum of squares sumsq)
+def _oneSampleT(sums, sumsq, numSubjects):
+    mean = sums / numSubjects
+    variance = (sumsq - numSubjects * mean * mean) / (numSubjects - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return mean / np.sqrt(np.maximum(variance, 0) / numSubjects)
+
+
+#Welch t of the first group (members) against the rest, from the sums and sums of squares of the first group and
+#the totals of all subjects
+def _welchT(sums1, sumsq1, totals, totalsq, n1, n2):
+    mean1 = sums1 / n1
+    mean2 = (totals - sums1) / n2
+    var1 = (sumsq1 - n1 * mean1 * mean1) / (n1 - 1)
+    var2 = (totalsq - sumsq1 - n2 * mean2 * mean2) / (n2 - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (mean1 - mean2) / np.sqrt(np.maximum(var1, 0) / n1 + np.maximum(var2, 0) / n2)
+
+
+#t of every resample (rows of labels: +-1 signs for paired, 1 for the members of the first group for groups) and bin
+def _resampleT(test, labels):
+    data = test['data']
+    if test['kind'] == PAIRED:
+        return _oneSampleT(np.dot(labels, data), test['sumsq'], data.shape[0])
+    return _welchT(np.dot(labels, data), np.dot(labels, test['squares']), test['totals'], test['totalsq'],
+                   test['n1'], data.shape[0] - test['n1'])
+
+
+#Random labels of size resamples
+def _randomLabels(test, random, size):
+    numSubjects = test['data'].shape[0]
+    if test['kind'] == PAIRED:
+        return random.randint(0, 2, size=(size, numSubjects)) * 2.0 - 1.0
+    #the n1 subjects with the smallest random keys are the first group
+    ranks = np.argsort(random.random_sample((size, numSubjects)), axis=1)
+    labels = np.zeros((size, numSubjects))
+    labels[np.arange(size)[:, None], ranks[:, :test['n1']]] = 1.0
+    return labels
+
+
+#Clusters of every row of t: runs of bins of the same segment over threshold with the same sign
+#Returns (cluster of every cell, -1 outside clusters; mass (sum of t) of every cluster; row of every cluster)
+def _clusters(t, threshold, segments):
+    numRows, numBins = t.shape
+    sign = np.where(np.abs(t) > threshold, np.sign(t), 0).astype(np.int8)
+    start = np.ones((numRows, numBins), dtype=bool)
+    start[:, 1:] = (sign[:, 1:] != sign[:, :-1]) | (segments[1:] != segments[:-1])
+    inside = sign != 0
+    start &= inside
+    cluster = np.where(inside, np.cumsum(start.ravel()).reshape(numRows, numBins) - 1, -1)
+    numClusters = int(start.sum())
+    mass = np.bincount(cluster[inside], weights=t[inside], minlength=numClusters)
+    rowOfCluster = np.repeat(np.arange(numRows), numBins).reshape(numRows, numBins)[start]
+    return cluster, mass, rowOfCluster
+
+
+#Largest |cluster mass| of every row of t (0 without clusters)
+def _maxClusterMass(t, threshold, segments):
+    cluster, mass, rowOfCluster = _clusters(t, threshold, segments)
+    largest = np.zeros(t.shape[0])
+    np.maximum.at(largest, rowOfCluster, np.abs(mass))
+    return largest
+
+
+#Runs one block of resamples: (seed, size)
+#Returns (largest |cluster mass| and largest |t| of every resample, resamples with |t| >= the observed |t| by bin)
+def _nullBlock(block, test):
+    seed, size = block
+    t = _resampleT(test, _randomLabels(test, np.random.RandomState(seed), size))
+    t = np.nan_to_num(t)
+    maxT = np.abs(t).max(axis=1) if t.shape[1] else np.zeros(size)
+    exceed = (np.abs(t) >= test['observed'] - 1e-12).sum(axis=0)
+    return _maxClusterMass(t, test['threshold'], test['segments']), maxT, exceed
+
+
+#(seed, size) of every block: blocks of at most blockSize resamples, seeds drawn from seed
+def _blocks(numResamples, blockSize, seed):
+    sizes = [blockSize] * (numResamples // blockSize)
+    if numResamples % blockSize:
+        sizes.append(numResamples % blockSize)
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(sizes))
+    return [(int(s), size) for s, size in zip(seeds, sizes)]
+
+
+#Resamples of a block that fit in maxBytes: every resample holds its labels and a few arrays of the size of the bins
+def blockSize(numSubjects, numBins, maxBytes=MAX_BLOCK_MB << 20):
+    return int(max(1, maxBytes // (8 * (3 * numSubjects + 8 * max(numBins, 1)))))
+
+
+########################################################################################################
+#########################################  Tests  ######################################################
+########################################################################################################
+
+#Permutation test of a prepared test dict (see pairedTest and groupTest)
+#Returns (bin table, cluster table) with the columns BIN_FIELDS and CLUSTER_FIELDS
+def _runTest(test, bins, effect, numSubjects, numResamples, threshold, seed, jobs, maxBytes):
+    identity = np.ones((1, numSubjects)) if test['kind'] == PAIRED else test['labels'][None, :]
+    observed = np.nan_to_num(_resampleT(test, identity))
+    test['observed'] = np.abs(observed[0])
+    test['threshold'] = threshold
+    test['segments'] = pd.factorize(bins['Window'].values)[0]
+
+    nullMass = []
+    nullT = []
+    exceed = np.zeros(len(bins), dtype=np.int64)
+    blocks = _blocks(numResamples, blockSize(numSubjects, len(bins), maxBytes), seed)
+    for mass, maxT, count in _orderedMap(functools.partial(_nullBlock, test=test), blocks, jobs):
+        nullMass.append(mass)
+        nullT.append(maxT)
+        exceed += count
+    nullMass = np.sort(np.concatenate(nullMass)) if nullMass else np.zeros(0)
+    nullT = np.sort(np.concatenate(nullT)) if nullT else np.zeros(0)
+
+    #p = (1 + resamples at least as extreme) / (1 + resamples), the observed labels count as one of them
+    def pValues(null, values):
+        return (1.0 + len(null) - np.searchsorted(null, values - 1e-12, side='left')) / (1.0 + len(null))
+
+    cluster, mass, rowOfCluster = _clusters(observed, threshold, test['segments'])
+    clusterP = pValues(nullMass, np.abs(mass))
+    table = bins.copy()
+    table['subjects'] = numSubjects
+    table['effect'] = effect
+    table['t'] = observed[0]
+    table['p'] = (1.0 + exceed) / (1.0 + numResamples)
+    table['p_tmax'] = pValues(nullT, test['observed'])
+    table['cluster'] = cluster[0]
+    table['p_cluster'] = np.where(cluster[0] >= 0, clusterP[np.maximum(cluster[0], 0)], np.nan)
+
+    clusters = []
+    for c in range(len(mass)):
+        cells = np.flatnonzero(cluster[0] == c)
+        clusters.append([c, bins['Window'].values[cells[0]], bins['WindowTimeNormalized'].values[cells[0]],
+                         bins['WindowTimeNormalized'].values[cells[-1]], len(cells), mass[c], clusterP[c]])
+    return table[BIN_FIELDS], pd.DataFrame(clusters, columns=CLUSTER_FIELDS)
+
+
+#Sign flip test of two conditions (subject matrices a and b, see subjectMatrix) over the bins both have for every
+#subject of both; numResamples random sign flips of the subject differences a - b
+#threshold is the cluster-forming |t| (tThreshold of alpha with the subjects - 1 degrees of freedom if None)
+#The resamples run in blocks of at most maxBytes, on jobs worker processes if jobs > 1, from seed
+#Returns (bin table, cluster table): effect is the mean difference of every bin
+def pairedTest(a, b, numResamples=10000, threshold=None, alpha=0.05, seed=0, jobs=1, maxBytes=MAX_BLOCK_MB << 20):
+    a, b = _commonCells(a, b)
+    numSubjects = len(a)
+    if numSubjects < 2:
+        raise ValueError('a paired test needs at least 2 subjects with both conditions (got %d)' % numSubjects)
+    differences = a.values - b.values
+    bins = a.columns.to_frame(index=False)
+    test = {'kind' : PAIRED, 'data' : differences, 'sumsq' : np.square(differences).sum(axis=0)}
+    if threshold is None:
+        threshold = tThreshold(numSubjects - 1, alpha)
+    return _runTest(test, bins, differences.mean(axis=0), numSubjects, numResamples, threshold, seed, jobs, maxBytes)
+
+
+#Label permutation test of two groups of subjects: matrix (see subjectMatrix) and groups, a dict Subject -> group
+#with two groups (the subjects without a group are left out); numResamples random relabelings of the subjects
+#The other parameters are the ones of pairedTest (the degrees of freedom of the threshold are subjects - 2)
+#Returns (bin table, cluster table): effect is the mean of the first group (in sorted order) minus the other one
+def groupTest(matrix, groups, numResamples=10000, threshold=None, alpha=0.05, seed=0, jobs=1,
+              maxBytes=MAX_BLOCK_MB << 20):
+    matrix = matrix.loc[[subject for subject in matrix.index if subject in groups]]
+    matrix = _commonCells(matrix)[0]
+    labels = sorted(set(groups[subject] for subject in matrix.index))
+    if len(labels) != 2:
+        raise ValueError('a group test needs 2 groups (got %s)' % ', '.join(str(label) for label in labels))
+    first = np.array([groups[subject] == labels[0] for subject in matrix.index])
+    n1 = int(first.sum())
+    if n1 < 2 or len(first) - n1 < 2:
+        raise ValueError('a group test needs at least 2 subjects in every group (got %d and %d)'
+                         % (n1, len(first) - n1))
+    data = matrix.values
+    test = {'kind' : GROUPS, 'data' : data, 'squares' : np.square(data), 'totals' : data.sum(axis=0),
+            'totalsq' : np.square(data).sum(axis=0), 'n1' : n1, 'labels' : first.astype(np.float64)}
+    if threshold is None:
+        threshold = tThreshold(len(first) - 2, alpha)
+    effect = data[first].mean(axis=0) - data[~first].mean(axis=0)
+    return _runTest(test, matrix.columns.to_frame(index=False), effect, len(first), numResamples, threshold, seed,
+                    jobs, maxBytes)
+
+
+#Writes the bin table to path and the cluster table next to it (<path>_clusters), CSV if path ends with .csv and
+#tab separated otherwise
+def writeTest(path, binTable, clusterTable):
+    sep = ',' if path.endswith('.csv') else '\t'
+    binTable.to_csv(path, sep=sep, index=False)
+    stem, extension = os.path.splitext(path)
+    clusterTable.to_csv(stem + '_clusters' + (extension or '.tsv'), sep=sep, index=False)
+
+
+#Subject -> group of a CSV/TSV file with Subject and group columns
+def readGroups(path):
+    frame = pd.read_csv(path, sep=',' if path.endswith('.csv') else '\t')
+    return dict(zip(frame['Subject'], frame['group']))
+
+
+if __name__ == '__main__':
+    fields = [name for name, col in TIMECOURSE_FIELDS]
+    parser = argparse.ArgumentParser(prog='python -m setpupil.permutation',
+                                     description='Cluster-based permutation test of the time courses of the subjects')
+    parser.add_argument('subjects', help='subject means of the grand average (<grand average>_subjects file)')
+    parser.add_argument('--output', required=True, help='bin table (the clusters go to <output>_clusters)')
+    parser.add_argument('--measure', default='TEPR', help='TEPR, TEPR_fix or IEPR (default TEPR)')
+    parser.add_argument('--field', choices=fields, help='trial field of the conditions')
+    parser.add_argument('--conditions', help='paired test of two conditions of --field, e.g. SET,noSET')
+    parser.add_argument('--condition', help='with --groups, only the rows where --field is this condition')
+    parser.add_argument('--groups', help='group test: file with Subject and group columns (two groups)')
+    parser.add_argument('--permutations', type=int, default=10000, help='number of resamples (default 10000)')
+    parser.add_argument('--threshold', type=float, help='cluster-forming |t| (default: from --alpha)')
+    parser.add_argument('--alpha', type=float, default=0.05, help='two-sided alpha of the threshold (default 0.05)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default 0)')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes (default 1)')
+    parser.add_argument('--max-block-mb', type=int, default=MAX_BLOCK_MB,
+                        help='memory of a block of resamples (default %d)' % MAX_BLOCK_MB)
+    args = parser.parse_args()
+
+    subjectMeans = pd.read_csv(args.subjects, sep=',' if args.subjects.endswith('.csv') else '\t')
+    options = dict(numResamples=args.permutations, threshold=args.threshold, alpha=args.alpha, seed=args.seed,
+                   jobs=args.jobs, maxBytes=args.max_block_mb << 20)
+    if args.groups:
+        matrix = subjectMatrix(subjectMeans, args.measure, args.field if args.condition else None, args.condition)
+        binTable, clusterTable = groupTest(matrix, readGroups(args.groups), **options)
+    else:
+        if not args.field or not args.conditions or len(args.conditions.split(',')) != 2:
+            parser.error('a paired test needs --field and two --conditions (or use --groups)')
+        a, b = args.conditions.split(',')
+        binTable, clusterTable = pairedTest(subjectMatrix(subjectMeans, args.measure, args.field, a),
+                                            subjectMatrix(subjectMeans, args.measure, args.field, b), **options)
+    writeTest(args.output, binTable, clusterTable)
+    print(clusterTable.to_string(index=False))
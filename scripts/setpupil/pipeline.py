@@ -0,0 +1,488 @@
+import functools
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from setpupil import conditions, filtering, grandaverage, instrument, loader, sampling, writer
+from setpupil.columns import NUM_COLUMNS, colTrialId, colCurrentObject, colTETTime, colInterpPupil, colRemoveTrials
+from setpupil.windows import DEFAULT_SCHEDULE, calcWindowNames, windowLabels
+from setpupil.binning import combineTimeBuckets
+from setpupil.metrics import computeTrialMetrics
+
+########################################################################################################
+#########################################  Per-subject pipeline  #######################################
+########################################################################################################
+# processSubject runs every stage for one file and only returns its results (no module globals), so the
+# subjects can be processed in separate processes. processSubjects merges them back in the order of the
+# input files, whatever the number of workers.
+########################################################################################################
+
+#Name of new columns that will be populated with manipulated data
+new_headers = ['Window', 'PupilAvg', 'PupilAvgRoll', 'TrialBaseline', 'TEPR', 'TEPR_fix', 'IEPR', 'WindowTimeNormalized']
+
+
+#New columns of a subject, one typed array per new header: Window holds the window codes (see setpupil/windows.py),
+#the other columns are floats with NaN where there is no value
+#pupil_rolling_avg and normalized_times are only there for binned rows (see binSubject)
+def newColumns(windows, pupil_rolling_avg=None, normalized_times=None):
+    numRows = len(windows)
+    new_columns = {}
+    for new_header in new_headers:
+        new_columns[new_header] = np.full(numRows, np.nan)
+    new_columns['Window'] = np.asarray(windows, dtype=np.int8)
+    if pupil_rolling_avg is not None:
+        new_columns['PupilAvgRoll'][:] = pupil_rolling_avg
+    if normalized_times is not None:
+        new_columns['WindowTimeNormalized'][:] = normalized_times
+    return new_columns
+
+
+#Typed time series of one subject for the columnar output: the input columns we keep (named by their header),
+#then the new columns, with NaN where the text output has an empty cell (Window as the labels of schedule)
+def _timeSeriesFrame(frame, file_headers, outputColumns, new_columns, schedule=None):
+    block = pd.DataFrame(index=pd.RangeIndex(len(frame)))
+    for col in range(len(file_headers)):
+        if col in outputColumns and col in frame.columns:
+            block[file_headers[col]] = frame[col].values
+    block['Window'] = pd.Categorical.from_codes(new_columns['Window'], (schedule or DEFAULT_SCHEDULE).labels)
+    for new_header in new_headers[1:]:
+        block[new_header] = new_columns[new_header]
+    return block
+
+
+#Groups the rows of a subject into time bins (see setpupil/binning.py)
+#Every bin is represented by its first row, with the pupil data replaced by the bin average
+#Returns (binned frame, Window code of every bin, rolling avg of every bin, normalized time of every bin)
+def binSubject(frame, windows, timeRoundTo, windowSize):
+    bins = combineTimeBuckets(frame[colTrialId], frame[colCurrentObject], frame[colTETTime], windows,
+                              frame[colRemoveTrials], timeRoundTo, windowSize)
+    frame = frame.iloc[bins['row'].values].reset_index(drop=True)
+    frame[colRemoveTrials] = bins['PupilAvg'].values
+    return frame, bins['Window'].values, bins['PupilAvgRoll'].values, bins['WindowTimeNormalized'].values
+
+
+#Text of every value of a float column, NaN as missing
+def _floatTexts(values, missing):
+    texts = [repr(value) for value in values.tolist()]
+    for row_number in np.flatnonzero(np.isnan(values)):
+        texts[row_number] = missing
+    return texts
+
+
+#Text of every cell of an input column, the way it looked in the export (see loader.formatCell)
+def _inputTexts(frame, col):
+    if col not in frame.columns:
+        return ['NA'] * len(frame)
+    values = frame[col]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        #text is written as it is, missing values (code -1) are NA
+        texts = np.asarray(values, dtype=object)
+        texts[np.asarray(values.cat.codes) < 0] = 'NA'
+        return texts.tolist()
+    if loader.isText(values):
+        #pass-through text, missing cells (short rows) are NA
+        texts = np.asarray(values, dtype=object)
+        texts[values.isna().to_numpy()] = 'NA'
+        return texts.tolist()
+    return [loader.formatCell(col, value) for value in values.to_numpy(dtype=np.float64).tolist()]
+
+
+#Texts of the input columns of the time series, one list per column we keep
+def inputColumnTexts(frame, numColumns, outputColumns):
+    columns = []
+
+    ### filter out columns we don't want ###
+    for cnt in range(max(numColumns, NUM_COLUMNS)):
+        if cnt in outputColumns:
+            columns.append(_inputTexts(frame, cnt))
+    return columns
+
+
+#Text lines of the time series of one subject (without the header line)
+#new_columns are the new columns of the rows (see newColumns)
+#binned says whether the rows went through binSubject; if not, PupilAvgRoll and WindowTimeNormalized stay empty
+#(binned rows without a rolling avg get 'nan', like the old per-row columns did)
+#inputTexts are the texts of the input columns (see inputColumnTexts), made here if None
+#schedule is the WindowSchedule of the window codes (setpupil/windows.py), the one of SET if None
+def timeSeriesLines(frame, numColumns, outputColumns, new_columns, binned, inputTexts=None, schedule=None):
+    if inputTexts is None:
+        inputTexts = inputColumnTexts(frame, numColumns, outputColumns)
+    columns = list(inputTexts)
+
+    for new_header in new_headers:
+        values = new_columns[new_header]
+        if new_header == 'Window':
+            columns.append(windowLabels(values, schedule).tolist())
+        elif new_header == 'WindowTimeNormalized':
+            columns.append(['%d' % value for value in values.tolist()] if binned else [''] * len(values))
+        elif new_header == 'PupilAvgRoll':
+            columns.append(_floatTexts(values, 'nan') if binned else [''] * len(values))
+        else:
+            columns.append(_floatTexts(values, ''))
+
+    return ["\t".join(cells) for cells in zip(*columns)]
+
+
+#Stages of a subject that do not depend on the time bins or the rolling avg: read, sampling profile, filter,
+#trial removal, experiment rows and window labels (see processSubject for the parameters)
+#timeRoundTo and avgSameTime are only used for the sampling profile and its warning
+#timer is the StageTimer of the subject, schedule the WindowSchedule of the task (see setpupil/windows.py)
+#Returns (headers of the file, experiment rows, their window codes (None if there are no rows), TETTime of every
+#row that was read, quality stats of the subject)
+def labelSubject(path, timeRoundTo, avgSameTime, outputColumns, timer, store=None, pupilFilter=None,
+                 trialThreshold=None, schedule=None):
+    filename = os.path.basename(path)
+
+    #only the columns we use or write out are read, already typed (see setpupil/loader.py and setpupil/store.py)
+    timer.start('read', None)
+    usecols = loader.columnsToRead(outputColumns)
+    if pupilFilter is not None:
+        usecols = sorted(set(usecols).union(filtering.FILTER_COLUMNS))
+    if store is not None:
+        file_headers, frame = store.read(path, usecols)
+    else:
+        file_headers, frame = loader.readTobiiExport(path, usecols)
+    rowsRead = len(frame)
+
+    ### sampling rate and jitter of the subject, and whether the time bins suit them ###
+    times = frame[colTETTime].to_numpy(dtype=np.float64)
+    qualityStats = {'sampling' : subjectSampling(filename, filtering.subjectName(frame), times, timeRoundTo,
+                                                 avgSameTime)}
+    timer.stop(rowsRead, rowsRead)
+
+    ### filter and interpolate the pupil data (what filter_with_stat_report.R did before this script ran) ###
+    if pupilFilter is not None:
+        timer.start('filter', len(frame))
+        file_headers, frame, filterStats = pupilFilter.apply(file_headers, frame)
+        qualityStats.update(filterStats)
+        timer.stop(len(frame))
+
+    ### remove the data of trials with too little valid data (what Removetrialswithtoofewdatapoints.R did) ###
+    if trialThreshold is not None or pupilFilter is not None:
+        if colInterpPupil not in frame:
+            raise ValueError('%s has no interp_av_pupil column (a raw export has to go through the pupil filter first)'
+                             % filename)
+        timer.start('trials', len(frame))
+        file_headers, frame, trialStats = filtering.removeTrials(file_headers, frame, trialThreshold or 0)
+        qualityStats.update(trialStats)
+        timer.stop(len(frame))
+    elif colRemoveTrials not in frame:
+        raise ValueError('%s has no remove_trial column (a raw export has to go through the pupil filter first)'
+                         % filename)
+
+    ### get rid of practice and of rows without pupil data ###
+    timer.start('select', len(frame))
+    frame = loader.experimentRows(frame)
+    timer.stop(len(frame))
+    if len(frame) == 0:
+        return file_headers, frame, None, times, qualityStats
+
+    ### set window values ###
+    timer.start('windows', len(frame))
+    windows = calcWindowNames(frame[colCurrentObject], frame[colTrialId], frame[colTETTime], schedule)
+    timer.stop(len(windows))
+    return file_headers, frame, windows, times, qualityStats
+
+
+#Sampling profile of a subject (see sampling.samplingProfile) with its file name and Subject
+#Prints a warning when the time bins are too small for the sampling rate (only if the rows go through the bins)
+def subjectSampling(filename, subject, times, timeRoundTo, avgSameTime):
+    profile = sampling.samplingProfile(times, timeRoundTo)
+    profile['file'] = filename
+    profile['Subject'] = subject
+    warning = sampling.binWarning(profile)
+    if warning is not None and avgSameTime:
+        print('WARNING (%s): %s' % (filename, warning))
+    return profile
+
+
+#Stages of a subject that depend on the time bins and the rolling avg: bins, aggregate and format
+#frame and windows are the experiment rows and window codes of labelSubject (they are not changed); timeRoundTo is
+#a number of ms (not 'auto'), the other parameters are the ones of processSubject
+#shared is a dict that keeps the bins (by timeRoundTo and windowSize) and the texts of the input columns (by
+#timeRoundTo) of the subject for the next calls with other parameters (see setpupil/sweep.py), or None
+#Returns (time series rows without the header, summary data frame of the trials, stats for the quality stats of the
+#subject: the condition stats of the bias and encoding windows ('conditions', see setpupil/conditions.py) and the
+#sums of the time courses of the binned rows ('timecourse', see setpupil/grandaverage.py))
+def aggregateSubject(file_headers, frame, windows, avgSameTime, timeRoundTo, rolling, windowSize, outputColumns,
+                     outputFormat, timer, shared=None, schedule=None):
+    if shared is None:
+        shared = {}
+    binKey = ('bins', timeRoundTo, windowSize) if avgSameTime else ('rows',)
+    textKey = ('texts', timeRoundTo) if avgSameTime else ('texts',)
+
+    ### if set to avg time bins, then aggregate rows with same time bin ###
+    #rows that do not go through the time bins have no rolling avg or normalized time
+    if avgSameTime:
+        timer.start('bins', len(frame))
+        if binKey not in shared:
+            shared[binKey] = binSubject(frame, windows, timeRoundTo, windowSize)
+        frame, windows, pupil_rolling_avg, new_normalized_times = shared[binKey]
+        new_columns = newColumns(windows, pupil_rolling_avg, new_normalized_times)
+        timer.stop(len(frame))
+    else:
+        new_columns = newColumns(windows)
+
+    ### baseline, fix and window averages and TEPR/TEPR_fix/IEPR, all in one pass (see setpupil/metrics.py) ###
+    #trialDataMap: key is TrialId, value is dic for every field in summary dataframe
+    timer.start('aggregate', len(frame))
+    metric_cols, trialDataMap, biasMap, encodingStrategyMap = computeTrialMetrics(frame, windows,
+                                                                                  new_columns['PupilAvgRoll'], rolling,
+                                                                                  schedule)
+    new_columns.update(metric_cols)
+    timer.stop(len(trialDataMap))
+
+    timer.start('format', len(frame))
+    if outputFormat != 'tsv':
+        block = _timeSeriesFrame(frame, file_headers, outputColumns, new_columns, schedule)
+    else:
+        ### time series rows of this subject
+        #the rows of the bins do not depend on windowSize, so neither do the texts of their input columns
+        if textKey not in shared:
+            shared[textKey] = inputColumnTexts(frame, len(file_headers), outputColumns)
+        block = timeSeriesLines(frame, len(file_headers), outputColumns, new_columns, avgSameTime, shared[textKey],
+                                schedule)
+    timer.stop(len(block))
+    stats = {
+        'conditions' : conditions.conditionStats(biasMap, encodingStrategyMap),
+        'timecourse' : grandaverage.subjectTimeCourse(frame, new_columns, schedule),
+    }
+    return block, pd.DataFrame(list(trialDataMap.values())), stats
+
+
+#Time series and summary of a subject without experiment rows
+def emptyResults(outputFormat):
+    return [] if outputFormat == 'tsv' else pd.DataFrame(), pd.DataFrame()
+
+
+#Runs the whole pipeline for one subject file
+#avgSameTime, timeRoundTo, rolling and windowSize are AVG_SAME_TIME, TIME_ROUND_TO, ROLLING and WINDOW_SIZE
+#timeRoundTo 'auto' picks the bin width of the subject from its sampling rate (see setpupil/sampling.py)
+#outputColumns are the input columns written to the time series (settings.columns)
+#outputFormat 'tsv' gives the time series as text lines, anything else (see writer.py) as a typed data frame
+#report is a list that gets the timing record of every stage (see setpupil/instrument.py)
+#store is a ColumnStore (setpupil/store.py) the file is read from, or None to parse the text
+#pupilFilter is a PupilFilter (setpupil/filtering.py) to filter and interpolate the pupil data of a raw export first,
+#or None when the file already went through filter_with_stat_report.R
+#trialThreshold: remove_trial is made from interp_av_pupil without the trials that have less than trialThreshold %
+#valid data (see filtering.removeTrials), None when the file already went through Removetrialswithtoofewdatapoints.R
+#(with a pupilFilter no trials are removed then)
+#schedule is the WindowSchedule of the task (see setpupil/windows.py), the one of SET if None
+#Returns (headers of the file, time series rows without the header, summary data frame of the trials,
+#quality stats of the subject: its sampling profile ('sampling'), the stats of the filter stages, the condition
+#stats of the bias and encoding windows ('conditions') and the sums of its time courses ('timecourse'), see
+#aggregateSubject)
+def processSubject(path, avgSameTime, timeRoundTo, rolling, windowSize, outputColumns, outputFormat='tsv', report=None,
+                   store=None, pupilFilter=None, trialThreshold=None, schedule=None):
+    filename = os.path.basename(path)
+    print('processing file: %s' % filename)
+    timer = instrument.StageTimer(filename, report)
+
+    file_headers, frame, windows, times, qualityStats = labelSubject(path, timeRoundTo, avgSameTime, outputColumns,
+                                                                     timer, store, pupilFilter, trialThreshold,
+                                                                     schedule)
+    if windows is None:
+        block, summary = emptyResults(outputFormat)
+        return file_headers, block, summary, qualityStats
+
+    block, summary, stats = aggregateSubject(file_headers, frame, windows, avgSameTime,
+                                             qualityStats['sampling']['time_round_to'], rolling, windowSize,
+                                             outputColumns, outputFormat, timer, schedule=schedule)
+    qualityStats.update(stats)
+    print('DONE!!! (%s)' % filename)
+    return file_headers, block, summary, qualityStats
+
+
+#Calls function on every item, on jobs worker processes if jobs > 1
+#Yields the results in the order of items
+#With sizes (the work of every item, e.g. its rows) the workers get the largest items first, so a big one does not
+#start last and hold up the end of the run; the results that finish early wait here until it is their turn
+def _orderedMap(function, items, jobs, sizes=None):
+    if jobs <= 1 or len(items) <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    pool = multiprocessing.Pool(min(jobs, len(items)))
+    try:
+        if sizes is None:
+            for result in pool.imap(function, items):
+                yield result
+        else:
+            #largest first, items of the same size in their order
+            order = sorted(range(len(items)), key=lambda n: -sizes[n])
+            finished = {}
+            nextItem = 0
+            for n, result in pool.imap_unordered(functools.partial(_numberedCall, function),
+                                                 [(n, items[n]) for n in order]):
+                finished[n] = result
+                while nextItem in finished:
+                    yield finished.pop(nextItem)
+                    nextItem += 1
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+#Calls function on the item of a (number, item) pair, returns (number, result)
+def _numberedCall(function, numberAndItem):
+    n, item = numberAndItem
+    return n, function(item)
+
+
+#Runs processSubject for one (path, cache key) item
+#With a cache (see setpupil/cache.py) the results are loaded from it if they are there, and stored in it if not
+#profile is a ProfileHook (setpupil/instrument.py) or None, store a ColumnStore (setpupil/store.py) or None
+#Returns (results of processSubject, timing records of the subject)
+def _cachedProcessSubject(pathAndKey, cache=None, profile=None, store=None, **params):
+    path, key = pathAndKey
+    report = []
+    if cache is not None:
+        timer = instrument.StageTimer(os.path.basename(path), report)
+        timer.start('cache', None)
+        result = cache.get(key)
+        if result is not None:
+            timer.stop(len(result[1]))
+            print('loaded from cache: %s' % os.path.basename(path))
+            return result, report
+        del report[:]
+
+    if profile is not None and profile.matches(path):
+        result = profile.run(path, processSubject, path, report=report, store=store, **params)
+    else:
+        result = processSubject(path, report=report, store=store, **params)
+    if cache is not None:
+        cache.put(key, result)
+    return result, report
+
+
+#(path, cache key) of every file, the keys are None without a cache
+def _cacheItems(paths, cache, params):
+    if cache is None:
+        return [(path, None) for path in paths]
+    return list(zip(paths, cache.keys(paths, params)))
+
+
+#Runs processSubject for every file, on jobs worker processes if jobs > 1
+#Yields the (path, result) of every file in the order of paths, so the output does not depend on jobs
+#cache is a SubjectCache (setpupil/cache.py) or None, profile a ProfileHook (setpupil/instrument.py) or None,
+#store a ColumnStore (setpupil/store.py) or None, pupilFilter a PupilFilter (setpupil/filtering.py) or None,
+#trialThreshold and schedule as in processSubject
+#report is a list that gets the timing records of every subject
+def processSubjects(paths, avgSameTime, timeRoundTo, rolling, windowSize, outputColumns, jobs=1, outputFormat='tsv',
+                    cache=None, profile=None, store=None, report=None, pupilFilter=None, trialThreshold=None,
+                    schedule=None):
+    params = dict(avgSameTime=avgSameTime, timeRoundTo=timeRoundTo, rolling=rolling, windowSize=windowSize,
+                  outputColumns=outputColumns, outputFormat=outputFormat, pupilFilter=pupilFilter,
+                  trialThreshold=trialThreshold, schedule=schedule)
+    process = functools.partial(_cachedProcessSubject, cache=cache, profile=profile, store=store, **params)
+    for path, (result, records) in zip(paths, _orderedMap(process, _cacheItems(paths, cache, params), jobs)):
+        if report is not None:
+            report.extend(records)
+        yield path, result
+
+
+#Worker side of writeSubjects: processes one subject and writes its rows to a part file
+def _processSubjectToPart(pathKeyAndPart, **params):
+    path, key, partPath = pathKeyAndPart
+    (file_headers, lines, summary, stats), records = _cachedProcessSubject((path, key), **params)
+    timer = instrument.StageTimer(os.path.basename(path), records)
+    timer.start('write_part', len(lines))
+    writer.writePart(partPath, lines)
+    timer.stop(len(lines))
+    return file_headers, summary, stats, records
+
+
+#Adds the quality stats of a subject to the list of the run; with a grandAverage (setpupil/grandaverage.py) its
+#time courses are folded in there and not kept with the rest
+def _collectStats(stats, qualityStats, grandAverage=None):
+    if grandAverage is not None:
+        grandAverage.add(stats.pop('timecourse', None), stats.get('sampling', {}).get('Subject'))
+    qualityStats.append(stats)
+
+
+#Processes every file and streams the time series to tsPath as the subjects finish (in the order of paths)
+#outputFormat is 'tsv' or one of the columnar formats of writer.py (tsPath is then the file to write, see columnarPath)
+#With jobs > 1 the workers write part files next to tsPath that are appended in order and removed (tsv only,
+#the columnar rows are typed and small enough to send back to the main process)
+#With a cache, unchanged subjects are not processed again and the cache is trimmed to its size at the end
+#report is a list that gets the timing records of every stage of every subject (see setpupil/instrument.py)
+#With a store (setpupil/store.py) the files are read from their binary columns instead of parsed
+#With a pupilFilter (setpupil/filtering.py) the files are raw exports, with a trialThreshold the trials are removed
+#here (see processSubject); schedule is the WindowSchedule of the task (setpupil/windows.py), the one of SET if None
+#qualityStats is a list that gets the quality stats of every subject (sampling profile, filter stages and condition
+#stats); grandAverage is a GrandAverage (setpupil/grandaverage.py) that gets the time courses of every subject as
+#it finishes, or None
+#sizes is the work of every file of paths (e.g. its rows, see setpupil/manifest.py): with jobs > 1 the largest files
+#are processed first (tsv only, the columnar rows of the files that finish early would have to wait in memory)
+#Returns the summary data frame of all the subjects
+def writeSubjects(paths, tsPath, avgSameTime, timeRoundTo, rolling, windowSize, outputColumns, jobs=1, outputFormat='tsv',
+                  cache=None, profile=None, store=None, report=None, pupilFilter=None, trialThreshold=None,
+                  qualityStats=None, schedule=None, grandAverage=None, sizes=None):
+    params = dict(avgSameTime=avgSameTime, timeRoundTo=timeRoundTo, rolling=rolling, windowSize=windowSize,
+                  outputColumns=outputColumns, pupilFilter=pupilFilter, trialThreshold=trialThreshold,
+                  schedule=schedule)
+    if report is None:
+        report = []
+    if qualityStats is None:
+        qualityStats = []
+    summaries = []
+    try:
+        if outputFormat != 'tsv':
+            with writer.ColumnarWriter(tsPath, outputFormat) as tsWriter:
+                for path, (file_headers, block, summary, stats) in processSubjects(paths, jobs=jobs,
+                                                                                   outputFormat=outputFormat,
+                                                                                   cache=cache, profile=profile,
+                                                                                   store=store, report=report,
+                                                                                   **params):
+                    timer = instrument.StageTimer(os.path.basename(path), report)
+                    timer.start('write', len(block))
+                    tsWriter.writeSubject(block)
+                    timer.stop(len(block))
+                    summaries.append(summary)
+                    _collectStats(stats, qualityStats, grandAverage)
+
+        else:
+            with writer.TimeSeriesWriter(tsPath, outputColumns, new_headers) as tsWriter:
+                if jobs <= 1 or len(paths) <= 1:
+                    for path, (file_headers, lines, summary, stats) in processSubjects(paths, jobs=1, cache=cache,
+                                                                                       profile=profile, store=store,
+                                                                                       report=report, **params):
+                        timer = instrument.StageTimer(os.path.basename(path), report)
+                        timer.start('write', len(lines))
+                        tsWriter.writeSubject(file_headers, lines)
+                        timer.stop(len(lines))
+                        summaries.append(summary)
+                        _collectStats(stats, qualityStats, grandAverage)
+                else:
+                    partDir = tempfile.mkdtemp(prefix='.parts-', dir=os.path.dirname(os.path.abspath(tsPath)))
+                    try:
+                        parts = [os.path.join(partDir, '%06d.tsv' % n) for n in range(len(paths))]
+                        items = [(path, key, partPath) for (path, key), partPath in
+                                 zip(_cacheItems(paths, cache, dict(params, outputFormat='tsv')), parts)]
+                        process = functools.partial(_processSubjectToPart, cache=cache, profile=profile, store=store,
+                                                    **params)
+                        for path, partPath, (file_headers, summary, stats, records) in zip(paths, parts,
+                                                                                           _orderedMap(process, items,
+                                                                                                       jobs, sizes)):
+                            report.extend(records)
+                            timer = instrument.StageTimer(os.path.basename(path), report)
+                            timer.start('write', records[-1]['rows_out'])
+                            tsWriter.appendPart(file_headers, partPath)
+                            timer.stop(records[-1]['rows_out'])
+                            summaries.append(summary)
+                            _collectStats(stats, qualityStats, grandAverage)
+                    finally:
+                        shutil.rmtree(partDir, ignore_errors=True)
+    finally:
+        if cache is not None:
+            cache.evict()
+
+    if len(summaries) == 0:
+        return pd.DataFrame()
+    return pd.concat(summaries, ignore_index=True)
@@ -0,0 +1,82 @@
+import argparse
+import socket
+import sys
+import time
+
+from setpupil.columns import colTETTime
+
+########################################################################################################
+#########################################  Session replay  #############################################
+########################################################################################################
+# Stands in for the eye tracker when trying out the real-time mode (setpupil/streaming.py): the lines of
+# an export are sent out at the pace they were recorded (TETTime), to stdout (a pipe), to a file that
+# grows as the session goes (for --follow) or to the first client that connects to a TCP port.
+########################################################################################################
+
+
+#Time (ms) of a line, None for the header or a line without a TETTime
+def _lineTime(line):
+    cells = line.split('\t', colTETTime + 1)
+    try:
+        return float(cells[colTETTime])
+    except (IndexError, ValueError):
+        return None
+
+
+#Writes the lines of an export to out (a file object) as they were recorded, speed times faster (0: no waiting)
+#Returns the number of lines written
+def replayExport(path, out, speed=1.0):
+    start = None
+    firstTime = None
+    numLines = 0
+    with open(path, 'r') as tsvfile:
+        for line in tsvfile:
+            lineTime = _lineTime(line)
+            if speed > 0 and lineTime is not None:
+                if firstTime is None:
+                    start = time.time()
+                    firstTime = lineTime
+                wait = start + (lineTime - firstTime) / 1000.0 / speed - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+            out.write(line)
+            out.flush()
+            numLines += 1
+    return numLines
+
+
+#Waits for a client on port (all interfaces of host) and replays the export to it (see replayExport)
+def serveExport(path, port, host='', speed=1.0):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        server.bind((host, port))
+        server.listen(1)
+        connection = server.accept()[0]
+        try:
+            out = connection.makefile('w')
+            numLines = replayExport(path, out, speed)
+            out.close()
+        finally:
+            connection.close()
+    finally:
+        server.close()
+    return numLines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m setpupil.replay',
+                                     description='Send the lines of an export at the pace they were recorded')
+    parser.add_argument('path', help='export file to replay')
+    parser.add_argument('--speed', type=float, default=1.0, help='times faster than recorded, 0 for no waiting (default 1)')
+    parser.add_argument('--port', type=int, help='send to the first client of this TCP port instead of stdout')
+    parser.add_argument('--append', help='append to this file instead of stdout (read it with streaming --follow)')
+    args = parser.parse_args()
+
+    if args.port is not None:
+        serveExport(args.path, args.port, speed=args.speed)
+    elif args.append:
+        with open(args.append, 'a') as out:
+            replayExport(args.path, out, args.speed)
+    else:
+        replayExport(args.path, sys.stdout, args.speed)
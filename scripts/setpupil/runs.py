@@ -0,0 +1,20 @@
+import numpy as np
+
+########################################################################################################
+#########################################  Runs  #######################################################
+########################################################################################################
+# A run is a stretch of consecutive rows with the same keys (e.g. the rows of one trial, or of one window
+# within a trial). The trial index (setpupil/trials.py) and the trial metrics (setpupil/metrics.py) are
+# built on runs.
+########################################################################################################
+
+
+#Marks the first row of every run of equal keys (arrays of the same length)
+def runStarts(*keys):
+    numRows = len(keys[0])
+    change = np.ones(numRows, dtype=bool)
+    if numRows > 1:
+        change[1:] = False
+        for key in keys:
+            change[1:] |= key[1:] != key[:-1]
+    return change
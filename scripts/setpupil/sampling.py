@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+########################################################################################################
+#########################################  Sampling rate  ##############################################
+########################################################################################################
+# What getTobiisamplingrate.R measured, from the TETTime column of every subject while it is read:
+# the intervals between samples (their distribution, not only the mean), the samples the eye tracker
+# dropped (intervals of about two or more sampling periods) and the jitter (sd of the intervals).
+# The time bins (TIME_ROUND_TO) are checked against the intervals: a bin that is shorter than the
+# sampling period ends up empty, one that holds only a sample or two gives noisy averages.
+# With TIME_ROUND_TO = 'auto' every subject gets the smallest bin width that holds MIN_BIN_SAMPLES.
+########################################################################################################
+
+#Fewest samples a time bin should hold
+MIN_BIN_SAMPLES = 3
+
+#Bin width (ms) for TIME_ROUND_TO = 'auto' when a subject has no sampling intervals (TIME_ROUND_TO of the script)
+DEFAULT_BIN_WIDTH = 50
+
+#Relative rounding slack of the sample counts: 50 ms at 60 Hz is 50 / 16.67 = 2.9994 samples (the export rounds
+#the timestamps), which is 3
+SAMPLES_TOLERANCE = 1e-3
+
+#Bin widths picked for TIME_ROUND_TO = 'auto' are multiples of this (ms)
+BIN_STEP = 10
+
+#An interval longer than this many sampling periods counts as dropped samples
+DROP_FACTOR = 1.5
+
+#% of the intervals that may be longer than a bin (dropped samples) before the bins are too small
+MAX_EMPTY_BIN_PERCENT = 1
+
+#Columns of the sampling report
+SAMPLING_FIELDS = [
+    'Subject', 'file', 'samples', 'rate_hz', 'interval_mean_ms', 'interval_median_ms', 'interval_sd_ms',
+    'interval_p5_ms', 'interval_p95_ms', 'interval_max_ms', 'dropped_samples', 'dropped_percent',
+    'backward_steps', 'time_round_to', 'samples_per_bin', 'intervals_over_bin',
+]
+
+
+#Sampling profile of a subject from the times of its samples (ms, in file order), with the bin fields for
+#time bins of timeRoundTo ms: samples_per_bin (at the median interval) and intervals_over_bin (% of the intervals
+#longer than a bin, i.e. bins without samples)
+#timeRoundTo 'auto' picks the bin width with binWidth (DEFAULT_BIN_WIDTH if there are no intervals)
+#Returns a dict with the SAMPLING_FIELDS (but Subject and file)
+def samplingProfile(times, timeRoundTo, minSamples=MIN_BIN_SAMPLES):
+    times = np.asarray(times, dtype=np.float64)
+    times = times[~np.isnan(times)]
+    intervals = np.diff(times)
+    #time going backwards (or standing still) is an error of the export, not a sampling interval
+    forward = intervals[intervals > 0]
+
+    profile = dict.fromkeys(['rate_hz', 'interval_mean_ms', 'interval_median_ms', 'interval_sd_ms', 'interval_p5_ms',
+                             'interval_p95_ms', 'interval_max_ms', 'dropped_percent', 'samples_per_bin',
+                             'intervals_over_bin'], float('nan'))
+    profile.update({'samples' : len(times), 'backward_steps' : int(len(intervals) - len(forward)),
+                    'dropped_samples' : 0})
+    if len(forward) > 0:
+        median = float(np.median(forward))
+        p5, p95 = np.percentile(forward, [5, 95])
+        #an interval of n sampling periods means n - 1 samples are missing
+        long = forward[forward > DROP_FACTOR * median]
+        dropped = int(np.rint(long / median).sum() - len(long))
+        profile.update({
+            'rate_hz' : 1000.0 / median,
+            'interval_mean_ms' : float(forward.mean()),
+            'interval_median_ms' : median,
+            'interval_sd_ms' : float(forward.std()),
+            'interval_p5_ms' : float(p5),
+            'interval_p95_ms' : float(p95),
+            'interval_max_ms' : float(forward.max()),
+            'dropped_samples' : dropped,
+            'dropped_percent' : dropped * 100.0 / (len(times) + dropped),
+        })
+
+    if timeRoundTo == 'auto':
+        timeRoundTo = binWidth(profile, minSamples) or DEFAULT_BIN_WIDTH
+    profile['time_round_to'] = timeRoundTo
+    if len(forward) > 0:
+        profile['samples_per_bin'] = timeRoundTo / profile['interval_median_ms']
+        profile['intervals_over_bin'] = float(np.count_nonzero(forward > timeRoundTo) * 100.0 / len(forward))
+    return profile
+
+
+#Smallest bin width (a multiple of BIN_STEP) that holds minSamples samples even at the slow end of the
+#intervals (their 95th percentile); None if the profile has no intervals
+def binWidth(profile, minSamples=MIN_BIN_SAMPLES):
+    p95 = profile['interval_p95_ms']
+    if np.isnan(p95):
+        return None
+    return int(max(1, math.ceil(minSamples * p95 / BIN_STEP / (1 + SAMPLES_TOLERANCE))) * BIN_STEP)
+
+
+#Warning (text) when the time bins of a profile are too small for its sampling rate, None if they are fine
+def binWarning(profile, minSamples=MIN_BIN_SAMPLES):
+    tooFew = profile['samples_per_bin'] * (1 + SAMPLES_TOLERANCE) < minSamples
+    if not (tooFew or profile['intervals_over_bin'] > MAX_EMPTY_BIN_PERCENT):
+        return None
+    return ('time bins of %s ms hold %.1f samples at %.1f Hz (%.2f%% of the intervals are longer than a bin), '
+            'at least %s ms is needed for %d samples per bin' %
+            (profile['time_round_to'], profile['samples_per_bin'], profile['rate_hz'], profile['intervals_over_bin'],
+             binWidth(profile, minSamples), minSamples))
+
+
+#Sampling report of the subjects (the 'sampling' stats of processSubject), one row per subject
+def samplingFrame(subjectStats):
+    rows = [stats['sampling'] for stats in subjectStats if 'sampling' in stats]
+    return pd.DataFrame(rows, columns=SAMPLING_FIELDS)
+
+
+#Writes the sampling report: CSV if path ends with .csv, tab separated otherwise
+def writeSamplingReport(path, subjectStats):
+    frame = samplingFrame(subjectStats)
+    if path.endswith('.csv'):
+        frame.to_csv(path, index=False)
+    else:
+        frame.to_csv(path, sep='\t', index=False)
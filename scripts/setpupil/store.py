@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from setpupil import loader
+from setpupil.columns import CATEGORY_COLUMNS, NUM_COLUMNS, PIPELINE_COLUMNS
+
+########################################################################################################
+#########################################  Column store  ###############################################
+########################################################################################################
+# The first time a subject file is read it is converted into a directory of binary columns:
+#   <column>.npy       numbers as float64, text columns as the codes of their categories (-1 for NA)
+#   categories.npz     the categories of every text column
+#   meta.json          header names, column types and the size/mtime of the source file
+# Later runs memory-map the .npy files of the columns they need instead of parsing the text again.
+# If the source file changes (size or mtime), the entry is converted again.
+########################################################################################################
+
+#Bump when the layout of the entries changes
+STORE_VERSION = 1
+
+
+#Store of converted subject files in directory
+class ColumnStore(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    #Directory of the entry of a subject file (named after the file, plus a hash of its path to keep files of
+    #different directories apart)
+    def entryPath(self, path):
+        digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.directory, '%s-%s' % (os.path.basename(path), digest))
+
+    #Reads a subject file like loader.readTobiiExport, converting it first if needed
+    #Returns (header names, data frame labeled by column number); the numeric columns are memory-mapped (read only)
+    def read(self, path, usecols=None):
+        entry = self.entryPath(path)
+        meta = self._meta(entry)
+        if meta is None or meta['source'] != _signature(path):
+            meta = self.convert(path)
+        return meta['headers'], _readEntry(entry, meta, usecols)
+
+    #Converts a subject file into its entry (replacing an older one) and returns the metadata of the entry
+    def convert(self, path):
+        signature = _signature(path)
+        headers, frame = loader.readTobiiExport(path, range(max(len(loader.readHeaders(path)), NUM_COLUMNS)))
+
+        entry = self.entryPath(path)
+        tmpEntry = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            meta = {'version' : STORE_VERSION, 'source' : signature, 'headers' : headers, 'rows' : len(frame),
+                    'numeric' : [], 'text' : []}
+            categories = {}
+            for col in frame.columns:
+                values = frame[col]
+                if loader.isText(values):
+                    values = pd.Series(pd.Categorical(values))
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    np.save(os.path.join(tmpEntry, '%d.npy' % col), np.asarray(values.cat.codes, dtype=np.int32))
+                    categories[str(col)] = np.array([str(c) for c in values.cat.categories], dtype=np.str_)
+                    meta['text'].append(int(col))
+                else:
+                    np.save(os.path.join(tmpEntry, '%d.npy' % col), np.asarray(values, dtype=np.float64))
+                    meta['numeric'].append(int(col))
+            with open(os.path.join(tmpEntry, 'categories.npz'), 'wb') as npzfile:
+                np.savez(npzfile, **categories)
+            #meta.json is written last: an entry without it is not complete
+            with open(os.path.join(tmpEntry, 'meta.json'), 'w') as jsonfile:
+                json.dump(meta, jsonfile)
+
+            if os.path.isdir(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.rename(tmpEntry, entry)
+            except OSError:
+                #another process converted the same file in the meantime
+                if self._meta(entry) is None:
+                    raise
+        finally:
+            if os.path.isdir(tmpEntry):
+                shutil.rmtree(tmpEntry, ignore_errors=True)
+        return meta
+
+    #Metadata of an entry, None if there is no complete entry of the current version
+    def _meta(self, entry):
+        try:
+            with open(os.path.join(entry, 'meta.json'), 'r') as jsonfile:
+                meta = json.load(jsonfile)
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('version') != STORE_VERSION:
+            return None
+        return meta
+
+
+#Size and mtime of a file, what the entries are checked against
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+#Data frame of the columns usecols (all of them if None) of an entry
+def _readEntry(entry, meta, usecols):
+    stored = sorted(meta['numeric'] + meta['text'])
+    if usecols is None:
+        usecols = PIPELINE_COLUMNS
+    usecols = [c for c in sorted(set(usecols)) if c in stored]
+
+    columns = {}
+    with np.load(os.path.join(entry, 'categories.npz'), allow_pickle=False) as categories:
+        for col in usecols:
+            values = np.load(os.path.join(entry, '%d.npy' % col), mmap_mode='r')
+            if col in meta['text'] and col in CATEGORY_COLUMNS:
+                columns[col] = pd.Categorical.from_codes(values, categories[str(col)])
+            elif col in meta['text']:
+                #text like the loader keeps it, NaN where the cell is missing
+                texts = np.append(categories[str(col)].astype(object), np.nan)
+                columns[col] = texts[np.asarray(values)]
+            else:
+                columns[col] = values
+    return pd.DataFrame(columns, columns=usecols, index=pd.RangeIndex(meta['rows']), copy=False)
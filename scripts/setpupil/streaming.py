@@ -0,0 +1,288 @@
+import argparse
+import io
+import os
+import re
+import socket
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from setpupil import filtering, loader, sampling
+from setpupil.columns import colTrialId, colCurrentObject, colTETTime, colRemoveTrials
+from setpupil.columns import colDiameterPupilLeftEye, colValidityLeftEye, colDiameterPupilRightEye, colValidityRightEye
+from setpupil.windows import DEFAULT_SCHEDULE, calcWindowNames, loadSchedule
+from setpupil.pipeline import binSubject, newColumns
+from setpupil.metrics import computeTrialMetrics, TRIAL_FIELDS
+
+########################################################################################################
+#########################################  Real-time trials  ###########################################
+########################################################################################################
+# The samples of a session come in one line at a time, in the layout of the exports (header line first),
+# from a pipe, a socket or a file that is still being written (see setpupil/replay.py to play an export
+# back at the speed it was recorded). The lines of the current trial are kept until its feedback segment
+# starts: every row the summary of the trial needs has arrived then, so the trial goes through the same
+# stages as a whole subject (windows, time bins, baseline/fix/window averages) and its summary row comes
+# out right away, with the numbers the batch run gives. Only the current trial is kept; the rest of its
+# feedback rows are dropped.
+# A stream without remove_trial (straight from the eye tracker) uses the avg of the valid eyes instead,
+# without the filter of filter_with_stat_report.R (it needs the whole session).
+########################################################################################################
+
+#Fields of the summary row of a trial: the trialDataMap fields of the batch summary (with the fix# windows of the
+#window schedule, the one of SET if None), the avg TEPR/TEPR_fix/IEPR of the item rows of the trial, its number of
+#samples and the % of them with pupil data
+def streamFields(schedule=None):
+    return [name for name, col in TRIAL_FIELDS] + \
+        [window + '_pupil_av' for window in (schedule or DEFAULT_SCHEDULE).fixWindows] + \
+        ['TEPR_Fix2Fix3avg', 'TEPR_av', 'TEPR_fix_av', 'IEPR_av', 'samples', 'valid_percent']
+
+STREAM_FIELDS = streamFields()
+
+#A trial that goes on for this many rows without a feedback segment is summarized then (the rest of it is dropped),
+#so a broken stream cannot fill up the memory
+MAX_TRIAL_ROWS = 100000
+
+#host:port of a socket source
+SOCKET_SOURCE = re.compile(r'^([^:/\\]+):(\d+)$')
+
+
+#Summary row of one trial (a dict with the streamFields), None if the batch run has no summary for it
+#(practice trials, trials without pupil data or without windows)
+#frame holds every row of the trial as read by loader.readExportRows; the other parameters are the ones of
+#processSubject
+def trialSummary(frame, avgSameTime, timeRoundTo, rolling, windowSize, schedule=None):
+    samples = len(frame)
+    if colRemoveTrials not in frame:
+        pupil = filtering.pupilValues(frame[colDiameterPupilLeftEye], frame[colValidityLeftEye],
+                                      frame[colDiameterPupilRightEye], frame[colValidityRightEye])[0]
+        frame = frame.copy()
+        frame[colRemoveTrials] = pupil
+    valid = np.count_nonzero(np.asarray(frame[colRemoveTrials], dtype=np.float64) > 0)
+
+    frame = loader.experimentRows(frame)
+    if len(frame) == 0:
+        return None
+    windows = calcWindowNames(frame[colCurrentObject], frame[colTrialId], frame[colTETTime], schedule)
+    if avgSameTime:
+        frame, windows, pupil_rolling_avg, new_normalized_times = binSubject(frame, windows, timeRoundTo, windowSize)
+        new_columns = newColumns(windows, pupil_rolling_avg, new_normalized_times)
+    else:
+        new_columns = newColumns(windows)
+
+    metric_cols, trialDataMap = computeTrialMetrics(frame, windows, new_columns['PupilAvgRoll'], rolling,
+                                                    schedule)[:2]
+    if len(trialDataMap) == 0:
+        return None
+    summary = dict.fromkeys(streamFields(schedule), 'NA')
+    summary.update(list(trialDataMap.values())[0])
+    for name in ['TEPR', 'TEPR_fix', 'IEPR']:
+        values = metric_cols[name][~np.isnan(metric_cols[name])]
+        if len(values) > 0:
+            summary[name + '_av'] = float(values.mean())
+    summary['samples'] = samples
+    summary['valid_percent'] = valid * 100.0 / samples
+    return summary
+
+
+#Keeps the lines of the current trial and summarizes it when its feedback starts (see trialSummary)
+#headers are the header names of the stream, the other parameters the ones of processSubject; timeRoundTo 'auto'
+#is picked from the samples of the first trial and kept for the rest of the stream
+#feed gives every line after the header to the stream and returns the summaries of the trials it completed;
+#close returns the summary of the last trial
+#skippedTrials gets the TrialId of every trial without a summary (see trialSummary)
+class TrialStream(object):
+
+    def __init__(self, headers, avgSameTime=True, timeRoundTo=50, rolling=False, windowSize=100,
+                 maxTrialRows=MAX_TRIAL_ROWS, schedule=None):
+        if len(headers) <= colCurrentObject:
+            raise ValueError('the stream has no CurrentObject column (%d columns)' % len(headers))
+        self.headers = headers
+        self.avgSameTime = avgSameTime
+        self.timeRoundTo = timeRoundTo
+        self.rolling = rolling
+        self.windowSize = windowSize
+        self.usecols = loader.columnsToRead()
+        self.maxTrialRows = maxTrialRows
+        self.schedule = schedule
+        self.skippedTrials = []
+        self.trialId = None
+        self.lines = []
+        self.done = False
+
+    def feed(self, line):
+        line = line.rstrip('\r\n')
+        if not line:
+            return []
+        cells = line.split('\t', colCurrentObject + 1)
+        if len(cells) <= colCurrentObject:
+            return []
+
+        summaries = []
+        if cells[colTrialId] != self.trialId:
+            summaries = self.close()
+            self.trialId = cells[colTrialId]
+            self.done = False
+        if self.done:
+            return summaries
+
+        self.lines.append(line)
+        if cells[colCurrentObject].strip('"').lower() == 'feedback' or len(self.lines) >= self.maxTrialRows:
+            summaries.extend(self.close())
+        return summaries
+
+    #Summarizes the lines kept for the current trial; later lines of the trial are dropped
+    def close(self):
+        if self.done or not self.lines:
+            return []
+        self.done = True
+        frame = loader.readExportRows(io.StringIO('\n'.join(self.lines) + '\n'), self.headers, self.usecols)
+        self.lines = []
+
+        if self.timeRoundTo == 'auto':
+            self.timeRoundTo = sampling.samplingProfile(frame[colTETTime], self.timeRoundTo)['time_round_to']
+        summary = trialSummary(frame, self.avgSameTime, self.timeRoundTo, self.rolling, self.windowSize,
+                               self.schedule)
+        if summary is None:
+            self.skippedTrials.append(self.trialId)
+            return []
+        return [summary]
+
+
+#Summaries of the trials of a stream of lines (the first one is the header), as the trials complete
+#stream is a TrialStream made from the header; kwargs are its parameters
+def streamTrials(lines, stream=None, **kwargs):
+    lines = iter(lines)
+    if stream is None:
+        for line in lines:
+            if line.strip():
+                stream = TrialStream(loader.parseHeaders(line), **kwargs)
+                break
+        else:
+            return
+
+    for line in lines:
+        for summary in stream.feed(line):
+            yield summary
+    for summary in stream.close():
+        yield summary
+
+
+########################################################################################################
+#########################################  Sources  ####################################################
+########################################################################################################
+
+#Lines of a file object (a pipe, stdin) as they come in
+def readLines(fileobj):
+    for line in iter(fileobj.readline, ''):
+        yield line
+
+
+#Lines of a file that is still being written, like tail -f: at the end of the file it looks for more data every
+#poll seconds, and stops after idle seconds without any (never if idle is None)
+def followFile(path, poll=0.1, idle=None):
+    with open(path, 'r') as tsvfile:
+        partial = ''
+        waited = 0.0
+        while True:
+            line = tsvfile.readline()
+            if line:
+                waited = 0.0
+                partial += line
+                if partial.endswith('\n'):
+                    yield partial
+                    partial = ''
+                continue
+            if idle is not None and waited >= idle:
+                break
+            time.sleep(poll)
+            waited += poll
+        if partial:
+            yield partial
+
+
+#Lines sent over a TCP connection to host:port (e.g. python -m setpupil.replay --port), until the other side closes it
+def socketLines(host, port):
+    connection = socket.create_connection((host, port))
+    try:
+        for line in readLines(connection.makefile('r')):
+            yield line
+    finally:
+        connection.close()
+
+
+#Lines of a source: '-' is stdin, host:port a socket (if there is no such file), anything else a file
+#follow keeps reading a file as it grows (see followFile)
+def sourceLines(source, follow=False, poll=0.1, idle=None):
+    if source == '-':
+        return readLines(sys.stdin)
+    match = SOCKET_SOURCE.match(source)
+    if match and not os.path.exists(source):
+        return socketLines(match.group(1), int(match.group(2)))
+    if follow:
+        return followFile(source, poll, idle)
+    return readLines(open(source, 'r'))
+
+
+#One line of the summary output (tab separated fields, STREAM_FIELDS by default), numbers written the way the batch
+#summary writes them
+def summaryLine(summary, fields=STREAM_FIELDS):
+    return pd.DataFrame([summary], columns=fields).to_csv(sep='\t', header=False, index=False).rstrip('\r\n')
+
+
+if __name__ == '__main__':
+    from setpupil.__main__ import binWidth
+
+    parser = argparse.ArgumentParser(prog='python -m setpupil.streaming',
+                                     description='Print the summary of every trial of a session as soon as it ends')
+    parser.add_argument('source', help="'-' for stdin, host:port for a socket, or a file")
+    parser.add_argument('--follow', action='store_true', help='keep reading the file as it is written (like tail -f)')
+    parser.add_argument('--idle', type=float, help='with --follow, stop after this many seconds without new data')
+    parser.add_argument('--output', help='also append the summary lines to this file')
+    parser.add_argument('--no-avg-same-time', dest='avg_same_time', action='store_false',
+                        help='do not average the rows of the same time bin (AVG_SAME_TIME)')
+    parser.add_argument('--time-round-to', type=binWidth, default=50,
+                        help="size of the time bins in ms, or 'auto' (default 50)")
+    parser.add_argument('--rolling', action='store_true', help='use the rolling avg of the pupil data')
+    parser.add_argument('--window-size', type=int, default=100, help='length of the rolling avg in ms (default 100)')
+    parser.add_argument('--window-schedule', help='JSON file with the window schedule (default: the one of SET)')
+    args = parser.parse_args()
+
+    schedule = loadSchedule(args.window_schedule) if args.window_schedule else DEFAULT_SCHEDULE
+    fields = streamFields(schedule)
+    output = None
+    if args.output:
+        output = open(args.output, 'a')
+        if output.tell() == 0:
+            output.write('\t'.join(fields) + '\n')
+    print('\t'.join(fields))
+    sys.stdout.flush()
+
+    lines = sourceLines(args.source, args.follow, idle=args.idle)
+    stream = None
+    for line in lines:
+        if line.strip():
+            stream = TrialStream(loader.parseHeaders(line), args.avg_same_time, args.time_round_to, args.rolling,
+                                 args.window_size, schedule=schedule)
+            break
+
+    #trials without a summary are reported as they go by, so a bad recording shows up right away
+    def emit(summaries):
+        for trialId in stream.skippedTrials:
+            sys.stderr.write('trial %s: no summary (practice, removed or no pupil data)\n' % trialId)
+        del stream.skippedTrials[:]
+        for summary in summaries:
+            text = summaryLine(summary, fields)
+            print(text)
+            sys.stdout.flush()
+            if output is not None:
+                output.write(text + '\n')
+                output.flush()
+
+    if stream is not None:
+        for line in lines:
+            emit(stream.feed(line))
+        emit(stream.close())
+    if output is not None:
+        output.close()
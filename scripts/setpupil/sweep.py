@@ -0,0 +1,175 @@
+import functools
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from setpupil import instrument, writer
+from setpupil.pipeline import new_headers, labelSubject, subjectSampling, aggregateSubject, emptyResults, _orderedMap
+from setpupil.pipeline import _collectStats
+
+########################################################################################################
+#########################################  Parameter sweep  ############################################
+########################################################################################################
+# Runs the pipeline with several parameter sets (TIME_ROUND_TO, ROLLING, WINDOW_SIZE, AVG_SAME_TIME) in one
+# go: every subject is read, filtered and window labeled once (labelSubject), then binned and aggregated
+# for every parameter set (aggregateSubject). The bins of a bin width and window size, and the text of the
+# input columns of a bin width, are kept for the parameter sets that come after, so e.g. ROLLING on and off
+# share their bins. Every parameter set gets its own output files, tagged with the parameters (e.g.
+# ts_t50_roll1_w100.tsv), with the same rows a run with only those parameters gives.
+# The work is split by subject and, when there are more workers than subjects, by groups of parameter sets
+# (every group labels the subject once).
+########################################################################################################
+
+#Parameters of a parameter set (keyword arguments of processSubject)
+SWEEP_PARAMETERS = ['avgSameTime', 'timeRoundTo', 'rolling', 'windowSize']
+
+
+#Every combination of the given values, as a list of parameter sets (dicts with the SWEEP_PARAMETERS)
+def parameterGrid(timeRoundTo=(50,), rolling=(False,), windowSize=(100,), avgSameTime=(True,)):
+    return [dict(avgSameTime=avg, timeRoundTo=bins, rolling=roll, windowSize=size)
+            for avg, bins, roll, size in itertools.product(avgSameTime, timeRoundTo, rolling, windowSize)]
+
+
+#Tag of a parameter set in the output file names, e.g. t50_roll1_w100 (with _noavg without time bins)
+def configTag(params):
+    tag = 't%s_roll%d_w%s' % (params['timeRoundTo'], int(bool(params['rolling'])), params['windowSize'])
+    if not params['avgSameTime']:
+        tag += '_noavg'
+    return tag
+
+
+#Output path of a parameter set: the tag goes before the extension, e.g. ts.tsv -> ts_t50_roll0_w100.tsv
+def taggedPath(path, tag):
+    stem, extension = os.path.splitext(path)
+    return '%s_%s%s' % (stem, tag, extension)
+
+
+#Runs one subject with several parameter sets: labelSubject once, aggregateSubject for every parameter set
+#The other parameters are the ones of processSubject; the timing records of the shared stages have the file name
+#as subject, the others the file name and the tag of the parameter set
+#Returns (headers of the file, [(time series rows, summary, quality stats) for every parameter set])
+def sweepSubject(path, paramSets, outputColumns, outputFormat='tsv', report=None, store=None, pupilFilter=None,
+                 trialThreshold=None, schedule=None):
+    filename = os.path.basename(path)
+    print('processing file: %s (%d parameter sets)' % (filename, len(paramSets)))
+    timer = instrument.StageTimer(filename, report)
+    file_headers, frame, windows, times, sharedStats = labelSubject(path, paramSets[0]['timeRoundTo'], False,
+                                                                    outputColumns, timer, store, pupilFilter,
+                                                                    trialThreshold, schedule)
+    subject = sharedStats['sampling']['Subject']
+
+    #bins and input texts of the subject that more than one parameter set can use (see aggregateSubject)
+    shared = {}
+    results = []
+    for params in paramSets:
+        #the sampling profile (and 'auto' bins) depends on the bin width of the parameter set
+        qualityStats = dict(sharedStats)
+        qualityStats['sampling'] = subjectSampling(filename, subject, times, params['timeRoundTo'],
+                                                   params['avgSameTime'])
+        if windows is None:
+            block, summary = emptyResults(outputFormat)
+        else:
+            configTimer = instrument.StageTimer('%s [%s]' % (filename, configTag(params)), report)
+            block, summary, stats = aggregateSubject(file_headers, frame, windows, params['avgSameTime'],
+                                                     qualityStats['sampling']['time_round_to'], params['rolling'],
+                                                     params['windowSize'], outputColumns, outputFormat, configTimer,
+                                                     shared, schedule)
+            qualityStats.update(stats)
+        results.append((block, summary, qualityStats))
+    print('DONE!!! (%s)' % filename)
+    return file_headers, results
+
+
+#Worker side of writeSweep: runs one subject with a group of parameter sets
+#item is (path, number of the subject, numbers of the parameter sets); with a partDir the time series rows of
+#every parameter set go to a part file there and the path of the part is returned instead of the rows
+#Returns (headers of the file, [(rows or part path, summary, quality stats)], timing records)
+def _sweepItem(item, paramSets, partDir=None, **params):
+    path, subjectNumber, configNumbers = item
+    report = []
+    file_headers, results = sweepSubject(path, [paramSets[n] for n in configNumbers], report=report, **params)
+    if partDir is not None:
+        for r, (n, (block, summary, stats)) in enumerate(zip(configNumbers, results)):
+            partPath = os.path.join(partDir, '%06d_%04d.tsv' % (subjectNumber, n))
+            writer.writePart(partPath, block)
+            results[r] = (partPath, summary, stats)
+    return file_headers, results, report
+
+
+#Groups of parameter set numbers, one work item per subject and group: as many groups as it takes to give every
+#worker something to do, but a subject is labeled once per group so there are no more groups than needed
+def _configGroups(numConfigs, numSubjects, jobs):
+    numGroups = min(numConfigs, max(1, -(-jobs // max(numSubjects, 1))))
+    return [[int(n) for n in group] for group in np.array_split(np.arange(numConfigs), numGroups)]
+
+
+#Runs every file with every parameter set of paramSets and writes the time series of parameter set n to tsPaths[n]
+#(as the subjects finish, in the order of paths), on jobs worker processes if jobs > 1
+#The other parameters are the ones of writeSubjects (there is no subject cache here)
+#qualityStats is a list that gets a list of the quality stats of every subject for every parameter set
+#grandAverages has a GrandAverage (setpupil/grandaverage.py) for every parameter set that gets its time courses, or None
+#sizes is the work of every file of paths, the largest files go first (see writeSubjects)
+#Returns the summary data frame of every parameter set
+def writeSweep(paths, tsPaths, paramSets, outputColumns, jobs=1, outputFormat='tsv', store=None, report=None,
+               pupilFilter=None, trialThreshold=None, qualityStats=None, schedule=None, grandAverages=None,
+               sizes=None):
+    if report is None:
+        report = []
+    if qualityStats is None:
+        qualityStats = []
+    del qualityStats[:]
+    qualityStats.extend([] for params in paramSets)
+    summaries = [[] for params in paramSets]
+    if grandAverages is None:
+        grandAverages = [None for params in paramSets]
+
+    groups = _configGroups(len(paramSets), len(paths), jobs)
+    items = [(path, s, group) for s, path in enumerate(paths) for group in groups]
+    partDir = None
+    if outputFormat == 'tsv' and jobs > 1 and len(items) > 1:
+        partDir = tempfile.mkdtemp(prefix='.parts-', dir=os.path.dirname(os.path.abspath(tsPaths[0])))
+
+    tsWriters = []
+    try:
+        for tsPath in tsPaths:
+            if outputFormat != 'tsv':
+                tsWriters.append(writer.ColumnarWriter(tsPath, outputFormat))
+            else:
+                tsWriters.append(writer.TimeSeriesWriter(tsPath, outputColumns, new_headers))
+
+        process = functools.partial(_sweepItem, paramSets=paramSets, partDir=partDir, outputColumns=outputColumns,
+                                    outputFormat=outputFormat, store=store, pupilFilter=pupilFilter,
+                                    trialThreshold=trialThreshold, schedule=schedule)
+        itemSizes = None
+        if sizes is not None and partDir is not None:
+            itemSizes = [sizes[s] for path, s, group in items]
+        for (path, s, group), (file_headers, results, records) in zip(items, _orderedMap(process, items, jobs,
+                                                                                          itemSizes)):
+            report.extend(records)
+            for n, (block, summary, stats) in zip(group, results):
+                timer = instrument.StageTimer('%s [%s]' % (os.path.basename(path), configTag(paramSets[n])), report)
+                if outputFormat != 'tsv':
+                    timer.start('write', len(block))
+                    tsWriters[n].writeSubject(block)
+                    timer.stop(len(block))
+                elif partDir is not None:
+                    timer.start('write', None)
+                    tsWriters[n].appendPart(file_headers, block)
+                    timer.stop(None)
+                else:
+                    timer.start('write', len(block))
+                    tsWriters[n].writeSubject(file_headers, block)
+                    timer.stop(len(block))
+                summaries[n].append(summary)
+                _collectStats(stats, qualityStats[n], grandAverages[n])
+    finally:
+        for tsWriter in tsWriters:
+            tsWriter.close()
+        if partDir is not None:
+            shutil.rmtree(partDir, ignore_errors=True)
+
+    return [pd.concat(frames, ignore_index=True) if frames else pd.DataFrame() for frames in summaries]
@@ -0,0 +1,164 @@
+import argparse
+import os
+
+import numpy as np
+
+########################################################################################################
+#########################################  Synthetic SET exports  ######################################
+########################################################################################################
+# Writes made-up subject files with the layout of the real exports (43 columns, or 40 for raw exports, R style quoting, NA for
+# missing data) so the pipeline can be benchmarked and checked without real data. Every trial goes
+# through the objects of the SET window schedule (windows.SET_SCHEDULE):
+#   Fixation 500ms, firstitem/seconditem/thirditems 1500ms each (item + fixation cross),
+#   fourthitem 1500ms + RT (item + fixation cross + response), feedback 500ms
+# The first trials are practice (TrainorExp = Train); some trials lose their remove_trial data
+# (bad trials) and every sample can lose one or both eyes (missingRate).
+########################################################################################################
+
+#Header of the exports, in column order (see setpupil/columns.py)
+HEADERS = [
+    'ID', 'Subject', 'Session', 'TimestampSec', 'TETTime', 'TimestampMicrosec', 'RTTime', 'CursorX', 'CursorY',
+    'XGazePosLeftEye', 'YGazePosLeftEye', 'XCameraPosLeftEye', 'YCameraPosLeftEye', 'ZCameraPosLeftEye',
+    'DiameterPupilLeftEye', 'DistanceLeftEye', 'ValidityLeftEye', 'XGazePosRightEye', 'YGazePosRightEye',
+    'XCameraPosRightEye', 'YCameraPosRightEye', 'DiameterPupilRightEye', 'DistanceRightEye', 'ValidityRightEye',
+    'TrialId', 'Block', 'Procedure', 'ACC', 'RT', 'Category', 'SETornoSET', 'TrainorExp', 'Position_false_shape',
+    'Item1', 'Item2', 'Item3', 'Item4', 'CorrectAnswer', 'Response', 'CurrentObject', 'interp_av_pupil',
+    'filtered_av_pupil', 'remove_trial',
+]
+
+#Columns of a raw export (the rest is added by filter_with_stat_report.R and Removetrialswithtoofewdatapoints.R)
+RAW_COLUMNS = 40
+
+#(CurrentObject, duration in ms) of every trial; the fourth item also lasts the RT of the trial
+TRIAL_OBJECTS = [
+    ('Fixation', 500),
+    ('firstitem', 1500),
+    ('seconditem', 1500),
+    ('thirditems', 1500),
+    ('fourthitem', 1500),
+    ('feedback', 500),
+]
+
+#Validity code of an eye without data (0 is valid)
+INVALID_EYE = 4
+
+
+#Rounds to 6 decimals and writes the shortest text that reads back as the same number (-1, not -1.0, like R)
+def _number(value):
+    text = repr(round(float(value), 6))
+    if text.endswith('.0'):
+        text = text[:-2]
+    return text
+
+
+#Writes one synthetic subject file
+#samplingRate is in Hz; every sample interval is jittered by up to +-jitter (as a fraction of the interval)
+#missingRate is the chance that an eye has no data in a sample, badTrialRate the chance that a trial loses its
+#remove_trial data, practiceTrials the number of Train trials at the start
+#quote writes the text cells in quotes, like R's write.table
+#raw writes the export as it comes from the eye tracker, without the columns the R scripts add (interp_av_pupil,
+#filtered_av_pupil, remove_trial), and with a blink artifact (spike) in some samples (outlierRate)
+#Returns the number of samples written
+def generateSubject(path, subject, samplingRate=60, numTrials=60, missingRate=0.1, quote=True, practiceTrials=2,
+                    badTrialRate=0.1, jitter=0.05, seed=0, raw=False, outlierRate=0.01):
+    rng = np.random.RandomState(seed)
+    interval = 1000.0 / samplingRate
+    if quote:
+        q = lambda text: '"%s"' % text
+    else:
+        q = lambda text: text
+
+    headers = HEADERS[:RAW_COLUMNS] if raw else HEADERS
+    lines = ['\t'.join([q(header) for header in headers])]
+    rowId = 0
+    t = 1000.0 + rng.uniform(0, 10)
+    for trial in range(1, numTrials + 1):
+        trainOrExp = 'Train' if trial <= practiceTrials else 'Exp'
+        acc = rng.choice([0, 1, 1])
+        rt = rng.randint(300, 1500)
+        category = rng.choice(['span1', 'span2', 'span3', 'NA'])
+        setOrNoSet = rng.choice(['SET', 'noSET'])
+        positionFalseShape = rng.choice(['1', '2', '3', '4', 'NA'])
+        badTrial = trainOrExp == 'Exp' and rng.uniform() < badTrialRate
+        baseline = 3.0 + rng.uniform()
+        trialCells = [str(trial), '1', q('TrialProc'), str(acc), str(rt), q(category), q(setOrNoSet), q(trainOrExp),
+                      q(positionFalseShape), q('a'), q('b'), q('c'), q('d'), q('1'), q('1')]
+
+        for obj, duration in TRIAL_OBJECTS:
+            if obj == 'fourthitem':
+                duration += rt
+            numSamples = int(np.ceil(duration / interval))
+            times = t + np.cumsum(np.append(0, interval * (1 + rng.uniform(-jitter, jitter, numSamples - 1))))
+            t = times[-1] + interval
+            validLeft = np.where(rng.uniform(size=numSamples) < missingRate, INVALID_EYE, 0)
+            validRight = np.where(rng.uniform(size=numSamples) < missingRate, INVALID_EYE, 0)
+            #the pupil dilates a little after every item
+            dilation = baseline + 0.2 * np.sin(np.linspace(0, np.pi, numSamples))
+            diamLeft = np.where(validLeft == 0, dilation + rng.normal(0, 0.1, numSamples), -1)
+            diamRight = np.where(validRight == 0, dilation + rng.normal(0, 0.1, numSamples), -1)
+            if raw:
+                spikes = rng.uniform(size=numSamples) < outlierRate
+                diamLeft[spikes & (validLeft == 0)] += 2
+                diamRight[spikes & (validRight == 0)] += 2
+
+            for n in range(numSamples):
+                rowId += 1
+                if validLeft[n] == 0 and validRight[n] == 0:
+                    pupil = _number((round(diamLeft[n], 6) + round(diamRight[n], 6)) / 2)
+                elif validLeft[n] == 0:
+                    pupil = _number(diamLeft[n])
+                elif validRight[n] == 0:
+                    pupil = _number(diamRight[n])
+                else:
+                    pupil = 'NA'
+                removeTrial = 'NA' if badTrial and obj != 'Fixation' else pupil
+                time = times[n]
+                row = [str(rowId), str(subject), '1', str(int(time // 1000)), _number(round(time, 3)),
+                       str(int((time % 1000) * 1000)), '0', '0', '0', '0.5', '0.5', '0.5', '0.5', '600',
+                       _number(diamLeft[n]), '600', str(validLeft[n]), '0.5', '0.5', '0.5', '0.5',
+                       _number(diamRight[n]), '600', str(validRight[n])]
+                row += trialCells
+                row += [q(obj)]
+                if not raw:
+                    row += [pupil, pupil, removeTrial]
+                lines.append('\t'.join(row))
+
+    with open(path, 'w') as tsvfile:
+        tsvfile.write('\n'.join(lines) + '\n')
+    return rowId
+
+
+#Writes numSubjects synthetic subject files (SET-<subject>-1.tsv) to directory, see generateSubject for kwargs
+#Every subject gets its own seed, and every other subject is written without quotes
+#Returns the paths of the files
+def generateCohort(directory, numSubjects, firstSubject=101, **kwargs):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = []
+    for n in range(numSubjects):
+        subject = firstSubject + n
+        path = os.path.join(directory, 'SET-%d-1.tsv' % subject)
+        params = dict(quote=(n % 2 == 0), seed=subject)
+        params.update(kwargs)
+        generateSubject(path, subject, **params)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m setpupil.synthetic', description='Write synthetic SET subject files')
+    parser.add_argument('directory', help='where the files are written')
+    parser.add_argument('--subjects', type=int, default=3, help='number of subject files (default 3)')
+    parser.add_argument('--rate', type=int, default=60, help='sampling rate in Hz (default 60)')
+    parser.add_argument('--trials', type=int, default=60, help='trials per subject (default 60)')
+    parser.add_argument('--missing', type=float, default=0.1, help='chance that an eye has no data (default 0.1)')
+    parser.add_argument('--raw', action='store_true', help='write raw exports (before the R filter scripts)')
+    parser.add_argument('--quote', choices=['yes', 'no', 'mixed'], default='mixed',
+                        help='quote the text cells (default mixed: every other subject)')
+    args = parser.parse_args()
+
+    kwargs = dict(samplingRate=args.rate, numTrials=args.trials, missingRate=args.missing, raw=args.raw)
+    if args.quote != 'mixed':
+        kwargs['quote'] = args.quote == 'yes'
+    for path in generateCohort(args.directory, args.subjects, **kwargs):
+        print(path)
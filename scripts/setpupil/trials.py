@@ -0,0 +1,223 @@
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from setpupil import loader
+from setpupil.columns import colTrialId
+from setpupil.runs import runStarts
+from setpupil.windows import WINDOW_LABELS
+
+########################################################################################################
+#########################################  Trial index  ################################################
+########################################################################################################
+# A trial is a run of rows with the same TrialId, and a window segment a run of rows with the same window
+# within a trial. The index keeps the row range of every trial and of every window segment, so one trial
+# (or one window of it) is a slice of the rows instead of a scan over the whole subject.
+# For export files the index also keeps the byte range of every trial: readTrial then reads a single trial
+# without going through the rest of the file. The index of an export is only stored when the caller gives
+# a directory for it (load_trial uses the column store or cache directory of the run); the data directory
+# is never written to.
+########################################################################################################
+
+#Bytes read at a time when looking for the line starts of an export
+SCAN_CHUNK = 1 << 24
+
+
+#Arrays of a TrialIndex, as they are saved
+INDEX_FIELDS = ['trialIds', 'starts', 'stops', 'segmentStarts', 'segmentStops', 'segmentWindows', 'trialSegments',
+                'byteStarts', 'byteStops']
+
+
+#NA TrialIds count as 0, like everywhere else
+def _trialIds(trialId):
+    return np.nan_to_num(np.asarray(trialId, dtype=np.float64)).astype(np.int64)
+
+
+#Row ranges of the trials of a subject (and of their window segments)
+#   trialIds[n], starts[n], stops[n]:  TrialId and rows [start, stop) of the n-th trial
+#   segmentStarts, segmentStops, segmentWindows:  rows and window code of every window segment
+#   trialSegments[n]:  first segment of trial n, its segments are trialSegments[n]:trialSegments[n + 1]
+#   byteStarts, byteStops:  byte range of every trial in the export file (only for indexExport)
+class TrialIndex(object):
+
+    def __init__(self, trialIds, starts, stops, segmentStarts=None, segmentStops=None, segmentWindows=None,
+                 trialSegments=None, byteStarts=None, byteStops=None):
+        self.trialIds = trialIds
+        self.starts = starts
+        self.stops = stops
+        self.segmentStarts = segmentStarts
+        self.segmentStops = segmentStops
+        self.segmentWindows = segmentWindows
+        self.trialSegments = trialSegments
+        self.byteStarts = byteStarts
+        self.byteStops = byteStops
+
+    def __len__(self):
+        return len(self.trialIds)
+
+    #Positions (n) of the runs of a TrialId; a TrialId normally has one run, more if its rows are not together
+    def positions(self, trialId):
+        found = np.flatnonzero(self.trialIds == trialId)
+        if len(found) == 0:
+            raise KeyError('no trial %r' % (trialId,))
+        return found
+
+    #Rows of a trial: a slice, or an array of row numbers if the trial has more than one run
+    def rows(self, trialId):
+        found = self.positions(trialId)
+        if len(found) == 1:
+            return slice(int(self.starts[found[0]]), int(self.stops[found[0]]))
+        return np.concatenate([np.arange(self.starts[n], self.stops[n]) for n in found])
+
+    #(Window label, rows) of every window segment of a trial, in row order
+    #labels are the labels of the window codes (those of the window schedule the windows came from)
+    def segments(self, trialId, labels=WINDOW_LABELS):
+        if self.segmentStarts is None:
+            raise ValueError('the index was built without windows')
+        segments = []
+        for n in self.positions(trialId):
+            for s in range(self.trialSegments[n], self.trialSegments[n + 1]):
+                segments.append((labels[self.segmentWindows[s]],
+                                 slice(int(self.segmentStarts[s]), int(self.segmentStops[s]))))
+        return segments
+
+    #Position of the trial of every row
+    def trialOfRows(self):
+        return np.repeat(np.arange(len(self)), self.stops - self.starts)
+
+    #Number of the window segment of every row
+    def segmentOfRows(self):
+        return np.repeat(np.arange(len(self.segmentStarts)), self.segmentStops - self.segmentStarts)
+
+    def save(self, path, **extra):
+        arrays = dict(extra)
+        for name in INDEX_FIELDS:
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        with open(path, 'wb') as npzfile:
+            np.savez(npzfile, **arrays)
+
+
+#Reads an index written by TrialIndex.save
+#Returns (index, the other arrays that were saved with it)
+def loadTrialIndex(path):
+    fields = {}
+    extra = {}
+    with np.load(path, allow_pickle=False) as arrays:
+        for name in arrays.files:
+            if name in INDEX_FIELDS:
+                fields[name] = arrays[name]
+            else:
+                extra[name] = arrays[name]
+    return TrialIndex(**fields), extra
+
+
+#Index of the rows of a subject from its TrialId column (and window codes, for the window segments)
+def buildTrialIndex(trialId, windows=None):
+    trialIds = _trialIds(trialId)
+    numRows = len(trialIds)
+    newTrial = runStarts(trialIds) if numRows else np.zeros(0, dtype=bool)
+    starts = np.flatnonzero(newTrial)
+    stops = np.append(starts[1:], numRows).astype(np.int64)
+    if windows is None:
+        return TrialIndex(trialIds[starts], starts, stops)
+
+    windows = np.asarray(windows)
+    newSegment = runStarts(trialIds, windows) if numRows else np.zeros(0, dtype=bool)
+    segmentStarts = np.flatnonzero(newSegment)
+    segmentStops = np.append(segmentStarts[1:], numRows).astype(np.int64)
+    #every trial start is also a segment start
+    trialSegments = np.append(np.searchsorted(segmentStarts, starts), len(segmentStarts))
+    return TrialIndex(trialIds[starts], starts, stops, segmentStarts, segmentStops, windows[segmentStarts],
+                      trialSegments)
+
+
+#Byte offset of the start of every line of a file (plus the size of the file at the end)
+def _lineStarts(path):
+    starts = [np.zeros(1, dtype=np.int64)]
+    offset = 0
+    with open(path, 'rb') as datafile:
+        chunk = datafile.read(SCAN_CHUNK)
+        while chunk:
+            starts.append(np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n')) + offset + 1)
+            offset += len(chunk)
+            chunk = datafile.read(SCAN_CHUNK)
+    starts = np.concatenate(starts)
+    if starts[-1] != offset:
+        #the last line has no line break
+        starts = np.append(starts, offset)
+    return starts
+
+
+#Trial index of an export file with the byte range of every trial
+def indexExport(path):
+    headers = loader.readHeaders(path)
+    trialIds = loader.readExportRows(path, headers, [colTrialId], skiprows=1)[colTrialId]
+    lineStarts = _lineStarts(path)
+    #line 0 is the header, row r is line r + 1
+    if len(lineStarts) - 2 != len(trialIds):
+        raise ValueError('%s: %d lines for %d rows (blank lines or line breaks in cells?)' %
+                         (path, len(lineStarts) - 2, len(trialIds)))
+    index = buildTrialIndex(trialIds)
+    index.byteStarts = lineStarts[index.starts + 1]
+    index.byteStops = lineStarts[index.stops + 1]
+    return index
+
+
+#Where the index of an export file is stored in directory (named after the file, plus a hash of its path to keep
+#files of different directories apart, like the entries of the column store)
+def trialIndexPath(path, directory):
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(directory, '%s-%s.trials.npz' % (os.path.basename(path), digest))
+
+
+#Trial index of an export file
+#With indexDir, the index is read from there if it is there and the file did not change since; otherwise the file
+#is indexed and the index is stored there (if the directory is writable). Without indexDir nothing is stored.
+def exportTrialIndex(path, indexDir=None):
+    if indexDir is None:
+        return indexExport(path)
+
+    stat = os.stat(path)
+    signature = np.array([stat.st_size, stat.st_mtime])
+    indexPath = trialIndexPath(path, indexDir)
+    if os.path.exists(indexPath):
+        try:
+            index, extra = loadTrialIndex(indexPath)
+            if 'signature' in extra and np.array_equal(extra['signature'], signature):
+                return index
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    index = indexExport(path)
+    try:
+        if not os.path.isdir(indexDir):
+            os.makedirs(indexDir)
+        index.save(indexPath, signature=signature)
+    except (IOError, OSError):
+        pass
+    return index
+
+
+#Reads the rows of one trial of an export file (all of its rows, also practice and removed ones)
+#usecols as in loader.readTobiiExport; index is the exportTrialIndex of the file (read from indexDir or built if None)
+#The rows keep their row number in the file as index
+def readTrial(path, trialId, usecols=None, index=None, indexDir=None):
+    if index is None:
+        index = exportTrialIndex(path, indexDir)
+    headers = loader.readHeaders(path)
+
+    parts = []
+    with open(path, 'rb') as datafile:
+        for n in index.positions(trialId):
+            datafile.seek(index.byteStarts[n])
+            part = loader.readExportRows(io.BytesIO(datafile.read(index.byteStops[n] - index.byteStarts[n])),
+                                         headers, usecols)
+            part.index = pd.RangeIndex(index.starts[n], index.stops[n])
+            parts.append(part)
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts)
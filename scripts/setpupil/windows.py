@@ -0,0 +1,195 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+########################################################################################################
+#########################################  Window labeling  ############################################
+########################################################################################################
+# The windows of a trial come from a schedule: for every CurrentObject, the windows its rows go through,
+# by the time since the object started. Each item object (firstitem, seconditem, ...) of SET stays on
+# CurrentObject for the item presentation and for the fixation cross that follows it:
+#   0-1000ms -> item#, 1000-1500ms -> fix#, after that fix# (or response for the fourth item)
+# A schedule is compiled once into one sorted array of (object, start of window) boundaries, and every
+# row is labeled with a searchsorted of (its object, time since its object started) in that array.
+########################################################################################################
+
+#Time (ms) since the object started at which the item ends and the fixation cross ends
+ITEM_END = 1000
+FIX_END = 1500
+
+#Window schedule of SET: CurrentObject (lower case) -> [(ms since the object started, window that starts then)]
+#An object with an item# window is item number #, its fix# window is the fixation cross after the item
+SET_SCHEDULE = {
+    'fixation' : [(0, 'fixation')],
+    'firstitem' : [(0, 'item1'), (ITEM_END, 'fix1')],
+    'seconditem' : [(0, 'item2'), (ITEM_END, 'fix2')],
+    'thirditems' : [(0, 'item3'), (ITEM_END, 'fix3')],
+    'fourthitem' : [(0, 'item4'), (ITEM_END, 'fix4'), (FIX_END, 'response')],
+    'feedback' : [(0, 'feedback')],
+}
+
+#Window name of an item (item#)
+ITEM_WINDOW = re.compile(r'^item(\d+)$')
+
+
+#Compiled window schedule
+#objects is a schedule like SET_SCHEDULE; the metrics (setpupil/metrics.py) also need:
+#   baseline:        object whose rows give the baseline of TEPR (default: the object of item 1)
+#   encodingWindows: windows averaged into TEPR_Fix2Fix3avg and the encoding strategy values
+#   biasWindow:      window of the bias values
+#Window labels are stored as small integer codes (index in labels); code 0 ('') is "not in a window"
+class WindowSchedule(object):
+
+    def __init__(self, objects, baseline=None, encodingWindows=('fix2', 'fix3'), biasWindow='fix3'):
+        self.objects = {}
+        for name, phases in objects.items():
+            phases = [(float(start), label) for start, label in phases]
+            if not phases or phases[0][0] != 0:
+                raise ValueError('the first window of %r has to start at 0' % name)
+            if any(later[0] <= earlier[0] for earlier, later in zip(phases, phases[1:])):
+                raise ValueError('the windows of %r have to start in order' % name)
+            if any(not label for start, label in phases):
+                raise ValueError('the windows of %r need a name' % name)
+            self.objects[str(name).lower()] = phases
+
+        self.labels = [''] + sorted(set(label for phases in self.objects.values() for start, label in phases))
+        if len(self.labels) > np.iinfo(np.int8).max:
+            raise ValueError('too many windows (%d)' % len(self.labels))
+        self.code = dict((label, code) for code, label in enumerate(self.labels))
+
+        #item number of every object (0 if it has no item# window)
+        self.itemNumbers = {}
+        for name, phases in self.objects.items():
+            numbers = [int(ITEM_WINDOW.match(label).group(1)) for start, label in phases if ITEM_WINDOW.match(label)]
+            self.itemNumbers[name] = numbers[0] if numbers else 0
+        items = sorted(set(n for n in self.itemNumbers.values() if n > 0))
+        self.fixWindows = ['fix%d' % n for n in items if 'fix%d' % n in self.code]
+        self.fixCodes = [self.code[label] for label in self.fixWindows]
+
+        if baseline is None:
+            firstItems = [name for name in sorted(self.itemNumbers) if self.itemNumbers[name] == 1]
+            baseline = firstItems[0] if firstItems else None
+        self.baseline = baseline
+        self.encodingWindows = list(encodingWindows)
+        self.biasWindow = biasWindow
+
+        #the objects are numbered in name order; every window after the first of an object is a boundary
+        #(object number + 1j * start), so a sorted complex array orders them by object and then by start
+        self.names = sorted(self.objects)
+        boundaries = []
+        self.phaseCodes = []
+        self.firstPhase = []
+        self.firstBoundary = []
+        for number, name in enumerate(self.names):
+            self.firstPhase.append(len(self.phaseCodes))
+            self.firstBoundary.append(len(boundaries))
+            for n, (start, label) in enumerate(self.objects[name]):
+                self.phaseCodes.append(self.code[label])
+                if n > 0:
+                    boundaries.append(complex(number, start))
+        self.boundaries = np.array(boundaries, dtype=np.complex128)
+        self.phaseCodes = np.array(self.phaseCodes, dtype=np.int8)
+        self.firstPhase = np.array(self.firstPhase, dtype=np.int64)
+        self.firstBoundary = np.array(self.firstBoundary, dtype=np.int64)
+
+    #Text that changes with anything that changes the windows (used in the cache key)
+    def __repr__(self):
+        return 'WindowSchedule(%r, baseline=%r, encodingWindows=%r, biasWindow=%r)' % (
+            sorted(self.objects.items()), self.baseline, self.encodingWindows, self.biasWindow)
+
+    #Number of the object of every name (CurrentObject, any case), -1 for names that are not in the schedule
+    def objectNumbers(self, names):
+        numbers = dict((name, number) for number, name in enumerate(self.names))
+        return np.array([numbers.get(str(name).lower(), -1) for name in names], dtype=np.int64)
+
+    #Window code of rows of the objects (numbers from objectNumbers, not -1) elapsed ms after their object started
+    def label(self, objects, elapsed):
+        keys = np.empty(len(objects), dtype=np.complex128)
+        keys.real = objects
+        keys.imag = elapsed
+        phase = np.searchsorted(self.boundaries, keys, side='right') - self.firstBoundary[objects]
+        return self.phaseCodes[self.firstPhase[objects] + phase]
+
+
+#Schedule used when none is given
+DEFAULT_SCHEDULE = WindowSchedule(SET_SCHEDULE)
+
+#Labels and codes of the default schedule
+WINDOW_LABELS = DEFAULT_SCHEDULE.labels
+WINDOW_CODE = DEFAULT_SCHEDULE.code
+EMPTY_WINDOW = WINDOW_CODE['']
+
+
+#Window schedule of a JSON file: either the objects (like SET_SCHEDULE, with [start, window] lists) or
+#{"objects": ..., "baseline": ..., "encodingWindows": [...], "biasWindow": ...} (see WindowSchedule)
+def loadSchedule(path):
+    with open(path, 'r') as jsonfile:
+        spec = json.load(jsonfile)
+    if 'objects' not in spec:
+        spec = {'objects': spec}
+    return makeSchedule(spec)
+
+
+#WindowSchedule of a schedule spec: a WindowSchedule, the objects of one (like SET_SCHEDULE) or a dict with the
+#objects and the other parameters of WindowSchedule; the default schedule if None
+def makeSchedule(spec):
+    if spec is None:
+        return DEFAULT_SCHEDULE
+    if isinstance(spec, WindowSchedule):
+        return spec
+    if 'objects' in spec and isinstance(spec['objects'], dict):
+        params = dict(spec)
+        return WindowSchedule(params.pop('objects'), **params)
+    return WindowSchedule(spec)
+
+
+#Labels of window codes, as an array of strings (labels of the schedule, the default one if None)
+def windowLabels(codes, schedule=None):
+    labels = (schedule or DEFAULT_SCHEDULE).labels
+    return np.array(labels, dtype=object)[np.asarray(codes, dtype=np.int64)]
+
+
+#Start time of every mapped row's CurrentObject segment
+#A segment starts whenever TrialId or CurrentObject changes between mapped rows; if the same object shows up
+#twice in a trial, every row of that object uses the start of the last segment (same as the old timeMap)
+def _segmentStarts(trialIds, codes, times):
+    change = np.ones(len(codes), dtype=bool)
+    change[1:] = (codes[1:] != codes[:-1]) | (trialIds[1:] != trialIds[:-1])
+    segmentOfRow = np.cumsum(change) - 1
+    segmentStart = times[change]
+
+    keys = pd.MultiIndex.from_arrays([trialIds[change], codes[change]])
+    keyOfSegment, uniqueKeys = pd.factorize(keys)
+    lastSegment = np.full(len(uniqueKeys), -1, dtype=np.int64)
+    np.maximum.at(lastSegment, keyOfSegment, np.arange(len(keyOfSegment)))
+
+    return segmentStart[lastSegment[keyOfSegment[segmentOfRow]]]
+
+
+#Defines the new names of the stimuli seen by subjects (e.g. first item, first fixation, etc)
+#currentObject, trialId and time are the CurrentObject, TrialId and TETTime columns of the (experiment) rows
+#schedule is a WindowSchedule, the one of SET if None
+#Returns the window code of every row (EMPTY_WINDOW for rows whose CurrentObject is not in the schedule), see
+#the labels of the schedule and windowLabels for the names
+def calcWindowNames(currentObject, trialId, time, schedule=None):
+    schedule = schedule or DEFAULT_SCHEDULE
+    objects = pd.Categorical(currentObject)
+    codes = np.asarray(objects.codes, dtype=np.int64)
+    #missing CurrentObject (code -1) is never in the schedule
+    objectOfCode = np.append(schedule.objectNumbers(objects.categories), -1)
+
+    #NA TrialId/TETTime count as 0, like str2int/str2float did
+    trialIds = np.nan_to_num(np.asarray(trialId, dtype=np.float64)).astype(np.int64)
+    times = np.nan_to_num(np.asarray(time, dtype=np.float64))
+
+    windows = np.full(len(codes), EMPTY_WINDOW, dtype=np.int8)
+    mapped = np.flatnonzero(objectOfCode[codes] >= 0)
+    if len(mapped) == 0:
+        return windows
+
+    mappedCodes = codes[mapped]
+    elapsed = times[mapped] - _segmentStarts(trialIds[mapped], mappedCodes, times[mapped])
+    windows[mapped] = schedule.label(objectOfCode[mappedCodes], elapsed)
+    return windows
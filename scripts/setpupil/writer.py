@@ -0,0 +1,296 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from setpupil.loader import isText
+
+########################################################################################################
+#########################################  Time series output  ##########################################
+########################################################################################################
+# The time series file is written while the cohort is processed: every subject's rows are flushed to
+# disk as soon as the subject is done, so a crash only loses the subjects that were still running.
+# In parallel mode the workers write their rows to part files and the parts are appended in order.
+########################################################################################################
+
+#Rows joined into one write() call
+BUFFER_LINES = 10000
+
+
+#Header line of the time series: the input columns we keep (settings.columns) plus the new columns
+def outputHeaders(file_headers, outputColumns, new_headers):
+    headers = []
+    cnt = 0
+    for header in file_headers:
+        if cnt in outputColumns:
+            headers.append(header)
+        cnt += 1
+    return headers + new_headers
+
+
+#Writes lines to a file, BUFFER_LINES at a time
+def _writeLines(tsvfile, lines):
+    for start in range(0, len(lines), BUFFER_LINES):
+        tsvfile.write('%s\n' % '\n'.join(lines[start:start + BUFFER_LINES]))
+
+
+#Writes the time series rows of one subject to a part file (used by the worker processes)
+def writePart(partPath, lines):
+    with open(partPath, 'w') as partfile:
+        _writeLines(partfile, lines)
+
+
+#Writes the time series file subject by subject
+#The header line comes from the first subject, like it always did
+class TimeSeriesWriter(object):
+
+    def __init__(self, path, outputColumns, new_headers):
+        self.path = path
+        self.outputColumns = outputColumns
+        self.new_headers = new_headers
+        self.headersWritten = False
+        self.tsvfile = open(path, 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _writeHeaders(self, file_headers):
+        if not self.headersWritten:
+            self.tsvfile.write('%s\n' % "\t".join(outputHeaders(file_headers, self.outputColumns, self.new_headers)))
+            self.headersWritten = True
+
+    #Appends the rows of the next subject and flushes them to disk
+    def writeSubject(self, file_headers, lines):
+        self._writeHeaders(file_headers)
+        _writeLines(self.tsvfile, lines)
+        self.tsvfile.flush()
+
+    #Appends the part file of the next subject (see writePart) and removes it
+    def appendPart(self, file_headers, partPath):
+        self._writeHeaders(file_headers)
+        with open(partPath, 'r') as partfile:
+            shutil.copyfileobj(partfile, self.tsvfile)
+        self.tsvfile.flush()
+        os.remove(partPath)
+
+    def close(self):
+        if self.tsvfile is None:
+            return
+        self._writeHeaders([])
+        self.tsvfile.close()
+        self.tsvfile = None
+
+
+########################################################################################################
+#########################################  Columnar output  ############################################
+########################################################################################################
+# Instead of the big TSV, the time series and the summary can be written as typed columns:
+#   parquet: one row group per subject (needs pyarrow); readers can load only the columns they need
+#   npz:     NumPy arrays, one per column (categoricals as codes + '<column>.categories', text as strings
+#            with '' for missing cells); np.load only reads the arrays that are asked for. Used when pyarrow is not installed.
+#            Every subject goes to a part file in a temporary directory next to the output, and the parts are
+#            copied into the npz file column by column when the writer is closed: only one subject's column is in
+#            memory at a time, but the parts take as much disk as the npz file until then.
+# 'columnar' picks parquet when pyarrow is available and npz otherwise.
+########################################################################################################
+
+COLUMNAR_FORMATS = ['parquet', 'npz', 'columnar']
+
+#Summary columns that hold text, the rest are numbers ('NA' becomes NaN)
+SUMMARY_TEXT_COLUMNS = ['Subject', 'Category', 'SETornoSET', 'Position_false_shape']
+
+
+def _hasPyarrow():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+#Turns 'columnar' into the format that will actually be written
+def resolveFormat(outputFormat):
+    if outputFormat == 'columnar':
+        return 'parquet' if _hasPyarrow() else 'npz'
+    if outputFormat == 'parquet' and not _hasPyarrow():
+        raise ImportError('writing parquet files needs pyarrow (use npz or columnar instead)')
+    return outputFormat
+
+
+#Output path for a columnar format: the extension of path is replaced by the format (e.g. .tsv -> .parquet)
+def columnarPath(path, outputFormat):
+    return os.path.splitext(path)[0] + '.' + resolveFormat(outputFormat)
+
+
+#Summary data frame with typed columns: text columns as categoricals, everything else numeric
+def typedSummary(dfSUMMARY):
+    typed = pd.DataFrame(index=dfSUMMARY.index)
+    for name in dfSUMMARY.columns:
+        if name in SUMMARY_TEXT_COLUMNS:
+            typed[name] = dfSUMMARY[name].astype(str).astype('category')
+        else:
+            typed[name] = pd.to_numeric(dfSUMMARY[name], errors='coerce')
+    return typed
+
+
+#Arrow schema of a block: categoricals become dictionary columns with int32 codes so every subject matches
+def _arrowSchema(block):
+    import pyarrow as pa
+    fields = []
+    for name in block.columns:
+        if isinstance(block[name].dtype, pd.CategoricalDtype):
+            fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+        elif isText(block[name]):
+            fields.append(pa.field(name, pa.string()))
+        else:
+            fields.append(pa.field(name, pa.from_numpy_dtype(block[name].dtype)))
+    return pa.schema(fields)
+
+
+#Array of a text column as it is stored in npz files ('' for missing cells)
+def _npzText(values):
+    return np.asarray(values.fillna(''), dtype=np.str_)
+
+
+#Writes one array as a .npy member of an open npz (zip) file, the way np.savez does
+def _writeNpzMember(npzfile, name, array):
+    with npzfile.open(name + '.npy', 'w', force_zip64=True) as member:
+        np.lib.format.write_array(member, array, allow_pickle=False)
+
+
+#Writes one data frame (e.g. the summary) in a columnar format
+def writeColumnar(path, frame, outputFormat):
+    with ColumnarWriter(path, outputFormat) as columnarWriter:
+        columnarWriter.writeSubject(frame)
+
+
+#Reads a parquet or npz file written here; columns limits the read to those columns
+def readColumnar(path, columns=None):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+
+    with np.load(path, allow_pickle=False) as arrays:
+        names = list(arrays['__columns__']) if columns is None else columns
+        frame = pd.DataFrame()
+        for name in names:
+            if name + '.categories' in arrays.files:
+                frame[name] = pd.Categorical.from_codes(arrays[name], arrays[name + '.categories'])
+            else:
+                frame[name] = arrays[name]
+    return frame
+
+
+#Writes the typed time series subject by subject
+#parquet files get a row group per subject as they come in; npz subjects go to part files that make up the npz file
+#when the writer is closed (see the section header)
+class ColumnarWriter(object):
+
+    def __init__(self, path, outputFormat):
+        self.path = path
+        self.outputFormat = resolveFormat(outputFormat)
+        self.schema = None
+        self.parquetWriter = None
+        self.partDir = None
+        self.parts = []
+        self.columns = None
+        #npz: per column, the dtype of the concatenated subjects and (categoricals) category -> code
+        self.dtypes = []
+        self.categories = []
+        self.rows = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #Appends the rows of the next subject (subjects without rows are skipped)
+    def writeSubject(self, block):
+        if len(block) == 0:
+            return
+
+        if self.outputFormat == 'npz':
+            self._writePart(block)
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self.parquetWriter is None:
+            self.schema = _arrowSchema(block)
+            self.parquetWriter = pq.ParquetWriter(self.path, self.schema)
+        self.parquetWriter.write_table(pa.Table.from_pandas(block, schema=self.schema, preserve_index=False))
+
+    #Saves the columns of a subject to the next part file
+    #The codes of the categoricals are turned into codes of the categories of all the subjects so far
+    def _writePart(self, block):
+        if self.partDir is None:
+            self.partDir = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(os.path.abspath(self.path)))
+            self.columns = [str(name) for name in block.columns]
+            self.dtypes = [None] * len(self.columns)
+            self.categories = [{} if isinstance(block[name].dtype, pd.CategoricalDtype) else None
+                               for name in block.columns]
+
+        arrays = {}
+        for i, name in enumerate(block.columns):
+            values = block[name]
+            if self.categories[i] is not None:
+                known = self.categories[i]
+                lookup = np.array([known.setdefault(c, len(known)) for c in values.cat.categories] + [-1],
+                                  dtype=np.int32)
+                array = lookup[np.asarray(values.cat.codes)]
+            elif isText(values):
+                array = _npzText(values)
+            else:
+                array = np.asarray(values)
+            self.dtypes[i] = array.dtype if self.dtypes[i] is None else np.result_type(self.dtypes[i], array.dtype)
+            arrays[str(i)] = array
+
+        partPath = os.path.join(self.partDir, '%d.npz' % len(self.parts))
+        with zipfile.ZipFile(partPath, 'w', allowZip64=True) as partfile:
+            for key, array in arrays.items():
+                _writeNpzMember(partfile, key, array)
+        self.parts.append(partPath)
+        self.rows += len(block)
+
+    #Writes the npz file from the part files, one column at a time, and removes the parts
+    def _writeNpz(self):
+        columns = self.columns if self.columns is not None else []
+        try:
+            with zipfile.ZipFile(self.path, 'w', allowZip64=True) as npzfile:
+                _writeNpzMember(npzfile, '__columns__', np.array(columns, dtype=np.str_))
+                for i, name in enumerate(columns):
+                    header = {'descr' : np.lib.format.dtype_to_descr(self.dtypes[i]), 'fortran_order' : False,
+                              'shape' : (self.rows,)}
+                    with npzfile.open(name + '.npy', 'w', force_zip64=True) as member:
+                        np.lib.format.write_array_header_1_0(member, header)
+                        for partPath in self.parts:
+                            with np.load(partPath, allow_pickle=False) as part:
+                                member.write(part[str(i)].astype(self.dtypes[i], copy=False).tobytes())
+                    if self.categories[i] is not None:
+                        _writeNpzMember(npzfile, name + '.categories',
+                                        np.array([str(c) for c in self.categories[i]], dtype=np.str_))
+        finally:
+            if self.partDir is not None:
+                shutil.rmtree(self.partDir, ignore_errors=True)
+                self.partDir = None
+            self.parts = []
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.outputFormat == 'npz':
+            self._writeNpz()
+        elif self.parquetWriter is not None:
+            self.parquetWriter.close()
+            self.parquetWriter = None
+        else:
+            #nothing was written, still leave an (empty) file behind
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table({}), self.path)